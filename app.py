@@ -1,11 +1,14 @@
 import datetime
 import thingy.engine
-import lxml.objectify
-from mako.template import Template
+import thingy.snapshot
+import thingy.log
+from thingy import metrics
 from thingy.collections import Date
+from thingy.edgar.store import FactStore, FACT_STORE_PATH
+from thingy.view import load_template
 
 import logging
-logging.basicConfig(level=logging.DEBUG)
+thingy.log.configure(logging.INFO)
 
 reports = (
     ('CDEV', 'MTDR', 'QEP', 'SM', 'NR', 'XOM', 'CVX', 'GEL', 'FET', 'CPE'),
@@ -26,13 +29,28 @@ dates = {
 #     'annual': [Date(2020, 0), Date(2019, 0)]
 # }
 
+snapshot = thingy.snapshot.load()
+logic = snapshot.logic
+providers = snapshot.providers()
+template_engine = load_template('thingy/templates/template.html.mako')
+fact_store = FactStore(FACT_STORE_PATH)
+catalog = snapshot.catalog(fact_store)
+
 for symbols in reports:
-    with open('thingy/engine.xml') as f:
-        engine = thingy.engine.Engine(
-            symbols=symbols,
-            logic=lxml.objectify.fromstring(f.read()),
-            template_engine=Template(filename='thingy/templates/template.html.mako')
-        )
-
-    engine.execute(dates).write(
-        f'/home/pnaudus/Downloads/{datetime.date.today()} - Comparative analysis of {"-".join(engine.symbols)}.html')
+    engine = thingy.engine.Engine(
+        symbols=symbols,
+        logic=logic,
+        template_engine=template_engine,
+        providers=providers,
+        fact_store=fact_store,
+        machine=snapshot.machine,
+        catalog=catalog
+    )
+
+    target = f'/home/pnaudus/Downloads/{datetime.date.today()} - Comparative analysis of {"-".join(engine.symbols)}'
+    engine.execute(dates).write(f'{target}.html')
+    engine.export(target)
+
+    if metrics.METRICS.enabled:
+        metrics.METRICS.dump(target)
+        metrics.METRICS.reset()
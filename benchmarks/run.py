@@ -0,0 +1,196 @@
+'''
+Microbenchmark suite
+
+Times the hot paths of a run against synthetic submissions (see
+benchmarks.synthetic), so no network access is needed:
+
+    python -m benchmarks.run --size medium
+    python -m benchmarks.run --compare benchmarks/results/<commit>-small.json
+
+Results (best/mean wall time, throughput, peak traced memory and memory
+retained by the result, e.g. per parsed statement) are saved as
+JSON, by default to benchmarks/results/<commit>-<size>.json, so runs for different
+commits can be compared and regressions caught.
+'''
+from __future__ import annotations
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import datetime
+import tracemalloc
+import tempfile
+import subprocess
+import lxml.objectify
+from typing import Callable
+from benchmarks.synthetic import SubmissionSpec, generate_submission, generate_statement
+from thingy.collections import Date, FallThruDict, Report
+from thingy.edgar.dtd import DTD
+from thingy.edgar.filing import Filing
+from thingy.edgar.financials import get_financial_report
+from thingy.edgar.sgml import Sgml
+from thingy.engine import Engine
+from thingy.providers import ProviderRegistry
+from thingy.tests.doubles import SyntheticProvider
+from thingy import snapshot
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+LOGIC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'thingy', 'engine.xml')
+
+SIZES = {
+    'small': dict(rows=40, documents=20, document_size=20_000),
+    'medium': dict(rows=200, documents=100, document_size=50_000),
+    'large': dict(rows=1000, documents=300, document_size=100_000),
+}
+
+
+def measure(name: str, func: Callable, repeat: int, work: float = None, unit: str = None) -> dict:
+    '''
+    Time func() repeat times, then run it once more under tracemalloc to
+    record peak memory and the memory retained by its return value. work is the amount of work done per call (e.g. bytes)
+    and is used to report throughput in unit/s.
+    '''
+    func()  # warm up
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    output = func()
+    gc.collect()  # parse trees are full of reference cycles
+    # memory still held by the output, e.g. the size of a parsed statement
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del output
+
+    result = {'name': name,
+              'repeat': repeat,
+              'best': min(timings),
+              'mean': sum(timings) / len(timings),
+              'peak_memory': peak,
+              'retained_memory': retained}
+    if work is not None:
+        result['throughput'] = {'value': work / min(timings), 'unit': f'{unit}/s'}
+
+    print(f'{name:<32} best {result["best"] * 1000:10.2f} ms   '
+          f'mean {result["mean"] * 1000:10.2f} ms   peak {peak / 2**20:8.2f} MiB   '
+          f'retained {retained / 2**10:9.1f} KiB'
+          + (f'   {result["throughput"]["value"]:,.0f} {unit}/s' if work is not None else ''))
+    return result
+
+
+def run(size: str, repeat: int) -> list[dict]:
+    spec = SubmissionSpec(**SIZES[size])
+    submission = generate_submission(spec)
+    filing = Filing('synthetic', company='SYN', text=submission)
+    title, concepts = spec.statements['R2.htm']
+    statement = generate_statement(title, concepts, spec, random.Random(spec.seed))
+    report = Report.new(filing, 'quarterly')
+
+    with open(LOGIC_PATH) as f:
+        logic = lxml.objectify.fromstring(f.read())
+    queries = [[line.strip() for line in str(query).split('\n')]
+               for fact in logic.facts.fact
+               if hasattr(fact, 'query')
+               for query in fact.query
+               if query.get('mode') == 'select']
+
+    def lookups():
+        for source in (report.balance_sheet, report.cash_flow, report.income_statements):
+            for payload in queries:
+                source.get_all(*payload)
+
+    def engine_cell():
+        Engine(symbols=['SYN'], logic=logic, template_engine=None,
+               providers=ProviderRegistry([SyntheticProvider(submission, spec.accession)])
+               ).execute({'quarterly': [Date(2020, 3)]})
+
+    def cold_import():
+        # A fresh interpreter, as every worker process pays for it
+        subprocess.run([sys.executable, '-c', 'import thingy.engine'], cwd=ROOT_PATH, check=True)
+
+    snapshot_path = os.path.join(tempfile.mkdtemp(), 'snapshot.pickle')
+    snapshot.save(snapshot.build(), snapshot_path)
+
+    return [
+        measure('startup.import', cold_import, repeat),
+        measure('startup.snapshot.build', snapshot.build, repeat),
+        measure('startup.snapshot.load', lambda: snapshot.load(snapshot_path), repeat),
+        measure('sgml.parse', lambda: Sgml(submission, DTD()), repeat,
+                len(submission), 'bytes'),
+        measure('filing.init', lambda: Filing('synthetic', company='SYN', text=submission), repeat,
+                len(submission), 'bytes'),
+        measure('financials.get_financial_report',
+                lambda: get_financial_report('SYN', datetime.datetime.now(), statement), repeat,
+                spec.rows, 'rows'),
+        measure('fallthrudict.new',
+                lambda: FallThruDict(filing.get_balance_sheets().reports[0], 'quarterly'), repeat,
+                spec.rows, 'rows'),
+        measure('fallthrudict.get_all', lookups, repeat,
+                3 * len(queries), 'queries'),
+        measure('engine.cell', engine_cell, repeat, 1, 'cells'),
+    ]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> bool:
+    '''Print the change against a previous run; returns False on regression'''
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+
+    ok = True
+    for result in results:
+        if (previous := baseline.get(result['name'])) is None:
+            continue
+        change = result['best'] / previous['best'] - 1
+        regression = change > threshold
+        ok &= not regression
+        print(f'{result["name"]:<32} {change:+8.1%}{"  REGRESSION" if regression else ""}')
+    return ok
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='where to save results (default: benchmarks/results/<commit>-<size>.json)')
+    parser.add_argument('--compare', metavar='RESULTS', help='previous results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown (fraction of best time) flagged as a regression')
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    results = run(args.size, args.repeat)
+
+    output = args.output or os.path.join(RESULTS_PATH, f'{revision}-{args.size}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'revision': revision,
+                   'size': args.size,
+                   'timestamp': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'results': results}, f, indent=2)
+    print(f'Results saved to {output}')
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
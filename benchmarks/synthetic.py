@@ -0,0 +1,191 @@
+'''
+Generator for synthetic, but structurally realistic, EDGAR submissions.
+
+A submission is the full .txt file served from the EDGAR archives: an SGML
+header followed by one <DOCUMENT> block per file in the filing. Generated
+submissions contain a FilingSummary.xml and R-file statement tables laid out
+the way the SEC renders them (title cell with unit header, period headers with
+colspans, date headers and pl/nump/text cells), so they go through exactly the
+same code paths as real filings.
+'''
+from __future__ import annotations
+import random
+import datetime
+from dataclasses import dataclass, field
+
+
+# Concepts queried by engine.xml, so a synthetic filing can drive a full engine
+# cell. Each entry is (xbrl element, label).
+BALANCE_SHEET_CONCEPTS = [
+    ('us-gaap_Cash', 'Cash'),
+    ('us-gaap_AssetsCurrent', 'Total current assets'),
+    ('us-gaap_Assets', 'Total assets'),
+    ('us-gaap_LiabilitiesCurrent', 'Total current liabilities'),
+    ('us-gaap_LongTermDebt', 'Long-term debt'),
+    ('us-gaap_LiabilitiesNoncurrent', 'Total non-current liabilities'),
+    ('us-gaap_Liabilities', 'Total liabilities'),
+    ('us-gaap_RetainedEarningsAccumulatedDeficit', 'Retained earnings'),
+]
+INCOME_STATEMENT_CONCEPTS = [
+    ('us-gaap_Revenues', 'Total revenues'),
+    ('us-gaap_OperatingExpenses', 'Total operating expenses'),
+    ('us-gaap_OperatingIncomeLoss', 'Operating income'),
+    ('us-gaap_InterestExpense', 'Interest expense'),
+    ('us-gaap_NetIncomeLoss', 'Net income'),
+    ('us-gaap_EarningsPerShareDiluted', 'Diluted (in dollars per share)'),
+]
+CASH_FLOW_CONCEPTS = [
+    ('us-gaap_NetIncomeLoss', 'Net income'),
+    ('us-gaap_DepreciationDepletionAndAmortization', 'Depreciation, depletion and amortization'),
+    ('us-gaap_NetCashProvidedByUsedInOperatingActivities', 'Net cash provided by operating activities'),
+]
+
+UNIT_HEADERS = ('$ in Thousands', 'shares in Thousands, $ in Millions', '$ in Millions')
+
+
+@dataclass
+class SubmissionSpec:
+    '''
+    Knobs controlling the size and shape of a generated submission
+
+    :param rows: number of line items per statement (padded with filler rows)
+    :param documents: number of extra exhibit/R-file documents to include
+    :param document_size: approximate size in bytes of each extra document
+    :param years: number of comparative years shown by the income and cash
+        flow statements (each adds a column to the "3 Months Ended" and
+        "N Months Ended" column groups)
+    '''
+    accession: str = '0000000001-20-000001'
+    company: str = 'SYNTHETIC CORP'
+    period_end: datetime.date = datetime.date(2020, 6, 30)
+    form: str = '10-Q'
+    rows: int = 40
+    documents: int = 20
+    document_size: int = 20_000
+    years: int = 2
+    seed: int = 0
+    statements: dict = field(default_factory=lambda: {
+        'R2.htm': ('Condensed Consolidated Balance Sheets', BALANCE_SHEET_CONCEPTS),
+        'R4.htm': ('Condensed Consolidated Statements of Operations', INCOME_STATEMENT_CONCEPTS),
+        'R7.htm': ('Condensed Consolidated Statements of Cash Flows', CASH_FLOW_CONCEPTS),
+    })
+
+
+def _format_date(date: datetime.date) -> str:
+    # EDGAR always abbreviates with a trailing period, e.g. "Jun. 30, 2020"
+    return f'{date:%b}. {date.day:02d}, {date.year}'
+
+
+def _quarter_end(date: datetime.date, quarters_back: int) -> datetime.date:
+    month = date.month - 3 * quarters_back
+    year = date.year + (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return next_month - datetime.timedelta(days=1)
+
+
+def _format_value(value: float) -> str:
+    text = f'{abs(value):,.0f}'
+    return f'$ ({text})' if value < 0 else f'$ {text}'
+
+
+def _row(element: str, label: str, values: list) -> str:
+    cells = ''.join(
+        f'<td class="nump">{_format_value(value)}<span></span></td>' if value is not None
+        else '<td class="text">&#160;<span></span></td>'
+        for value in values)
+    return (f'<tr class="re"><td class="pl" style="border-bottom: 0px;" valign="top">'
+            f'<a class="a" href="javascript:void(0);" '
+            f'onclick="top.Show.showAR( this, \'defref_{element}\', window );">{label}</a></td>'
+            f'{cells}</tr>\n')
+
+
+def generate_statement(title: str, concepts: list, spec: SubmissionSpec, rng: random.Random) -> str:
+    '''
+    Returns the html of an R-file statement table. Balance sheets get one
+    date column per period; other statements get "3 Months Ended" and
+    "N Months Ended" column groups spanning the current and prior year.
+    '''
+    unit_text = rng.choice(UNIT_HEADERS)
+    snapshot = 'balance sheet' in title.lower()
+    title_cell = (f'<th class="tl" colspan="1" rowspan="{1 if snapshot else 2}">'
+                  f'<div style="width: 200px;"><strong>{title} - USD ($)<br/>{unit_text}</strong></div></th>')
+
+    if snapshot:
+        # current period and prior fiscal year end
+        dates = [spec.period_end, datetime.date(spec.period_end.year - 1, 12, 31)]
+        header = '<tr>' + title_cell + ''.join(
+            f'<th class="th"><div>{_format_date(date)}</div></th>' for date in dates) + '</tr>\n'
+    else:
+        year_to_date = 3 * (((spec.period_end.month - 1) % 12) // 3 + 1)
+        groups = [3] + ([year_to_date] if year_to_date != 3 else [])
+        dates = [_quarter_end(spec.period_end, 4 * n) for n in range(spec.years)]
+        header = ('<tr>' + title_cell + ''.join(
+            f'<th class="th" colspan="{len(dates)}">{months} Months Ended</th>' for months in groups)
+            + '</tr>\n<tr>' + ''.join(
+            f'<th class="th"><div>{_format_date(date)}</div></th>' for months in groups for date in dates)
+            + '</tr>\n')
+        dates = dates * len(groups)
+
+    rows = [_row('us-gaap_StatementLineItemsAbstract', title.upper(), [None] * len(dates))]
+    for element, label in concepts:
+        rows.append(_row(element, label, [rng.uniform(1e3, 1e6) for _ in dates]))
+    for n in range(max(0, spec.rows - len(concepts))):
+        values = [rng.uniform(-1e5, 1e6) if rng.random() > 0.05 else None for _ in dates]
+        rows.append(_row(f'syn_FillerLineItem{n}', f'Filler line item {n}', values))
+
+    return ('<html><head><title></title></head><body>\n'
+            '<span style="display: none;">v3.20.2</span>\n'
+            '<table class="report" border="0" cellspacing="2" id="idm1">\n'
+            + header + ''.join(rows) +
+            '</table>\n</body></html>')
+
+
+def generate_filing_summary(spec: SubmissionSpec) -> str:
+    reports = ''.join(
+        f'<Report instance="syn-20200630.htm"><IsDefault>false</IsDefault>'
+        f'<HtmlFileName>{filename}</HtmlFileName><LongName>{title}</LongName>'
+        f'<ShortName>{title}</ShortName><MenuCategory>Statements</MenuCategory></Report>\n'
+        for filename, (title, concepts) in spec.statements.items())
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<FilingSummary><Version>3.20.2</Version><ReportFormat>Html</ReportFormat>\n'
+            f'<MyReports>\n{reports}</MyReports></FilingSummary>')
+
+
+def _document(sequence: int, doc_type: str, filename: str, description: str, text: str) -> str:
+    return (f'<DOCUMENT>\n<TYPE>{doc_type}\n<SEQUENCE>{sequence}\n<FILENAME>{filename}\n'
+            f'<DESCRIPTION>{description}\n<TEXT>\n{text}\n</TEXT>\n</DOCUMENT>\n')
+
+
+def generate_submission(spec: SubmissionSpec = None) -> str:
+    '''
+    Returns the full text of a synthetic EDGAR submission
+    '''
+    spec = spec or SubmissionSpec()
+    rng = random.Random(spec.seed)
+    filed = spec.period_end + datetime.timedelta(days=40)
+
+    documents = [_document(1, spec.form, 'syn-20200630.htm', spec.form,
+                           '<html><body>' + 'Lorem ipsum dolor sit amet. ' * 200 + '</body></html>')]
+    for filename, (title, concepts) in spec.statements.items():
+        documents.append(_document(len(documents) + 1, 'XML', filename, 'IDEA: XBRL DOCUMENT',
+                                   generate_statement(title, concepts, spec, rng)))
+    for n in range(spec.documents):
+        filler = f'<p>Exhibit {n}: ' + 'x' * max(0, spec.document_size) + '</p>'
+        documents.append(_document(len(documents) + 1, f'EX-{n + 10}', f'ex{n}.htm', f'EXHIBIT {n}',
+                                   f'<html><body>{filler}</body></html>'))
+    documents.append(_document(len(documents) + 1, 'XML', 'FilingSummary.xml', 'IDEA: XBRL DOCUMENT',
+                               f'<XML>\n{generate_filing_summary(spec)}\n</XML>'))
+
+    return (f'<SEC-DOCUMENT>{spec.accession}.txt : {filed:%Y%m%d}\n'
+            f'<SEC-HEADER>{spec.accession}.hdr.sgml : {filed:%Y%m%d}\n'
+            f'<ACCEPTANCE-DATETIME>{filed:%Y%m%d}161530\n'
+            f'ACCESSION NUMBER:\t\t{spec.accession}\n'
+            f'CONFORMED SUBMISSION TYPE:\t{spec.form}\n'
+            f'PUBLIC DOCUMENT COUNT:\t\t{len(documents)}\n'
+            f'CONFORMED PERIOD OF REPORT:\t{spec.period_end:%Y%m%d}\n'
+            f'FILED AS OF DATE:\t\t{filed:%Y%m%d}\n'
+            f'COMPANY CONFORMED NAME:\t\t\t{spec.company}\n'
+            '</SEC-HEADER>\n'
+            + ''.join(documents) +
+            '</SEC-DOCUMENT>\n')
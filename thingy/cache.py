@@ -0,0 +1,64 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+from thingy import metrics
+
+
+class LRUCache:
+    '''
+    Size-bounded memo which evicts the least recently used entry once
+    maxsize is exceeded. Safe to share between threads; get_or_create does
+    not hold the lock while creating, so a value may be created twice.
+    '''
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int, name: Optional[str] = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hit_metric = f'cache.{name or "lru"}.hit'
+        self._miss_metric = f'cache.{name or "lru"}.miss'
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        if (value := self.get(key, self._MISSING)) is self._MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                metrics.count(self._miss_metric)
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+        metrics.count(self._hit_metric)
+        return value
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if (value := self.get(key, self._MISSING)) is self._MISSING:
+            value = self[key] = factory()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,429 @@
+'''
+Concept and label catalog of the fact store
+
+Writing engine.xml means guessing the XBRL concepts and the labels filers
+use. The catalog lists every (statement, concept) of the fact store with its
+label variants, how many filers report it and how many datapoints carry it:
+
+    python -m thingy.catalog build                      # after filling the fact store
+    python -m thingy.catalog search 'longterm.*debt' --statement balance_sheet
+    python -m thingy.catalog lookup us-gaap_LongTermDebtNoncurrent
+    python -m thingy.catalog fallbacks --top 20
+
+build also resolves the regexp queries of the logic ahead of time: for every
+filer, the labels and concepts of the filer matching the patterns of each
+query are stored with the catalog. Given a catalog, the engine answers those
+queries with hash lookups (see FallThruDict.resolved_search) rather than
+matching every label of every report, for the reports it builds from the
+fact store whose datapoints all come from filings the catalog has seen.
+Resolutions hold the labels of the store, where a later filing overwrites the
+labels of the datapoints it reports again (e.g. as a comparative column), so
+parsed filings and datapoints stored since the last build are still searched.
+
+The engine records which query answered each fact of each cell (the first
+one, or one of its fallbacks) into the catalog; fallbacks lists the facts
+whose first query fails most often, i.e. those worth a better query.
+
+The catalog lives in the fact store database, next to the facts it is built
+from, and is rebuilt per filer (see build), so it can be kept up to date as
+filers are added. Entry points running on a persistent fact store open it
+with Catalog.of (see also Snapshot.catalog), which resolves the queries of
+the logic again when it changed since the last build.
+'''
+from __future__ import annotations
+import re
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+import dataclasses
+from collections import Counter
+from typing import Iterable, Optional
+from lxml.objectify import ObjectifiedElement
+from thingy import log
+from thingy.collections import FallThruDict, Report
+from thingy.edgar import store
+from thingy.metric_handlers import Fact
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog_concepts (
+    cik TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    concept TEXT NOT NULL,
+    frequency INTEGER NOT NULL,     -- datapoints
+    PRIMARY KEY (cik, statement, concept)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog_labels (
+    cik TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    concept TEXT NOT NULL,
+    label TEXT NOT NULL,
+    frequency INTEGER NOT NULL,     -- datapoints carrying the label
+    PRIMARY KEY (cik, statement, concept, label)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog_filings (
+    cik TEXT NOT NULL,
+    accession TEXT NOT NULL,
+    PRIMARY KEY (cik, accession)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog (
+    concept TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    filers INTEGER NOT NULL,
+    frequency INTEGER NOT NULL,
+    PRIMARY KEY (concept, statement)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog_variants (
+    concept TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    label TEXT NOT NULL,
+    filers INTEGER NOT NULL,
+    frequency INTEGER NOT NULL,
+    PRIMARY KEY (concept, statement, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS catalog_variants_by_label ON catalog_variants (label COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS catalog_resolutions (
+    cik TEXT NOT NULL,
+    source TEXT NOT NULL,
+    patterns TEXT NOT NULL,         -- JSON list, the payload of the query
+    labels TEXT NOT NULL,           -- JSON list of lowercase labels
+    concepts TEXT NOT NULL,         -- JSON list
+    PRIMARY KEY (cik, source, patterns)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog_answers (
+    fact TEXT NOT NULL,
+    position INTEGER NOT NULL,      -- of the query answering the fact, 0 for the first one
+    cells INTEGER NOT NULL,
+    PRIMARY KEY (fact, position)
+) WITHOUT ROWID;
+'''
+
+BUILD_CONCEPTS = '''
+INSERT INTO catalog_concepts (cik, statement, concept, frequency)
+SELECT cik, statement, concept, COUNT(*) FROM facts {where}
+GROUP BY cik, statement, concept
+'''
+
+BUILD_LABELS = '''
+INSERT INTO catalog_labels (cik, statement, concept, label, frequency)
+SELECT facts.cik, facts.statement, facts.concept, label.value,
+       COUNT(DISTINCT facts.period_end || ' ' || facts.months)
+FROM facts, json_each(facts.labels) AS label {where}
+GROUP BY facts.cik, facts.statement, facts.concept, label.value
+'''
+
+BUILD_FILINGS = 'INSERT INTO catalog_filings (cik, accession) SELECT DISTINCT cik, accession FROM facts {where}'
+
+SUMMARIZE = (
+    'DELETE FROM catalog',
+    'DELETE FROM catalog_variants',
+    'INSERT INTO catalog (concept, statement, filers, frequency) '
+    'SELECT concept, statement, COUNT(*), SUM(frequency) FROM catalog_concepts GROUP BY concept, statement',
+    'INSERT INTO catalog_variants (concept, statement, label, filers, frequency) '
+    'SELECT concept, statement, label, COUNT(*), SUM(frequency) FROM catalog_labels '
+    'GROUP BY concept, statement, label',
+)
+
+UPSERT_ANSWERS = '''
+INSERT INTO catalog_answers (fact, position, cells) VALUES (?, ?, ?)
+ON CONFLICT (fact, position) DO UPDATE SET cells = cells + excluded.cells
+'''
+
+
+@dataclasses.dataclass
+class Entry:
+    concept: str
+    statement: str              # '' when the source of the datapoints does not say
+    filers: int
+    frequency: int              # datapoints
+    labels: list[str]           # variants, most frequent first
+
+
+@dataclasses.dataclass
+class Fallback:
+    fact: str
+    answers: dict[int, int]     # position of the query answering the fact -> cells
+
+    @property
+    def cells(self) -> int:
+        return sum(self.answers.values())
+
+    @property
+    def fallbacks(self) -> int:
+        '''Cells not answered by the first query'''
+        return self.cells - self.answers.get(0, 0)
+
+    @property
+    def rate(self) -> float:
+        return self.fallbacks / self.cells if self.cells else 0.0
+
+
+def regexp_queries(logic: ObjectifiedElement) -> list[tuple[str, tuple[str]]]:
+    '''(source, patterns) of every regexp query of the logic, once each'''
+    queries = dict()
+    for fact in logic.facts.fact:
+        for query in getattr(fact, 'query', ()):
+            if query.get('mode') == 'regexp':
+                queries[(query.get('source'), Fact.get_payload(query))] = None
+    return list(queries)
+
+
+def _regexp(pattern: str, text: Optional[str]) -> bool:
+    return text is not None and re.search(pattern, text, re.IGNORECASE) is not None
+
+
+class Catalog:
+
+    def __init__(self, path: str = store.FACT_STORE_PATH):
+        '''
+        :param path: of the fact store the catalog is built from
+        '''
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        self._resolutions = dict()  # cik -> (accessions, {(source, patterns): (labels, concepts)})
+
+    @classmethod
+    def of(cls, fact_store: store.FactStore, logic: ObjectifiedElement) -> Optional[Catalog]:
+        '''
+        The catalog of fact_store, its resolutions in sync with logic (see
+        sync), or None for an in-memory store, which outlives no run
+        '''
+        if fact_store.path == ':memory:':
+            return None
+        catalog = cls(fact_store.path)
+        catalog.sync(logic)
+        return catalog
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(store.SCHEMA + SCHEMA)
+            self._connection.create_function('regexp', 2, _regexp, deterministic=True)
+        return self._connection
+
+    def build(self, ciks: Optional[Iterable[str]] = None) -> int:
+        '''
+        (Re)build the catalog from the facts of ciks (default: every filer),
+        returning the number of concepts of the catalog
+        '''
+        if ciks is None:
+            scopes = [('', [])]
+        else:
+            scopes = [('WHERE cik IN ({})'.format(', '.join('?' * len(chunk))), chunk)
+                      for chunk in store.chunks(ciks, store.MAX_VARIABLES)]
+
+        with self._lock, self.connection:
+            for where, params in scopes:
+                for table in ('catalog_concepts', 'catalog_labels', 'catalog_filings', 'catalog_resolutions'):
+                    self.connection.execute(f'DELETE FROM {table} {where}', params)
+                for statement in (BUILD_CONCEPTS, BUILD_LABELS, BUILD_FILINGS):
+                    self.connection.execute(statement.format(where=where), params)
+            for statement in SUMMARIZE:
+                self.connection.execute(statement)
+            self._resolutions.clear()
+            return self.connection.execute('SELECT COUNT(*) FROM catalog').fetchone()[0]
+
+    def compile(self, logic: ObjectifiedElement, ciks: Optional[Iterable[str]] = None) -> int:
+        '''
+        Resolve the regexp queries of logic for each of ciks (default: every
+        filer of the catalog) into the labels and concepts they match, as
+        FallThruDict.search would, returning the number of queries resolved
+        '''
+        queries = regexp_queries(logic)
+        with self._lock:
+            if ciks is None:
+                ciks = [row[0] for row in self.connection.execute('SELECT DISTINCT cik FROM catalog_concepts')]
+            ciks = list(ciks)
+
+            rows = list()
+            for cik in ciks:
+                concepts = self.connection.execute(
+                    'SELECT statement, concept FROM catalog_concepts WHERE cik = ?', (cik,)).fetchall()
+                labels = self.connection.execute(
+                    'SELECT statement, label FROM catalog_labels WHERE cik = ?', (cik,)).fetchall()
+                for source, patterns in queries:
+                    # Datapoints without a statement count for every statement, see Report.from_columns
+                    matcher = FallThruDict.compile_patterns(patterns)
+                    rows.append((
+                        cik, source, json.dumps(patterns),
+                        json.dumps(sorted({label.lower() for statement, label in labels
+                                           if statement in ('', source) and matcher(label.lower())})),
+                        json.dumps(sorted({concept for statement, concept in concepts
+                                           if statement in ('', source) and matcher(concept)}))))
+
+            with self.connection:
+                self.connection.executemany('DELETE FROM catalog_resolutions WHERE cik = ?',
+                                            ((cik,) for cik in ciks))
+                self.connection.executemany('INSERT INTO catalog_resolutions VALUES (?, ?, ?, ?, ?)', rows)
+            self._resolutions.clear()
+        logger.info('Resolved %d regexp queries for %d filers', len(queries), len(ciks), extra={'stage': 'catalog'})
+        return len(rows)
+
+    def sync(self, logic: ObjectifiedElement) -> int:
+        '''
+        Resolve the regexp queries of logic again (see compile) if the
+        catalog has been built but some of them were not resolved, e.g.
+        since engine.xml changed, returning the number of queries resolved
+        '''
+        with self._lock:
+            if self.connection.execute('SELECT 1 FROM catalog_filings LIMIT 1').fetchone() is None:
+                return 0
+            resolved = {(source, tuple(json.loads(patterns))) for source, patterns in self.connection.execute(
+                'SELECT DISTINCT source, patterns FROM catalog_resolutions')}
+        if set(regexp_queries(logic)) <= resolved:
+            return 0
+        return self.compile(logic)
+
+    def resolutions(self, cik: str, accessions: Iterable[Optional[str]]) -> dict[tuple[str, tuple[str]], tuple]:
+        '''
+        {(source, patterns): (labels, concepts)} of the regexp queries
+        resolved for cik (see Report.resolved), or {} unless all of
+        accessions, the filings of the datapoints of a report, are part of
+        the catalog
+        '''
+        with self._lock:
+            if cik not in self._resolutions:
+                seen = {row[0] for row in self.connection.execute(
+                    'SELECT accession FROM catalog_filings WHERE cik = ?', (cik,))}
+                queries = {
+                    (source, tuple(json.loads(patterns))): (tuple(json.loads(labels)), tuple(json.loads(concepts)))
+                    for source, patterns, labels, concepts in self.connection.execute(
+                        'SELECT source, patterns, labels, concepts FROM catalog_resolutions WHERE cik = ?', (cik,))}
+                self._resolutions[cik] = seen, queries
+            seen, queries = self._resolutions[cik]
+        return queries if set(accessions) <= seen else {}
+
+    def resolve(self, cik: Optional[str], report: Report) -> Report:
+        '''
+        Add the regexp queries resolved for cik to report, built from the
+        fact store (see Report.from_store), if it has none yet
+        '''
+        if cik is not None and not report.resolved:
+            # Parsed statements do not say which filing each element comes from
+            accessions = {getattr(element, 'accession', None)
+                          for source in Report.SOURCES for element in getattr(report, source).values()}
+            report.resolved.update(self.resolutions(cik, accessions))
+        return report
+
+    def lookup(self, concept: str) -> list[Entry]:
+        '''Entries of a concept, one per statement'''
+        return self._entries('concept = ?', [concept])
+
+    def find_label(self, label: str) -> list[Entry]:
+        '''Entries of the concepts carrying label (ignoring case)'''
+        return self._entries(
+            '(concept, statement) IN (SELECT concept, statement FROM catalog_variants '
+            'WHERE label = ? COLLATE NOCASE)', [label])
+
+    def search(self, pattern: str, statement: Optional[str] = None, limit: Optional[int] = 50) -> list[Entry]:
+        '''
+        Entries whose concept or one of whose labels matches pattern
+        (re.search, ignoring case), most widely reported first; datapoints
+        without a statement match every statement
+        '''
+        where = ('(concept REGEXP ? OR (concept, statement) IN (SELECT concept, statement FROM catalog_variants '
+                 'WHERE label REGEXP ?))')
+        params = [pattern, pattern]
+        if statement is not None:
+            where += " AND statement IN (?, '')"
+            params.append(statement)
+        return self._entries(where, params, limit)
+
+    def _entries(self, where: str, params: list, limit: Optional[int] = None) -> list[Entry]:
+        with self._lock:
+            rows = self.connection.execute(
+                f'SELECT concept, statement, filers, frequency FROM catalog WHERE {where} '
+                f'ORDER BY filers DESC, frequency DESC, concept LIMIT ?', params + [-1 if limit is None else limit]
+            ).fetchall()
+            entries = {(concept, statement): Entry(concept, statement, filers, frequency, [])
+                       for concept, statement, filers, frequency in rows}
+            for concept, statement, label in self.connection.execute(
+                    'SELECT concept, statement, label FROM catalog_variants WHERE concept IN ({}) '
+                    'ORDER BY frequency DESC, label'.format(', '.join('?' * len(entries))),
+                    [concept for concept, _ in entries]):
+                if (entry := entries.get((concept, statement))) is not None:
+                    entry.labels.append(label)
+        return list(entries.values())
+
+    def add_answers(self, answers: Counter):
+        '''
+        Record which queries answered facts
+
+        :param answers: (fact id, position of the query) -> cells, see
+            State.answers
+        '''
+        with self._lock, self.connection:
+            self.connection.executemany(UPSERT_ANSWERS, (
+                (fact, position, cells) for (fact, position), cells in answers.items()))
+
+    def fallbacks(self, limit: Optional[int] = None) -> list[Fallback]:
+        '''Facts not always answered by their first query, those falling back most often first'''
+        by_fact = dict()
+        with self._lock:
+            for fact, position, cells in self.connection.execute(
+                    'SELECT fact, position, cells FROM catalog_answers ORDER BY fact, position'):
+                by_fact.setdefault(fact, Fallback(fact, {})).answers[position] = cells
+        fallbacks = sorted((fallback for fallback in by_fact.values() if fallback.fallbacks),
+                           key=lambda fallback: (-fallback.fallbacks, -fallback.rate, fallback.fact))
+        return fallbacks[:limit]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def _print_entries(entries: list[Entry]):
+    for entry in entries:
+        print(f'{entry.concept}\t{entry.statement or "-"}\t{entry.filers} filers\t{entry.frequency} datapoints\t'
+              + ' | '.join(entry.labels))
+
+
+def main(argv: list[str] = None) -> int:
+    from thingy import snapshot
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default=store.FACT_STORE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='(re)build the catalog and resolve the regexp queries of the logic')
+    build.add_argument('ciks', nargs='*', help='only rebuild these filers')
+    search = commands.add_parser('search', help='concepts or labels matching a regular expression')
+    search.add_argument('pattern')
+    search.add_argument('--statement', choices=store.STATEMENTS)
+    search.add_argument('--limit', type=int, default=50)
+    lookup = commands.add_parser('lookup', help='a concept, or the concepts carrying a label')
+    lookup.add_argument('name')
+    fallbacks = commands.add_parser('fallbacks', help='facts falling back past their first query most often')
+    fallbacks.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    log.configure(logging.INFO)
+    catalog = Catalog(args.store)
+    try:
+        if args.command == 'build':
+            concepts = catalog.build(args.ciks or None)
+            catalog.compile(snapshot.load().logic, args.ciks or None)
+            print(f'{concepts} concepts')
+        elif args.command == 'search':
+            _print_entries(catalog.search(args.pattern, args.statement, args.limit))
+        elif args.command == 'lookup':
+            _print_entries(catalog.lookup(args.name) or catalog.find_label(args.name))
+        else:
+            for fallback in catalog.fallbacks(args.top):
+                positions = ', '.join(f'query {position + 1}: {cells}'
+                                      for position, cells in sorted(fallback.answers.items()))
+                print(f'{fallback.fact}\t{fallback.fallbacks} of {fallback.cells} cells ({fallback.rate:.0%})\t'
+                      f'{positions}')
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
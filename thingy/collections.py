@@ -1,10 +1,33 @@
 from __future__ import annotations
 import re
+import calendar
+import datetime
+import functools
+import itertools
+import threading
+from thingy import metrics
 from thingy.edgar.financials import FinancialInfo as EdgarFinancialInfo
 from thingy.edgar.filing import Filing as EdgarFiling
+from thingy.edgar.store import FactStore, Column
 from thingy.market_watch import FinancialInfo as MarketWatchFinancialInfo, Filing as MarketWatchFiling
-from typing import Union, Optional
-from dataclasses import dataclass
+from typing import Union, Optional, Callable
+from dataclasses import dataclass, field
+from collections import defaultdict, Counter
+
+# Distinct pattern tuples are few (one per regexp query of the logic), but the
+# service and the watcher run for long; keep the compiled matchers bounded
+MATCHER_CACHE_SIZE = 1024
+
+# A numbered backreference (\1 to \99), unless its backslash is escaped
+BACKREFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+# Days after the end of a fiscal period by which its filing is expected (10-Q
+# deadline, 10-K deadline of large accelerated filers), to tell which period
+# the filings of a date cover
+FILING_LAGS = {'quarterly': datetime.timedelta(days=45), 'annual': datetime.timedelta(days=60)}
+# 52-53 week fiscal years end on the same weekday each year, a few days off
+# the fiscal year end given by the filer
+FISCAL_DRIFT = datetime.timedelta(days=7)
 
 
 @dataclass
@@ -15,8 +38,56 @@ class Date:
     def __lt__(self, date: Date):
         return (self.year, self.quarter) < (date.year, date.quarter)
 
+    def period_end_window(self, period: str, fiscal_year_end: Optional[str] = None
+                          ) -> Optional[tuple[datetime.date, datetime.date]]:
+        '''
+        Range of period end dates of the statements filed for this date, or
+        None if that cannot be known up front (the latest filing is wanted).
+
+        The filing resolved for a date is the latest one filed by the end of
+        its quarter (or year, for annual filings, quarter 0), see
+        edgar.stock.Stock.get_filing_info. Given the fiscal year end of the
+        filer (MMDD), that is the filing of the latest fiscal period ending
+        at least FILING_LAGS before. Otherwise fiscal years are assumed to
+        end with a calendar quarter: quarterly filings are filed in the
+        quarter after the one they cover, and annual filings cover a fiscal
+        year ending between October of the previous year and September.
+        '''
+        if self.year == 0:
+            return None
+        if fiscal_year_end is not None and (period == 'annual' or (period == 'quarterly' and self.quarter)):
+            try:
+                month, day = int(fiscal_year_end[:2]), int(fiscal_year_end[2:])
+                datetime.date(2000, month, day)
+            except ValueError:
+                pass  # not MMDD, assume a calendar one
+            else:
+                return self.fiscal_period_end_window(period, month, day)
+        if period == 'annual':
+            return datetime.date(self.year - 1, 10, 1), datetime.date(self.year, 9, 30)
+        if period == 'quarterly' and self.quarter:
+            year, quarter = (self.year, self.quarter - 1) if self.quarter > 1 else (self.year - 1, 4)
+            start = datetime.date(year, 3 * quarter - 2, 1)
+            end = datetime.date(year + quarter // 4, 3 * quarter % 12 + 1, 1) - datetime.timedelta(days=1)
+            return start, end
+        return None
+
+    def fiscal_period_end_window(self, period: str, month: int, day: int) -> tuple[datetime.date, datetime.date]:
+        '''period_end_window of a filer whose fiscal year ends on month/day'''
+        if period == 'annual':
+            filed_by, months = datetime.date(self.year, 12, 31), (month,)
+        else:
+            filed_by = datetime.date(self.year + self.quarter // 4, 3 * self.quarter % 12 + 1, 1) - \
+                datetime.timedelta(days=1)
+            months = tuple((month + 3 * quarter - 1) % 12 + 1 for quarter in range(4))
+        ends = [datetime.date(year, end_month, min(day, calendar.monthrange(year, end_month)[1]))
+                for year in (filed_by.year - 1, filed_by.year) for end_month in months]
+        latest = max(end for end in ends if end + FILING_LAGS[period] <= filed_by)
+        return latest - FISCAL_DRIFT, latest + FISCAL_DRIFT
+
 
 class FallThruDict(dict):
+
     def __init__(self, source: Union[EdgarFinancialInfo, MarketWatchFinancialInfo], period: str):
         self._months = source.months
         self._factor = 1
@@ -26,26 +97,47 @@ class FallThruDict(dict):
 
         super().__init__(source.map)
 
-    def __getitem__(self, keys: Union[list, str]) -> float:
+        # Index everything once so that lookups are hash probes:
+        #  - key -> scaled value
+        #  - lowercase label -> keys of the elements carrying that label
+        #  - key -> position, so label matches keep the report's order
+        self._values = dict()
+        self._labels = defaultdict(list)
+        self._order = dict()
+        self._searches = dict()
+
+        for position, (key, element) in enumerate(self.items()):
+            self._order[key] = position
+            try:
+                self._values[key] = sum(element.values) / self._factor
+            except TypeError:
+                pass  # Non-numeric; computed (and fails) on lookup
+            for label in dict.fromkeys(label.lower() for label in element.labels):
+                self._labels[label].append(key)
+
+    def _value(self, key: str) -> float:
+        if key in self._values:
+            return self._values[key]
+        return sum(dict.__getitem__(self, key).values) / self._factor
+
+    def _lookup(self, keys: Union[list, str]) -> list:
         if isinstance(keys, str):
             keys = [keys]
 
         # Look up by key
-        key_results = [sum(element.values) / self._factor
-                       for key in keys
-                       if (element := dict.get(self, key))]
-        # Look up by label
-        label_results = [sum(element.values) / self._factor
-                         for element in self.values()
-                         if (set(label.lower() for label in element.labels)
-                             & set(label.lower() for label in keys))]
+        results = [self._value(key) for key in keys if dict.__contains__(self, key)]
 
-        results = key_results + label_results
+        # Look up by label
+        matches = {match
+                   for key in keys
+                   for match in self._labels.get(key.lower(), ())}
+        results.extend(self._value(match)
+                       for match in sorted(matches, key=self._order.__getitem__))
 
-        if not results:
-            # Key not found
-            raise KeyError(keys)
+        return results
 
+    @staticmethod
+    def _fall_thru(results: list) -> float:
         for result in results:
             if result:
                 # Non-zero value found
@@ -54,25 +146,23 @@ class FallThruDict(dict):
         # Welp, we got a zero value, but at least it is something
         return results[-1]
 
+    def __getitem__(self, keys: Union[list, str]) -> float:
+        if not (results := self._lookup(keys)):
+            # Key not found
+            raise KeyError(keys)
+        return self._fall_thru(results)
+
     def __contains__(self, keys: Union[list, str]) -> bool:
         if isinstance(keys, str):
             keys = [keys]
 
-        for key in keys:
-            if key in self.keys():
-                return True
-
-        for element in self.values():
-            if (set(label.lower() for label in element.labels)
-                    & set(label.lower() for label in keys)):
-                return True
-
-        return False
+        return any(dict.__contains__(self, key) or key.lower() in self._labels
+                   for key in keys)
 
     def get(self, *keys: list, default: Optional[float] = None) -> Optional[float]:
-        if keys in self:
-            return self[keys]
-        return default
+        if not (results := self._lookup(keys)):
+            return default
+        return self._fall_thru(results)
 
     def get_all(self, *keys: list) -> list:
         return [
@@ -81,25 +171,113 @@ class FallThruDict(dict):
         ]
 
     def search(self, *patterns: str) -> list:
-        results = list()
-        labels = (label for element in self.values() for label in element.labels)
+        '''
+        Return the value of every label and key matching (re.match, ignoring
+        case) any of the patterns. Matching labels come first, then matching
+        keys, each in report order. A label or key matching several patterns
+        is only returned once.
+        '''
+        if patterns not in self._searches:
+            matcher = self.compile_patterns(patterns)
+            # Labels are indexed in lowercase, which is fine for a case-insensitive match
+            self._searches[patterns] = [self[candidate]
+                                        for candidate in itertools.chain(self._labels, dict.keys(self))
+                                        if matcher(candidate)]
+        return self._searches[patterns]
 
-        for pattern in patterns:
-            results.extend(self[label] for label in labels
-                           if re.match(pattern, label, re.IGNORECASE))
-            results.extend(self[key] for key in self
-                           if re.match(pattern, key, re.IGNORECASE))
+    def resolved_search(self, labels: tuple[str], keys: tuple[str]) -> list:
+        '''
+        search() for patterns resolved ahead of time into the (lowercase)
+        labels and the keys they match (see thingy.catalog): the same values
+        in the same order, from hash lookups rather than matching every label
+        and key. Labels and keys the report does not have are ignored.
+        '''
+        labels = sorted((label for label in labels if label in self._labels), key=self._label_position)
+        keys = sorted((key for key in keys if dict.__contains__(self, key)), key=self._order.__getitem__)
+        return [self[candidate] for candidate in itertools.chain(labels, keys)]
 
-        return results
+    def _label_position(self, label: str) -> tuple[int, int]:
+        '''Position of label in self._labels, i.e. in report order'''
+        key = self._labels[label][0]  # where the label was first seen
+        labels = dict.fromkeys(label.lower() for label in dict.__getitem__(self, key).labels)
+        return self._order[key], list(labels).index(label)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=MATCHER_CACHE_SIZE)
+    def compile_patterns(patterns: tuple[str]) -> Callable[[str], bool]:
+        '''Compile patterns (once) into a single case-insensitive matcher'''
+        # Joining the patterns renumbers their groups, which breaks numbered
+        # backreferences; those patterns are matched one by one
+        if not any(BACKREFERENCE.search(pattern) for pattern in patterns):
+            try:
+                return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE).match
+            except re.error:
+                pass  # e.g. global flags in the middle of a pattern
+        compiled = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        return lambda text: any(pattern.match(text) for pattern in compiled)
 
 
 @dataclass(frozen=True)
 class Report:
+    SOURCES = ('balance_sheet', 'cash_flow', 'income_statements')
+
     balance_sheet: FallThruDict
     cash_flow: FallThruDict
     income_statements: FallThruDict
 
+    # Filing the statements came from
+    accession: Optional[str] = field(default=None, compare=False)
+
+    # Memoized query results, for the lifetime of the Report. Reports are
+    # cached and shared between engines (e.g. by thingy.service's threads),
+    # so both are only touched under _lock.
+    queries: dict = field(default_factory=dict, compare=False, repr=False)
+    stats: Counter = field(default_factory=Counter, compare=False, repr=False)
+
+    # (source, patterns) -> (labels, keys) of regexp queries resolved ahead
+    # of time for the filer of the report (see thingy.catalog)
+    resolved: dict = field(default_factory=dict, compare=False, repr=False)
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, compare=False, repr=False)
+
+    def query(self, source: str, mode: str, payload: tuple[str], stats: Optional[Counter] = None) -> list:
+        '''
+        Run a select or regexp query against one of the statements (see
+        SOURCES). Many facts query the same concepts, so results are memoized
+        by (source, mode, payload). Hits and misses are counted in self.stats
+        and, if given, in stats, as are regexp queries answered from
+        self.resolved.
+        '''
+        key = (source, mode, payload)
+        with self._lock:
+            outcome = 'hits' if key in self.queries else 'misses'
+            self.stats[outcome] += 1
+            if stats is not None:
+                stats[outcome] += 1
+
+            if outcome == 'misses':
+                if source not in self.SOURCES:
+                    raise ValueError(f'Unknown source: {source}')
+
+                statement = getattr(self, source)
+
+                if mode == 'select':
+                    self.queries[key] = statement.get_all(*payload)
+                elif mode == 'regexp':
+                    if (resolved := self.resolved.get((source, payload))) is not None:
+                        self.queries[key] = statement.resolved_search(*resolved)
+                        self.stats['resolved'] += 1
+                        if stats is not None:
+                            stats['resolved'] += 1
+                    else:
+                        self.queries[key] = statement.search(*payload)
+                else:
+                    raise ValueError(f'Unsupported mode: {mode}')
+
+            return self.queries[key]
+
     @classmethod
+    @metrics.timed('report.new')
     def new(cls, filing: Union[EdgarFiling, MarketWatchFiling], period: str) -> Report:
         return cls(
             balance_sheet=FallThruDict(
@@ -110,7 +288,49 @@ class Report:
                 period),
             income_statements=FallThruDict(
                 cls.get_recent_report(filing.get_income_statements().reports, period),
-                period))
+                period),
+            accession=getattr(filing, 'accession', None))
+
+    @classmethod
+    def from_store(cls, store: FactStore, cik: str, period: str, date: Date) -> Optional[Report]:
+        '''
+        Build the Report for a date from datapoints already in the fact store,
+        e.g. comparative columns of filings parsed earlier. Returns None if
+        the store cannot provide all of the statements.
+
+        Snapshot columns make up the balance sheet and duration columns the
+        other statements; datapoints stored without a statement count for
+        every statement of their kind.
+        '''
+        if (window := date.period_end_window(period, store.get_fiscal_year_end(cik))) is None:
+            return None
+        return cls.from_columns(store.get_columns(cik, *window), period)
+
+    @classmethod
+    def from_columns(cls, stored: dict[tuple[str, datetime.date, Optional[int]], Column],
+                     period: str) -> Optional[Report]:
+        '''
+        Build a Report from columns read back from the fact store (see
+        FactStore.get_columns), or None if they do not make up all of the
+        statements
+        '''
+        stored = sorted(stored.items(),
+                        key=lambda item: item[0][0] != '')  # statement specific datapoints win
+        statements = dict()
+        for source in cls.SOURCES:
+            snapshot = source == 'balance_sheet'
+            columns = dict()
+            for (statement, period_end, months), column in stored:
+                if statement in ('', source) and (months is None) == snapshot:
+                    columns.setdefault((period_end, months), Column(period_end, months)).map.update(column.map)
+            try:
+                statements[source] = cls.get_recent_report(list(columns.values()), period)
+            except ValueError:
+                return None
+
+        latest = max(statements['balance_sheet'].map.values(), key=lambda fact: (fact.date_filed, fact.accession))
+        return cls(**{source: FallThruDict(column, period) for source, column in statements.items()},
+                   accession=latest.accession)
 
     @staticmethod
     def get_recent_report(reports: list[Union[EdgarFinancialInfo, MarketWatchFinancialInfo]],
@@ -0,0 +1,266 @@
+'''
+Ingest of SEC companyfacts JSON
+
+https://www.sec.gov/edgar/sec-api-documentation
+
+For every company, SEC publishes every XBRL fact it ever reported as one
+JSON document (CIK##########.json), available one by one from data.sec.gov
+or all together in the nightly companyfacts.zip:
+
+    {"cik": 320193, "entityName": "Apple Inc.", "facts": {
+        "us-gaap": {
+            "Assets": {"label": "Assets", "description": "...", "units": {
+                "USD": [{"end": "2020-06-27", "val": 317344000000,
+                         "accn": "0000320193-20-000062", "fy": 2020, "fp": "Q3",
+                         "form": "10-Q", "filed": "2020-07-31"},
+                        {"start": ..., "end": ..., ...}, ...]}},
+            ...}}}
+
+Documents of large filers run into hundreds of MB, so they are never loaded
+whole: the scanner below walks the document down to the concepts and decodes
+them one at a time. Facts are loaded into the fact store keyed by (CIK,
+concept, period end, months) like the columns of parsed filings, concepts
+named the same way (e.g. us-gaap_Assets) and months derived from the start
+and end of durations. companyfacts do not say which statement a fact belongs
+to, so they are stored without one (see collections.Report.from_store), and
+cover page facts (see store.COVER_TAXONOMIES) are left out.
+
+One document answers every date of a company, so a multi-year comparison
+of a symbol costs one local file read (see providers.CompanyFactsProvider).
+The store can also be filled ahead of time:
+
+    python -m thingy.edgar.companyfacts companyfacts.zip
+    python -m thingy.edgar.companyfacts companyfacts.zip --cik 320193 34088
+'''
+import io
+import os
+import re
+import sys
+import json
+import zipfile
+import logging
+import argparse
+import itertools
+from datetime import date
+from thingy.edgar.edgar import FINANCIAL_FORM_MAP
+from thingy.edgar.store import FactStore, FACT_STORE_PATH, COVER_TAXONOMIES
+
+logger = logging.getLogger(__name__)
+
+COMPANY_FACTS_URL = 'https://data.sec.gov/api/xbrl/companyfacts/'
+BULK_URL = 'https://www.sec.gov/Archives/edgar/daily-index/xbrl/companyfacts.zip'
+FINANCIAL_FORMS = FINANCIAL_FORM_MAP['annual'] + FINANCIAL_FORM_MAP['quarterly']
+CHUNK_SIZE = 50000
+READ_SIZE = 1 << 16
+
+DAYS_PER_MONTH = 365.25 / 12
+WHITESPACE = re.compile(r'\s*')
+
+
+class CompanyFactsException(Exception):
+    pass
+
+
+def get_file_name(cik):
+    '''
+    Name of the document of cik, e.g. CIK0000320193.json
+    '''
+    return 'CIK{:010d}.json'.format(int(cik))
+
+
+def open_company_facts(cik, source=None):
+    '''
+    Return the document of cik as a text file, from source:
+
+    :param source: a directory of documents, companyfacts.zip (a path or an
+        open ZipFile), or None to download it from data.sec.gov
+    '''
+    name = get_file_name(cik)
+    if source is None:
+        from thingy.edgar.requests_wrapper import GetRequest
+        return io.StringIO(GetRequest(COMPANY_FACTS_URL + name).response.text)
+    if isinstance(source, str) and os.path.isdir(source):
+        try:
+            return open(os.path.join(source, name), encoding='utf-8')
+        except FileNotFoundError:
+            raise CompanyFactsException('{} has no {}'.format(source, name)) from None
+    dataset = source if isinstance(source, zipfile.ZipFile) else zipfile.ZipFile(source)
+    try:
+        return io.TextIOWrapper(dataset.open(name), encoding='utf-8')
+    except KeyError:
+        raise CompanyFactsException('{} has no {}'.format(dataset.filename, name)) from None
+
+
+class Scanner:
+    '''
+    Walk a JSON document read from a text file without loading it whole.
+    Objects are entered with members() and any value is decoded with value(),
+    so only the values decoded are ever held in memory.
+    '''
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _read(self, size):
+        chunk = self.f.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''
+        Skip whitespace and return the next character
+        '''
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read(self.read_size):
+                raise CompanyFactsException('Unexpected end of document')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise CompanyFactsException('Expected {!r} at {!r}'.format(
+                char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        '''
+        Decode the next value
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Truncated: read at least as much again, so that large
+                # values are decoded a logarithmic number of times
+                if self._read(max(self.read_size, len(self.buffer) - self.pos)):
+                    continue
+                raise
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self.buffer) and self._read(self.read_size):
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        '''
+        Enter an object and yield its keys; the value of each key must be
+        consumed (with value() or members()) before asking for the next one
+        '''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise CompanyFactsException('Expected \',\' or \'}}\' at {!r}'.format(
+                    self.buffer[self.pos - 1:self.pos + 20]))
+
+
+def read_concepts(f, read_size=READ_SIZE):
+    '''
+    Yield (taxonomy, tag, concept) for every concept of the document read
+    from f, where concept is the decoded {"label", "description", "units"}
+    '''
+    scanner = Scanner(f, read_size)
+    for key in scanner.members():
+        if key != 'facts':
+            scanner.value()
+            continue
+        for taxonomy in scanner.members():
+            for tag in scanner.members():
+                yield taxonomy, tag, scanner.value()
+
+
+def get_months(start, end):
+    '''
+    Duration, in months, of a fact from start to end (included)
+    '''
+    return round(((end - start).days + 1) / DAYS_PER_MONTH)
+
+
+def get_facts(cik, f, forms=FINANCIAL_FORMS, read_size=READ_SIZE):
+    '''
+    Yield the facts of the document read from f as rows for
+    FactStore.add_facts
+
+    :param forms: only facts reported in these forms are kept, all if empty
+    '''
+    for taxonomy, tag, concept in read_concepts(f, read_size):
+        if taxonomy in COVER_TAXONOMIES:
+            continue
+        name = '{}_{}'.format(taxonomy, tag)
+        labels = [concept['label']] if concept.get('label') else []
+        for facts in (concept.get('units') or {}).values():
+            for fact in facts:
+                if (forms and fact.get('form') not in forms) or fact.get('val') is None:
+                    continue
+                end = date.fromisoformat(fact['end'])
+                months = get_months(date.fromisoformat(fact['start']), end) if fact.get('start') else None
+                yield (cik, '', name, end, months, float(fact['val']), labels,
+                       fact['accn'], date.fromisoformat(fact['filed']))
+
+
+def ingest(cik, f, store, forms=FINANCIAL_FORMS, chunk_size=CHUNK_SIZE, read_size=READ_SIZE):
+    '''
+    Load the document of cik read from f into store; returns the number of
+    facts read
+    '''
+    count = 0
+    rows = get_facts(cik, f, forms, read_size)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        store.add_facts(chunk)
+        count += len(chunk)
+    logger.debug('Loaded %d companyfacts of CIK %s', count, cik, extra={'stage': 'ingest'})
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='companyfacts.zip or a directory of CIK##########.json')
+    parser.add_argument('--cik', nargs='*', help='only these companies (default: all)')
+    parser.add_argument('--store', default=FACT_STORE_PATH)
+    parser.add_argument('--all-forms', action='store_true', help='not only 10-K and 10-Q (and amendments)')
+    args = parser.parse_args(argv)
+
+    from thingy import log
+    log.configure(logging.INFO)
+    forms = () if args.all_forms else FINANCIAL_FORMS
+    source = args.source if os.path.isdir(args.source) else zipfile.ZipFile(args.source)
+    if args.cik:
+        ciks = args.cik
+    else:
+        names = os.listdir(source) if isinstance(source, str) else source.namelist()
+        ciks = [match.group(1) for match in map(re.compile(r'CIK(\d{10})\.json$').match, names) if match]
+
+    store = FactStore(args.store)
+    try:
+        count = 0
+        for cik in ciks:
+            cik = str(int(cik))
+            with open_company_facts(cik, source) as f:
+                count += ingest(cik, f, store, forms)
+        logger.info('Loaded %d facts of %d companies from %s', count, len(ciks), args.source,
+                    extra={'stage': 'ingest'})
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
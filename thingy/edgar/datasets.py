@@ -0,0 +1,180 @@
+'''
+Bulk ingest of the SEC Financial Statement Data Sets
+
+https://www.sec.gov/dera/data/financial-statement-data-sets.html
+
+Every quarter, SEC publishes the numbers of every financial statement filed
+in it, as one zip of tab separated files. The ones used here are:
+
+    sub.txt  one row per submission: adsh (accession), cik, name, sic, fye,
+             form, filed (YYYYMMDD), ...
+    num.txt  one row per number: adsh, tag, version, coreg (or segments),
+             ddate (period end, YYYYMMDD), qtrs (duration in quarters, 0 for
+             snapshots), uom, value, footnote
+    tag.txt  one row per tag: tag, version, custom, abstract, datatype,
+             iord, crdr, tlabel (label), doc
+
+The numbers are streamed out of the zip (nothing is extracted to disk) and
+loaded into the fact store in chunks, keyed by (CIK, concept, period end,
+months) like the columns of parsed filings, with concepts named the same
+way (e.g. us-gaap_Assets). The data sets do not say which statement a
+number belongs to, so they are stored without one and count for every
+statement (see collections.Report.from_store); cover page numbers (see
+store.COVER_TAXONOMIES) are left out. Companies (name, SIC code, fiscal
+year end) go to the companies table.
+
+A quarter of the whole market is then one local load instead of thousands of
+filings to download and scrape:
+
+    python -m thingy.edgar.datasets 2020q3.zip 2020q4.zip
+    python -m thingy.edgar.datasets 2020q4          # downloaded from SEC
+'''
+import io
+import os
+import re
+import csv
+import sys
+import zipfile
+import logging
+import argparse
+import itertools
+from datetime import datetime
+from thingy.edgar.edgar import FINANCIAL_FORM_MAP
+from thingy.edgar.store import FactStore, FACT_STORE_PATH, COVER_TAXONOMIES
+
+logger = logging.getLogger(__name__)
+
+DATASETS_URL = 'https://www.sec.gov/files/dera/data/financial-statement-data-sets/'
+FINANCIAL_FORMS = FINANCIAL_FORM_MAP['annual'] + FINANCIAL_FORM_MAP['quarterly']
+CHUNK_SIZE = 50000
+
+# Some numbers are reported for a co-registrant or a segment only; these
+# are not the figures of the consolidated statements
+DIMENSION_COLUMNS = ('coreg', 'segments')
+
+csv.field_size_limit(sys.maxsize)  # tag.txt documentation can be long
+
+
+class DatasetException(Exception):
+    pass
+
+
+def get_dataset_url(year, quarter):
+    return '{}{}q{}.zip'.format(DATASETS_URL, year, quarter)
+
+
+def open_dataset(source):
+    '''
+    Return a ZipFile of a data set, from a path or, given as YYYYqN (e.g.
+    2020q3), downloaded from SEC and kept in memory
+    '''
+    if os.path.exists(source):
+        return zipfile.ZipFile(source)
+    match = re.fullmatch(r'(\d{4})[qQ]([1-4])', source)
+    if match is None:
+        raise DatasetException('{} is neither a data set file nor a quarter (YYYYqN)'.format(source))
+    from thingy.edgar.requests_wrapper import GetRequest
+    url = get_dataset_url(*match.groups())
+    logger.info('Downloading %s', url, extra={'stage': 'fetch'})
+    return zipfile.ZipFile(io.BytesIO(GetRequest(url, cache=False).response.content))
+
+
+def read_table(dataset, name):
+    '''
+    Yield the rows of a table of dataset as dicts, streamed out of the zip
+    '''
+    try:
+        raw = dataset.open(name)
+    except KeyError:
+        raise DatasetException('{} has no {}'.format(dataset.filename, name)) from None
+    with io.TextIOWrapper(raw, encoding='utf-8', errors='replace', newline='') as f:
+        rows = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        header = next(rows, None)
+        if header is None:
+            return
+        for row in rows:
+            yield dict(zip(header, row))
+
+
+def get_concept(tag, version):
+    '''
+    Name a tag the way parsed filings do, e.g. us-gaap_Assets. Custom tags
+    (whose version is the accession of the filing) are named custom_<tag>
+    '''
+    namespace = version.split('/')[0] if '/' in version else 'custom'
+    return '{}_{}'.format(namespace, tag)
+
+
+def _parse_date(text):
+    return datetime.strptime(text, '%Y%m%d').date()
+
+
+def ingest(dataset, store, forms=FINANCIAL_FORMS, chunk_size=CHUNK_SIZE):
+    '''
+    Load a data set (a ZipFile) into store; returns the number of facts read
+
+    :param forms: only submissions of these forms are loaded, all if empty
+    '''
+    submissions = {}
+    companies = {}
+    for row in read_table(dataset, 'sub.txt'):
+        if forms and row['form'] not in forms:
+            continue
+        date_filed = _parse_date(row['filed'])
+        submissions[row['adsh']] = (row['cik'], date_filed)
+        if row['cik'] not in companies or companies[row['cik']][4] <= date_filed:
+            companies[row['cik']] = (row['cik'], row['name'], row.get('sic') or None,
+                                     row.get('fye') or None, date_filed)
+    store.add_companies(companies.values())
+
+    labels = {(row['tag'], row['version']): row['tlabel']
+              for row in read_table(dataset, 'tag.txt')
+              if row.get('tlabel')}
+
+    def facts():
+        for row in read_table(dataset, 'num.txt'):
+            submission = submissions.get(row['adsh'])
+            if (submission is None or not row['value']
+                    or any(row.get(column) for column in DIMENSION_COLUMNS)
+                    or row['version'].split('/')[0] in COVER_TAXONOMIES):
+                continue
+            cik, date_filed = submission
+            label = labels.get((row['tag'], row['version']))
+            months = int(row['qtrs']) * 3
+            yield (cik, '', get_concept(row['tag'], row['version']), _parse_date(row['ddate']),
+                   months or None, float(row['value']), [label] if label else [],
+                   row['adsh'], date_filed)
+
+    count = 0
+    rows = facts()
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        store.add_facts(chunk)
+        count += len(chunk)
+        logger.debug('Loaded %d facts from %s', count, dataset.filename, extra={'stage': 'ingest'})
+
+    logger.info('Loaded %d facts of %d submissions from %s', count, len(submissions), dataset.filename,
+                extra={'stage': 'ingest'})
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('datasets', nargs='+', help='data set zips, or quarters (YYYYqN) to download')
+    parser.add_argument('--store', default=FACT_STORE_PATH)
+    parser.add_argument('--all-forms', action='store_true', help='not only 10-K and 10-Q (and amendments)')
+    args = parser.parse_args(argv)
+
+    from thingy import log
+    log.configure(logging.INFO)
+    store = FactStore(args.store)
+    try:
+        for source in args.datasets:
+            with open_dataset(source) as dataset:
+                ingest(dataset, store, forms=() if args.all_forms else FINANCIAL_FORMS)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
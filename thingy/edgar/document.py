@@ -1,7 +1,9 @@
-from bs4 import BeautifulSoup
+import logging
 from thingy.edgar.dtd import DTD
 from thingy.edgar.document_text import DocumentText
 
+logger = logging.getLogger(__name__)
+
 
 class Document:
     dtd = DTD()
@@ -31,8 +33,8 @@ class Document:
         if xml_soup is not None:
             cik = xml_soup.find('issuercik').get_text().lstrip('0')
             symbol = xml_soup.find('issuertradingsymbol').get_text()
-            print('cik is {0} and symbol is {1}'.format(cik, symbol))
+            logger.debug('cik is %s and symbol is %s', cik, symbol)
         else:
-            print('document does not have xml, cannot determine symbol')
+            logger.warning('document does not have xml, cannot determine symbol')
 
         return cik, symbol
@@ -1,4 +1,3 @@
-from bs4 import BeautifulSoup
 from thingy.edgar.dtd import DTD
 
 
@@ -30,6 +29,7 @@ class DocumentText:
 
                 if attr == 'xml':
                     # for everything else, we take the text as is
+                    from bs4 import BeautifulSoup
                     value = BeautifulSoup(value, 'html.parser')
 
                 setattr(self, attr, value)
@@ -26,10 +26,14 @@ https://www.sec.gov/forms):
 These can all have ammendments made, e.g. 10-Q/A
 '''
 from thingy.edgar.requests_wrapper import GetRequest
+from thingy.cache import LRUCache
 import json
 import re
 from datetime import datetime
 import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 SYMBOLS_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'symbols.csv')
@@ -45,11 +49,16 @@ EDGAR_MIN_YEAR = 1993
 
 ARCHIVES_URL = 'https://www.sec.gov/Archives/'
 FULL_INDEX_URL = ARCHIVES_URL + 'edgar/full-index/'
+# one master.YYYYMMDD.idx per business day, published after the day closes
+DAILY_INDEX_URL = ARCHIVES_URL + 'edgar/daily-index/'
 INDEX_JSON = 'index.json'
 # company.idx gives us a list of all companies that filed in the period
 COMPANY_IDX = 'company.idx'  # sorted by company name
 FORM_IDX = 'form.idx'  # sorted by form type
 MASTER_IDX = 'master.idx'  # sorted by cik
+
+# Rows of the master.idx files read so far (each is tens of MB), by url
+MASTER_INDEX_CACHE = LRUCache(8, name='master_index')
 #CRAWLER_IDX = 'crawler.idx'
 #XBRL_IDX = 'xbrl.idx'
 
@@ -85,6 +94,13 @@ class FilingInfo:
         self.date_filed = date_filed
         self.url = ARCHIVES_URL + file
 
+    @property
+    def accession(self):
+        '''
+        Accession number of the filing, e.g. 0001193125-19-004285
+        '''
+        return os.path.splitext(os.path.basename(self.url))[0]
+
     def __repr__(self):
         return '[{0}, {1}, {2}, {3}, {4}]'.format(
             self.company, self.form, self.cik, self.date_filed, self.url)
@@ -207,13 +223,9 @@ def _get_filing_info(cik='', forms=[], year='', quarter=''):
 
     # using master.idx so it's sorted by cik and we can use binary search
     url = '{}{}{}{}'.format(FULL_INDEX_URL, year, quarter, MASTER_IDX)
-    print('getting {} filing info from {}'.format(forms, url))
+    logger.debug('Getting %s filing info from %s', forms, url, extra={'stage': 'index'})
 
-    response = GetRequest(url).response
-    text = response.text
-    # print(text)
-    rows = text.split('\n')
-    data_rows = rows[11:]
+    data_rows = MASTER_INDEX_CACHE.get_or_create(url, lambda: _get_master_index_rows(url))
 
     filing_infos = []
 
@@ -264,6 +276,50 @@ def _get_filing_info(cik='', forms=[], year='', quarter=''):
     return filing_infos
 
 
+def _get_master_index_rows(url):
+    '''
+    Returns the data rows (after the header) of a master.idx
+    '''
+    response = GetRequest(url).response
+    text = response.text
+    rows = text.split('\n')
+    return rows[11:]
+
+
+def get_daily_index_path(day):
+    '''
+    Returns the path, relative to DAILY_INDEX_URL, of the master index of
+    the filings of day (a date), e.g. 2020/QTR4/master.20201103.idx
+    '''
+    return '{}/QTR{}/master.{}.idx'.format(day.year, (day.month - 1) // 3 + 1, day.strftime('%Y%m%d'))
+
+
+def parse_master_index(text, forms=[]):
+    '''
+    Returns the FilingInfo of every row of a master index (either a full or
+    a daily one), only keeping those with one of forms if given. Daily
+    indexes give dates filed as YYYYMMDD, these are returned as YYYY-MM-DD
+    as in the full indexes.
+    '''
+    filing_infos = []
+    lines = iter(text.splitlines())
+    # skip the header, which ends with a line of dashes
+    for line in lines:
+        if line.startswith('-----'):
+            break
+
+    for line in lines:
+        data = line.split('|')
+        if len(data) != 5 or (forms and data[2] not in forms):
+            continue
+        date_filed = data[3]
+        if len(date_filed) == 8 and date_filed.isdigit():
+            date_filed = '{}-{}-{}'.format(date_filed[:4], date_filed[4:6], date_filed[6:])
+        filing_infos.append(FilingInfo(data[1], data[2], data[0], date_filed, data[4].strip()))
+
+    return filing_infos
+
+
 def get_financial_filing_info(period, cik, year='', quarter=''):
     if period not in FINANCIAL_FORM_MAP:
         raise KeyError('period must be either "annual" or "quarterly"')
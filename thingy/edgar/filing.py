@@ -6,8 +6,13 @@ from thingy.edgar.document import Document
 from thingy.edgar.sgml import Sgml
 from thingy.edgar.dtd import DTD
 from thingy.edgar.financials import get_financial_report
+from thingy.log import rate_limited
 from datetime import datetime
+import os
 import re
+import logging
+
+logger = rate_limited(logging.getLogger(__name__))
 
 
 FILING_SUMMARY_FILE = 'FilingSummary.xml'
@@ -35,17 +40,25 @@ class Filing:
     STATEMENTS = Statements()
     sgml = None
 
-    def __init__(self, url, company=None):
+    def __init__(self, url, company=None, text=None):
+        '''
+        :param url: location of the full submission text file
+        :param company: identifier of the company the filing belongs to
+        :param text: contents of the submission, if already fetched; when
+            None, the submission is downloaded from url
+        '''
         self.url = url
         # made this company instead of symbol since not all edgar companies are publicly traded
         self.company = company
 
-        response = GetRequest(url).response
-        text = response.text
+        if text is None:
+            response = GetRequest(url).response
+            text = response.text
 
         self.text = text
 
-        print('Processing SGML at ' + url)
+        logger.debug('Processing SGML at %s', url,
+                     extra={'symbol': company, 'accession': self.accession, 'stage': 'sgml'})
 
         dtd = DTD()
         sgml = Sgml(text, dtd)
@@ -63,6 +76,16 @@ class Filing:
         # not concerned with time/timezones
         self.date_filed = datetime.strptime(acceptance_datetime_text, '%Y%m%d')
 
+        # {(statement_regexps, get_all): financial data}
+        self._financial_data = {}
+
+    @property
+    def accession(self):
+        '''
+        Accession number of the filing, e.g. 0001193125-19-004285
+        '''
+        return os.path.splitext(os.path.basename(self.url))[0]
+
     def get_financial_data(self):
         '''
         This is mostly just for easy QA to return all financial statements
@@ -73,15 +96,23 @@ class Filing:
 
     def _get_financial_data(self, statement_regexps, get_all):
         '''
-        Returns financial data used for processing 10-Q and 10-K documents
+        Returns financial data used for processing 10-Q and 10-K documents.
+        Statements are only parsed once per Filing, so asking for the same
+        statement again (e.g. for both annual and quarterly) is free
         '''
+        key = (tuple(statement_regexps), get_all)
+        if key not in self._financial_data:
+            self._financial_data[key] = self._parse_financial_data(statement_regexps, get_all)
+        return self._financial_data[key]
+
+    def _parse_financial_data(self, statement_regexps, get_all):
         financial_data = []
 
         for names in self._get_statement(statement_regexps):
             short_name = names[0]
             filename = names[1]
-            print('Getting financial data for {0} (filename: {1})'
-                  .format(short_name, filename))
+            logger.debug('Getting financial data for %s (filename: %s)', short_name, filename,
+                         extra={'symbol': self.company, 'accession': self.accession, 'stage': 'parse'})
             financial_html_text = self.documents[filename].doc_text.data
 
             financial_report = get_financial_report(self.company, self.date_filed, financial_html_text)
@@ -106,20 +137,19 @@ class Filing:
             short_names = list(self.get_short_names(filing_summary_xml))
 
             if not short_names:
-                print('No short names found for any documents')
+                logger.warning('No short names found for any documents',
+                               extra={'symbol': self.company, 'accession': self.accession, 'stage': 'parse'})
 
             for short_name in short_names:
                 if any(regexp.match(short_name) for regexp in statement_regexps):
                     filename = self.get_html_file_name(filing_summary_xml, short_name)
                     if filename is not None:
                         statement_names += [(short_name, filename)]
-        else:
-            print('No financial documents in this filing')
-
         if len(statement_names) == 0:
-            print('No financial documents could be found. Likely need to update constants in edgar.filing.Statements.')
-            print(f'statement_regeps = {statement_regexps}')
-            breakpoint()
+            # Likely need to update constants in edgar.filing.Statements
+            raise NoFinancialDataException(
+                'No financial documents matching {} found in {}'.format(
+                    [regexp.pattern for regexp in statement_regexps], self.url))
 
         return statement_names
 
@@ -135,8 +165,7 @@ class Filing:
         for report in reports:
             short_name = report.find('shortname')
             if short_name is None:
-                print('The following report has no ShortName element')
-                print(report)
+                logger.debug('The following report has no ShortName element: %s', report)
                 continue
             # otherwise, get the text and keep procesing
             short_name = short_name.get_text().lower()
@@ -144,7 +173,8 @@ class Filing:
             if short_name == report_short_name.lower():
                 filename = report.find('htmlfilename').get_text()
                 return filename
-        print(f'could not find anything for ShortName {report_short_name.lower()}')
+        logger.warning('Could not find anything for ShortName %s', report_short_name.lower(),
+                       extra={'symbol': self.company, 'accession': self.accession, 'stage': 'parse'})
         return None
 
     def get_short_names(self, filing_summary_xml):
@@ -161,3 +191,60 @@ class Filing:
 
     def get_cash_flows(self):
         return self._get_financial_data(self.STATEMENTS.cash_flows, False)
+
+
+class ParsedFiling:
+    '''
+    The statements of a Filing, parsed up front and without the submission,
+    so that it is small enough to be sent between processes (see
+    thingy.pipeline). Quacks like a Filing for collections.Report and
+    store.FactStore.
+    '''
+
+    def __init__(self, url, company, date_filed, statements):
+        '''
+        :param statements: {'income_statements' | 'balance_sheets' |
+            'cash_flows': FinancialReport, or the NoFinancialDataException
+            raised looking for it}
+        '''
+        self.url = url
+        self.company = company
+        self.date_filed = date_filed
+        self.statements = statements
+
+    @property
+    def accession(self):
+        return os.path.splitext(os.path.basename(self.url))[0]
+
+    def _get(self, name):
+        statement = self.statements[name]
+        if isinstance(statement, NoFinancialDataException):
+            raise statement
+        return statement
+
+    def get_income_statements(self):
+        return self._get('income_statements')
+
+    def get_balance_sheets(self):
+        return self._get('balance_sheets')
+
+    def get_cash_flows(self):
+        return self._get('cash_flows')
+
+
+def parse_submission(url, company, text):
+    '''
+    Parse the statements of a submission into a ParsedFiling
+    '''
+    filing = Filing(url, company=company, text=text)
+    statements = {}
+    for name in ('income_statements', 'balance_sheets', 'cash_flows'):
+        try:
+            statements[name] = getattr(filing, 'get_' + name)()
+        except NoFinancialDataException as e:
+            statements[name] = e
+    return ParsedFiling(url, company, filing.date_filed, statements)
+
+
+class NoFinancialDataException(Exception):
+    pass
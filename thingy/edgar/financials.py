@@ -2,9 +2,16 @@
 Handles financial logic
 '''
 import re
-from bs4 import BeautifulSoup
+import sys
+from array import array
+from types import MappingProxyType
 from json import JSONEncoder
 from datetime import datetime
+from thingy import metrics
+from thingy.log import rate_limited
+import logging
+
+logger = rate_limited(logging.getLogger(__name__))
 
 
 class FinancialReportEncoder(JSONEncoder):
@@ -12,21 +19,67 @@ class FinancialReportEncoder(JSONEncoder):
     def default(self, o):
         if isinstance(o, datetime):
             return o.isoformat()
+        if isinstance(o, (FinancialElement, FinancialInfo)):
+            return o.to_dict()
         return o.__dict__
 
 
+def _intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
 class FinancialElement:
     '''
     Models financial elements
+
+    Labels are interned and values are kept as a range of a float64 array,
+    which is shared by all elements of a FinancialInfo
     '''
+    __slots__ = ('labels', '_values', '_start', '_stop')
+
+    class Builder:
+        '''
+        Mutable stand-in used while a statement is being parsed
+        '''
+        __slots__ = ('labels', 'values')
+
+        def __init__(self, labels: list, values: list):
+            self.labels = labels
+            self.values = values
+
+    def __init__(self, labels: list, values: list, values_raw: list = None):
+        '''
+        :param labels: labels of the element, as found in the report
+        :param values: values of the element
+        :param values_raw: deprecated, always identical to values
+        '''
+        self._set(labels, array('d', values), 0, len(values))
+
+    def _set(self, labels, values, start, stop):
+        self.labels = tuple(_intern(label) for label in labels)
+        self._values = values
+        self._start = start
+        self._stop = stop
 
-    def __init__(self, labels: list, values: list, values_raw: list):
-        self.labels = labels
-        self.values = values
-        self.values_raw = values_raw
+    @classmethod
+    def _view(cls, labels, values, start, stop):
+        element = cls.__new__(cls)
+        element._set(labels, values, start, stop)
+        return element
+
+    @property
+    def values(self) -> list:
+        return self._values[self._start:self._stop].tolist()
+
+    @property
+    def values_raw(self) -> list:
+        return self.values
+
+    def to_dict(self):
+        return {'labels': list(self.labels), 'values': self.values, 'values_raw': self.values_raw}
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
 
 
 class FinancialInfo:
@@ -34,19 +87,37 @@ class FinancialInfo:
     Models financial data provided in a financial report
     financial elements are stored in a map to retain flexibility
     '''
+    __slots__ = ('date', 'months', '_elements', 'values')
 
     def __init__(self, date, months, map):
         '''
         :param date: date of the information
         :param months: number of months that it covers (None if balance sheet)
-        :param map: map of XBRL element name to value
+        :param map: map of XBRL element name to FinancialElement (or anything
+            with labels and values); it is copied into compact storage
         '''
         self.date = date
         self.months = months
-        self.map = map
+
+        # all values of all elements, back to back
+        self.values = array('d')
+        self._elements = {}
+        for name, element in map.items():
+            start = len(self.values)
+            self.values.extend(element.values)
+            self._elements[_intern(name)] = FinancialElement._view(
+                element.labels, self.values, start, len(self.values))
+
+    @property
+    def map(self):
+        '''Read-only view of XBRL element name to FinancialElement'''
+        return MappingProxyType(self._elements)
+
+    def to_dict(self):
+        return {'date': self.date, 'months': self.months, 'map': dict(self._elements)}
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
 
 
 class FinancialReport:
@@ -114,6 +185,7 @@ The next part differs based on 10-K and 10-Q
 '''
 
 
+@metrics.timed('financials.get_financial_report')
 def get_financial_report(company, date_filed, financial_html_text):
     '''
     Returns a FinancialReport from html-structured financial data
@@ -129,6 +201,7 @@ def get_financial_report(company, date_filed, financial_html_text):
     return financial_report
 
 
+@metrics.timed('financials.process_financial_info')
 def _process_financial_info(financial_html_text):
     '''
     Return a list of FinancialInfo objects from html-structured financial data
@@ -136,17 +209,16 @@ def _process_financial_info(financial_html_text):
     :param financial_html_text: html-structured financial data from an annual
         or quarterly Edgar filing
     '''
+    from bs4 import BeautifulSoup  # slow to import, only needed for statements
+
     source_soup = BeautifulSoup(financial_html_text, 'html.parser')
     report = source_soup.find('table', {'class': 'report'})
     rows = report.find_all('tr')
 
-    financial_info = []
-
     dates, period_units, unit_text = _get_statement_meta_data(rows)
 
-    for i, date in enumerate(dates):
-        dt = datetime.strptime(date, '%b. %d, %Y')
-        financial_info.append(FinancialInfo(dt, period_units[i], {}))
+    # one {xbrl_element: (labels, values)} map per column
+    columns = [{} for date in dates]
 
     for row_num, row in enumerate(rows):
         data = row.find_all('td')
@@ -189,26 +261,23 @@ def _process_financial_info(financial_html_text):
 
             if processed_financial_value is not None:
                 # print(index)
-                if index - 1 not in range(len(financial_info)):
-                    print('index-1 {} is too big to capture {}'.format(index - 1, processed_financial_value))
-                financial_info_map = financial_info[index - 1].map
+                if index - 1 not in range(len(columns)):
+                    logger.warning('index-1 %d is too big to capture %s', index - 1, processed_financial_value)
+                financial_info_map = columns[index - 1]
 
                 if xbrl_element not in financial_info_map:
                     # handles adjustment details
                     # e.g. https://www.sec.gov/Archives/edgar/data/867773/0000867773-18-000082.txt
-                    financial_info_map[xbrl_element] = FinancialElement([], [], [])
+                    financial_info_map[xbrl_element] = FinancialElement.Builder([], [])
 
                 financial_info_map[xbrl_element].labels.append(label)
                 financial_info_map[xbrl_element].values.append(processed_financial_value)
-                financial_info_map[xbrl_element].values_raw.append(processed_financial_value)
 
     # clean reports
     # colspans sometimes cause duplicate reports with empty maps
-    for fi in financial_info:
-        if not fi.map:
-            financial_info.remove(fi)
-
-    return financial_info
+    return [FinancialInfo(datetime.strptime(date, '%b. %d, %Y'), period_units[i], column)
+            for i, (date, column) in enumerate(zip(dates, columns))
+            if column]
 
 
 def _get_statement_meta_data(rows):
@@ -363,6 +432,7 @@ def _process_financial_value(text, xbrl_element, unit_text):
             value = value * 1000
 
     except ValueError:
-        print('Warning: {} (from {}) is not numeric even after removing special characters () - ignoring'.format(text, xbrl_element, amount_text))
+        logger.warning('%s (from %s) is not numeric even after removing special characters () - ignoring',
+                       text, xbrl_element)
 
     return value
@@ -1,50 +1,91 @@
-import requests
 import os
 import calendar
-from cachecontrol import CacheControl
-from cachecontrol.heuristics import BaseHeuristic
-from cachecontrol.caches.file_cache import FileCache
+import threading
 from datetime import datetime, timedelta
 from email.utils import parsedate, formatdate
+from thingy import metrics
 
 
 CACHE_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'cache')
 
 
-class AlwaysCache(BaseHeuristic):
-
-    def update_headers(self, response):
-        # Don't let the header determine if this is cached
-        # Always cache it!
-        date = parsedate(response.headers['date'])
-        expires = datetime(*date[:6]) + timedelta(weeks=1)
-        return {
-            'expires': formatdate(calendar.timegm(expires.timetuple())),
-            'cache-control': 'public',
-        }
+def always_cache(response):
+    '''
+    Headers of the AlwaysCache heuristic (see GetRequest.session): cache
+    every response for a week, whatever its headers say
+    '''
+    date = parsedate(response.headers['date'])
+    expires = datetime(*date[:6]) + timedelta(weeks=1)
+    return {
+        'expires': formatdate(calendar.timegm(expires.timetuple())),
+        'cache-control': 'public',
+    }
 
 
 class GetRequest:
 
     # XXX Need to figure out a better caching strategy
-    SESSION = CacheControl(requests.Session(),
-                           heuristic=AlwaysCache(),
-                           cache=FileCache(CACHE_DATA_PATH, forever=True))
+    # Created on the first request, requests and cachecontrol are slow to import
+    SESSION = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def session(cls):
+        with cls._session_lock:
+            if cls.SESSION is None:
+                import requests
+                from cachecontrol import CacheControl
+                from cachecontrol.caches.file_cache import FileCache
+                from cachecontrol.heuristics import BaseHeuristic
+
+                class AlwaysCache(BaseHeuristic):
+
+                    def update_headers(self, response):
+                        # Don't let the header determine if this is cached
+                        # Always cache it!
+                        return always_cache(response)
 
-    def __init__(self, url, cache=True):
+                cls.SESSION = CacheControl(requests.Session(),
+                                           heuristic=AlwaysCache(),
+                                           cache=FileCache(CACHE_DATA_PATH, forever=True))
+            return cls.SESSION
+
+    @metrics.timed('http.get')
+    def __init__(self, url, cache=True, headers=None):
+        '''
+        :param headers: extra request headers; with If-None-Match or
+            If-Modified-Since, a 304 Not Modified response is accepted too
+            (see not_modified)
+        '''
+        import requests
 
         if cache:
-            _requests = self.SESSION
+            _requests = self.session()
         else:
             _requests = requests
 
-        response = _requests.get(url, headers={'Accept-Encoding': 'gzip,deflate,sdch'})
+        headers = dict({'Accept-Encoding': 'gzip,deflate,sdch'}, **(headers or {}))
+        response = _requests.get(url, headers=headers)
         response.encoding = 'utf-8'
-        if response.status_code != requests.codes.ok:
-            raise RequestException('{}: {}'.format(response.status_code, response.text))
+
+        metrics.count('http.requests')
+        metrics.count('http.bytes', len(response.content))
+        metrics.count('http.cache.hit' if getattr(response, 'from_cache', False) else 'http.cache.miss')
+
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+        if not (response.status_code == requests.codes.ok
+                or conditional and response.status_code == requests.codes.not_modified):
+            raise RequestException('{}: {}'.format(response.status_code, response.text),
+                                   status_code=response.status_code)
 
         self.response = response
 
+    @property
+    def not_modified(self):
+        return self.response.status_code == 304
+
 
 class RequestException(Exception):
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
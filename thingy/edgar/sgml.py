@@ -3,6 +3,10 @@ This file will be used to parse the sgml of an SEC document/filing
 given a DTD (dtd)
 '''
 import re
+import logging
+from thingy import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class SgmlException(Exception):
@@ -11,10 +15,12 @@ class SgmlException(Exception):
 
 class Sgml:
 
+    @metrics.timed('sgml.parse')
     def __init__(self, document, dtd):
         self.dtd = dtd
         self.document = document
         self.map = self._parse_sgml(document)
+        metrics.count('sgml.bytes', len(document))
 
 
     def _parse_sgml(self, data) -> dict():
@@ -136,8 +142,7 @@ class Sgml:
 
             if key in result and not element.repeats:
                 # for QA...
-                print('overriding '+key+':'+str(result[key]))
-                print('with '+key+':'+str(value))
+                logger.warning('Overriding %s:%s with %s:%s', key, result[key], key, value)
 
             if element.repeats:
                 # dealing with a list
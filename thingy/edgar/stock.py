@@ -1,31 +1,49 @@
 '''
 This module ties it all together; it will be the main module that's used
 '''
-import pandas as pd
+import csv
+import logging
 from thingy.edgar.edgar import get_financial_filing_info, get_latest_quarter_dir, find_latest_filing_info_going_back_from, SYMBOLS_DATA_PATH
 from thingy.edgar.filing import Filing
+from thingy.edgar.requests_wrapper import GetRequest
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 
 class Stock:
-    def __init__(self, symbol):
+    def __init__(self, symbol, cik=None):
+        '''
+        :param cik: the cik of the symbol, looked up in symbols.csv if not given
+        '''
         self.symbol = symbol
-        self.cik = self._find_cik()
+        self.cik = cik if cik is not None else self._find_cik()
 
     def _find_cik(self):
-        df = pd.read_csv(SYMBOLS_DATA_PATH, converters={'cik': str})
-        try:
-            cik = df.loc[df['symbol'] == self.symbol]['cik'].iloc[0]
-            print('cik for {} is {}'.format(self.symbol, cik))
-            return cik
-        except IndexError as e:
-            raise IndexError('could not find cik, must add to symbols.csv') from None
+        with open(SYMBOLS_DATA_PATH, newline='') as f:
+            for row in csv.DictReader(f):
+                if row['symbol'] == self.symbol:
+                    logger.debug('cik for %s is %s', self.symbol, row['cik'])
+                    return row['cik']
+        raise IndexError('could not find cik, must add to symbols.csv')
 
     def get_filing(self, period='annual', year=0, quarter=0):
         '''
         Returns the Filing closest to the given period, year, and quarter.
         Raises NoFilingInfoException if nothing is found for the params.
 
+        :param period: either "annual" (default) or "quarterly"
+        :param year: year to search, if 0, will default latest
+        :param quarter: 1, 2, 3, 4, or default value of 0 to get the latest
+        '''
+        return self.load_filing(self.get_filing_info(period=period, year=year, quarter=quarter))
+
+    def get_filing_info(self, period='annual', year=0, quarter=0):
+        '''
+        Returns the FilingInfo closest to the given period, year, and quarter
+        without downloading the filing itself.
+        Raises NoFilingInfoException if nothing is found for the params.
+
         :param period: either "annual" (default) or "quarterly"
         :param year: year to search, if 0, will default latest
         :param quarter: 1, 2, 3, 4, or default value of 0 to get the latest
@@ -36,11 +54,9 @@ class Stock:
             # get the latest
             current_year = datetime.now().year if year == 0 else year
             current_quarter = quarter if quarter > 0 else get_latest_quarter_dir(current_year)[0]
-            print(
-                'No {} filing info found for year={} quarter={}. Finding latest.'.format(
-                    period,
-                    current_year,
-                    current_quarter))
+            logger.info('No %s filing info found for year=%d quarter=%d. Finding latest.',
+                        period, current_year, current_quarter,
+                        extra={'symbol': self.symbol, 'period': period, 'stage': 'resolve'})
 
             # go back through the quarters to find the latest
             filing_info_list = find_latest_filing_info_going_back_from(period, self.cik, current_year, current_quarter)
@@ -49,7 +65,8 @@ class Stock:
                 # we still have nothing, one last try with the previous year
                 # this is useful when you're checking for data early on in a
                 # calendar year, since it takes time for the filings to come in
-                print('Will do a final attempt to find filing info from last year')
+                logger.info('Will do a final attempt to find filing info from last year',
+                            extra={'symbol': self.symbol, 'period': period, 'stage': 'resolve'})
                 filing_info_list = find_latest_filing_info_going_back_from(period, self.cik, current_year - 1, 4)
 
             if len(filing_info_list) == 0:
@@ -57,12 +74,20 @@ class Stock:
                 raise NoFilingInfoException(
                     'No filing info found. Try a different period (annual/quarterly), year, and/or quarter.')
 
-        filing_info = filing_info_list[0]
+        return filing_info_list[0]
 
-        url = filing_info.url
-        filing = Filing(company=self.symbol, url=url)
+    def load_filing(self, filing_info):
+        '''
+        Downloads and parses the Filing described by filing_info
+        '''
+        return Filing(company=self.symbol, url=filing_info.url)
 
-        return filing
+    def download_filing(self, filing_info):
+        '''
+        Downloads the submission of the Filing described by filing_info,
+        leaving it to be parsed (see filing.parse_submission)
+        '''
+        return GetRequest(filing_info.url).response.text
 
 
 class NoFilingInfoException(Exception):
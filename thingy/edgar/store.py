@@ -0,0 +1,294 @@
+'''
+Local time-series store of financial datapoints
+
+Every column of every statement parsed from a filing is written here, keyed by
+(CIK, statement, concept, period end, months), so that comparative columns (prior year
+quarters in a 10-Q, prior years in a 10-K) can answer later requests without
+downloading and parsing another filing.
+
+Each datapoint remembers the accession of the filing it came from. When the
+same datapoint is reported again (e.g. restated in a later filing), the most
+recently filed one wins.
+
+statement is one of STATEMENTS, or '' when the source of the datapoint does not
+say which statement it belongs to.
+
+Engines only keep their store across runs when one is configured, either by
+passing a FactStore or by setting THINGY_FACT_STORE to its path (see
+FactStore.configured); otherwise results would depend on what earlier runs
+happened to write. The ingest tools default to FACT_STORE_PATH.
+'''
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, date
+
+
+FACT_STORE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'facts.sqlite')
+FACT_STORE_ENV = 'THINGY_FACT_STORE'
+
+STATEMENTS = ('balance_sheet', 'cash_flow', 'income_statements')
+
+# Taxonomies of cover page (document and entity information) values, e.g.
+# dei_EntityCommonStockSharesOutstanding: these are not part of any statement
+# and are dated as of the cover, after the period end, so sources that do not
+# say which statement a datapoint belongs to must leave them out (otherwise
+# they make up the latest snapshot column, see collections.Report.from_store)
+COVER_TAXONOMIES = ('dei',)
+
+# SQLite before 3.32 takes at most 999 parameters per statement, so lists of
+# CIKs are queried in chunks
+MAX_VARIABLES = 999
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS facts (
+    cik TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    concept TEXT NOT NULL,
+    period_end TEXT NOT NULL,   -- ISO date
+    months INTEGER NOT NULL,    -- 0 for snapshots (balance sheet)
+    value REAL NOT NULL,
+    labels TEXT NOT NULL,       -- JSON list
+    accession TEXT NOT NULL,
+    date_filed TEXT NOT NULL,   -- ISO date
+    PRIMARY KEY (cik, statement, concept, period_end, months)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS facts_by_period ON facts (cik, period_end);
+CREATE TABLE IF NOT EXISTS companies (
+    cik TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    sic TEXT,                   -- Standard Industrial Classification code
+    fiscal_year_end TEXT,       -- MMDD
+    date_filed TEXT NOT NULL    -- ISO date of the filing this was last taken from
+) WITHOUT ROWID;
+'''
+
+UPSERT = '''
+INSERT INTO facts (cik, statement, concept, period_end, months, value, labels, accession, date_filed)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (cik, statement, concept, period_end, months) DO UPDATE SET
+    value = excluded.value,
+    labels = excluded.labels,
+    accession = excluded.accession,
+    date_filed = excluded.date_filed
+WHERE (excluded.date_filed, excluded.accession) >= (facts.date_filed, facts.accession)
+'''
+
+UPSERT_COMPANY = '''
+INSERT INTO companies (cik, name, sic, fiscal_year_end, date_filed)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (cik) DO UPDATE SET
+    name = excluded.name,
+    sic = excluded.sic,
+    fiscal_year_end = excluded.fiscal_year_end,
+    date_filed = excluded.date_filed
+WHERE excluded.date_filed >= companies.date_filed
+'''
+
+
+class Fact:
+    '''
+    A datapoint read back from the store; quacks like a FinancialElement
+    '''
+    __slots__ = ('labels', 'values', 'accession', 'date_filed')
+
+    def __init__(self, labels, value, accession, date_filed):
+        self.labels = labels
+        self.values = [value]
+        self.accession = accession
+        self.date_filed = date_filed
+
+    def __repr__(self):
+        return str({'labels': self.labels, 'values': self.values, 'accession': self.accession})
+
+
+class Column:
+    '''
+    A column of datapoints read back from the store; quacks like a FinancialInfo
+    '''
+    __slots__ = ('date', 'months', 'map')
+
+    def __init__(self, date, months, map=None):
+        self.date = date
+        self.months = months
+        self.map = {} if map is None else map
+
+    def __repr__(self):
+        return str({'date': self.date, 'months': self.months, 'map': self.map})
+
+
+class FactStore:
+
+    def __init__(self, path=FACT_STORE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def configured(cls):
+        '''
+        The store at THINGY_FACT_STORE, or an in-memory one (lasting as long
+        as the FactStore) when it is not set
+        '''
+        return cls(os.environ.get(FACT_STORE_ENV) or ':memory:')
+
+    @property
+    def connection(self):
+        # Opened lazily so that merely creating an Engine has no side effects
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def add_facts(self, rows):
+        '''
+        Insert or update datapoints; an existing datapoint is only replaced
+        by one from a filing that was filed at the same time or later
+
+        :param rows: iterable of (cik, statement, concept, period_end, months,
+            value, labels, accession, date_filed) where period_end and
+            date_filed are dates, months is None for snapshots and labels is a
+            list
+        '''
+        with self._lock, self.connection:
+            self.connection.executemany(UPSERT, (
+                (cik, statement or '', concept, _isoformat(period_end), months or 0, value,
+                 json.dumps(list(labels)), accession, _isoformat(date_filed))
+                for cik, statement, concept, period_end, months, value, labels, accession, date_filed in rows))
+
+    def add_financial_info(self, cik, statement, accession, date_filed, financial_info):
+        '''
+        Store one column (FinancialInfo) of a parsed statement
+        '''
+        if financial_info.date is None:
+            return
+        self.add_facts(
+            (cik, statement, concept, financial_info.date, financial_info.months, sum(element.values),
+             [label for label in element.labels if label is not None], accession, date_filed)
+            for concept, element in financial_info.map.items()
+            if concept is not None)
+
+    def add_filing(self, cik, filing):
+        '''
+        Store every column of every statement of a parsed edgar.filing.Filing
+        '''
+        for statement, financial_report in (('balance_sheet', filing.get_balance_sheets()),
+                                            ('cash_flow', filing.get_cash_flows()),
+                                            ('income_statements', filing.get_income_statements())):
+            for financial_info in financial_report.reports:
+                self.add_financial_info(cik, statement, filing.accession, filing.date_filed, financial_info)
+
+    def add_companies(self, rows):
+        '''
+        Insert or update companies, keeping the details of the latest filing
+
+        :param rows: iterable of (cik, name, sic, fiscal_year_end, date_filed)
+            where date_filed is a date and sic may be None
+        '''
+        with self._lock, self.connection:
+            self.connection.executemany(UPSERT_COMPANY, (
+                (cik, name, sic, fiscal_year_end, _isoformat(date_filed))
+                for cik, name, sic, fiscal_year_end, date_filed in rows))
+
+    def get_company(self, cik):
+        '''
+        Return {'cik', 'name', 'sic', 'fiscal_year_end'} of cik, or None
+        '''
+        return self.get_companies([cik]).get(cik)
+
+    def get_companies(self, ciks):
+        '''
+        Return {cik: {'cik', 'name', 'sic', 'fiscal_year_end'}} of the
+        companies of ciks that are known
+        '''
+        rows = []
+        with self._lock:
+            for chunk in chunks(ciks, MAX_VARIABLES):
+                rows.extend(self.connection.execute(
+                    'SELECT cik, name, sic, fiscal_year_end FROM companies WHERE cik IN ({})'.format(
+                        ', '.join('?' * len(chunk))), chunk))
+        return {row[0]: dict(zip(('cik', 'name', 'sic', 'fiscal_year_end'), row)) for row in rows}
+
+    def get_fiscal_year_end(self, cik):
+        '''
+        Return the fiscal year end (MMDD) of cik, or None if unknown
+        '''
+        return self.get_fiscal_year_ends([cik]).get(cik)
+
+    def get_fiscal_year_ends(self, ciks):
+        '''
+        Return {cik: fiscal year end (MMDD)} of the companies of ciks, as
+        given in the companies table or else taken from the period end of
+        their latest 12 months datapoint
+        '''
+        fiscal_year_ends = {}
+        with self._lock:
+            for chunk in chunks(ciks, MAX_VARIABLES):
+                fiscal_year_ends.update(
+                    (cik, period_end[5:7] + period_end[8:10]) for cik, period_end in self.connection.execute(
+                        'SELECT cik, MAX(period_end) FROM facts WHERE cik IN ({}) AND months = 12 '
+                        'GROUP BY cik'.format(', '.join('?' * len(chunk))), chunk))
+        fiscal_year_ends.update(
+            (cik, company['fiscal_year_end']) for cik, company in self.get_companies(ciks).items()
+            if company['fiscal_year_end'])
+        return fiscal_year_ends
+
+    def get_columns(self, cik, start, end):
+        '''
+        Return {(statement, period_end, months): Column} for every datapoint
+        of cik with start <= period_end <= end. months is None for snapshots.
+        '''
+        return self.get_columns_many([cik], start, end).get(cik, {})
+
+    def get_columns_many(self, ciks, start, end):
+        '''
+        Return {cik: {(statement, period_end, months): Column}} (see
+        get_columns) for the companies of ciks that have datapoints
+        '''
+        companies = {}
+        parsed = {}  # the same labels come back for many companies
+        for cik, statement, concept, period_end, months, value, labels, accession, date_filed in \
+                self.get_datapoints(ciks, start, end):
+            columns = companies.setdefault(cik, {})
+            key = (statement, date.fromisoformat(period_end), months or None)
+            if key not in columns:
+                columns[key] = Column(key[1], key[2])
+            if labels not in parsed:
+                parsed[labels] = json.loads(labels)
+            columns[key].map[concept] = Fact(parsed[labels], value, accession, date_filed)
+        return companies
+
+    def get_datapoints(self, ciks, start, end):
+        '''
+        Return the (cik, statement, concept, period_end, months, value,
+        labels, accession, date_filed) rows of ciks with start <= period_end
+        <= end, as stored: dates in ISO format, months 0 for snapshots and
+        labels a JSON list
+        '''
+        rows = []
+        with self._lock:
+            for chunk in chunks(ciks, MAX_VARIABLES - 2):
+                rows.extend(self.connection.execute(
+                    'SELECT cik, statement, concept, period_end, months, value, labels, accession, date_filed '
+                    'FROM facts WHERE cik IN ({}) AND period_end BETWEEN ? AND ?'.format(
+                        ', '.join('?' * len(chunk))),
+                    chunk + [_isoformat(start), _isoformat(end)]))
+        return rows
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def chunks(values, size):
+    '''Lists of at most size of values, in order'''
+    values = list(values)
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat()
@@ -1,46 +1,95 @@
 from __future__ import annotations
+import copy
+import time
 import itertools
-import yaml
-import xmltodict
+import logging
+from collections import Counter
 import lxml.etree
-import mako.exceptions
-from typing import Union, Any
-from thingy.edgar.stock import Stock as EdgarStock
-from thingy.market_watch import Stock as MarketWatchStock
+from typing import TYPE_CHECKING, Any, Optional
 from transitions.core import EventData
 from lxml.objectify import ObjectifiedElement
-from icecream import ic
+from thingy import metrics
+from thingy.cache import LRUCache
+from thingy.catalog import Catalog
 from thingy.collections import Report, Date
-from thingy.state import State, DeferredEval, ResultKey
+from thingy.state import State, DeferredEval, ResultKey, ResultValue
 from thingy.metric_handlers import Fact, Ratio
 from transitions.extensions import HierarchicalMachine as Machine
-from mako.template import Template
 from thingy.edgar.stock import NoFilingInfoException
+from thingy.edgar.filing import NoFinancialDataException
+from thingy.log import rate_limited
+from thingy.edgar.store import FactStore
+from thingy.negative_cache import Miss, NegativeCache, NO_FILING, NO_STATEMENTS, PROVIDER_ERROR, UNKNOWN_SYMBOL
+from thingy.providers import NotCoveredError, Provider, ProvidersFailedError, ProviderRegistry
+from thingy.view import render
+from thingy.export import export as export_results
+
+if TYPE_CHECKING:
+    from mako.template import Template
+
+logger = rate_limited(logging.getLogger(__name__))
+
+# Filings hold the raw submission text, so only keep a handful of them around
+FILING_CACHE_SIZE = 8
+REPORT_CACHE_SIZE = 128
+# Failures meaning a cell has nothing to compare, rather than that a provider broke
+MISSES = (NoFilingInfoException, NoFinancialDataException)
+
+
+def machine_config(logic: ObjectifiedElement) -> dict:
+    '''The state machine configuration in the logic (see also thingy.snapshot)'''
+    import xmltodict
+    return xmltodict.parse(lxml.etree.tostring(logic.machine))['machine']
 
 
 class Engine(Machine):
-    def __init__(self, symbols: list[str], logic: ObjectifiedElement, template_engine: Template):
+    def __init__(self, symbols: list[str], logic: ObjectifiedElement, template_engine: Template,
+                 filing_cache_size: int = FILING_CACHE_SIZE, report_cache_size: int = REPORT_CACHE_SIZE,
+                 fact_store: Optional[FactStore] = None, providers: Optional[ProviderRegistry] = None,
+                 filings: Optional[LRUCache] = None, reports: Optional[LRUCache] = None,
+                 machine: Optional[dict] = None, catalog: Optional[Catalog] = None,
+                 misses: Optional[NegativeCache] = None):
+        '''
+        filings, reports, fact_store, providers and misses may be shared
+        between engines (e.g. by thingy.service) to keep their caches warm, as
+        may the machine configuration (see machine_config). Without a
+        fact_store, the configured one is used, if any, else an in-memory one
+        (see FactStore.configured).
+
+        Cells found to have nothing to compare are remembered in misses (by
+        default, in the database of the fact store) and skipped until the
+        miss expires, see thingy.negative_cache.
+
+        Given a catalog (see thingy.catalog), regexp queries resolved ahead of
+        time are answered from hash lookups for reports built from the fact
+        store, and the queries answering facts
+        are recorded in it.
+        '''
         self.context = State()
         self.symbols = symbols
         self.logic = logic
         self.template_engine = template_engine
+        self.providers = ProviderRegistry.default() if providers is None else providers
+        self.filings = LRUCache(filing_cache_size, name='filings') if filings is None else filings
+        self.reports = LRUCache(report_cache_size, name='reports') if reports is None else reports
+        self.fact_store = FactStore.configured() if fact_store is None else fact_store
+        self.catalog = catalog
+        self.misses = NegativeCache(self.fact_store.path) if misses is None else misses
+        # ResultKey -> (provider, filing info) of filings pinned to cells, see recompute()
+        self.pinned = dict()
+        # ResultKey -> (provider, filing info, filing or None) resolved and
+        # possibly fetched ahead of time (see thingy.pipeline); unlike pinned
+        # ones, the fact store still comes first
+        self.resolved = dict()
         super().__init__(
             send_event=True,
-            **xmltodict.parse(
-                lxml.etree.tostring(
-                    logic.machine
-                )
-            )['machine']
+            **copy.deepcopy(machine_config(logic) if machine is None else machine)
         )
 
     def execute(self, dates: dict[str, Date]) -> Engine:
-        ic(dates)
-
-        self.START(dates=dates)
+        logger.debug('Executing %s for %s', self.symbols, dates)
 
-        for group in itertools.chain(self.logic.facts.groups.group,
-                                     self.logic.ratios.groups.group):
-            self.GROUP(group=group)
+        self.start(dates)
 
         for period, date_list in dates.items():
 
@@ -50,45 +99,304 @@ class Engine(Machine):
                 self.SYMBOL(symbol=symbol)
 
                 for date in date_list:
-                    try:
-                        self.DATE(date=date)
-
-                        for fact in self.logic.facts.fact:
-                            self.FACT(fact=fact)
-                            if hasattr(fact, 'eval'):
-                                self.EVAL(eval=fact.eval)
-                            if hasattr(fact, 'query'):
-                                for query in fact.query:
-                                    self.QUERY(query=query)
-
-                        for ratio in self.logic.ratios.ratio:
-                            self.RATIO(ratio=ratio)
-                    except NoFilingInfoException as e:
-                        ic(e)
-                        ic(self.context.key)
-                        print('WARNING: No filing found, skipping...')
+                    self.execute_cell(period, symbol, date)
+        self.finish()
+        return self
+
+    def finish(self):
+        '''End a run: log its stats and record the queries answering facts in the catalog'''
         self.END()
+        self.log_stats()
+        if self.catalog is not None:
+            self.catalog.add_answers(self.context.answers)
+
+    def log_stats(self):
+        logger.info('Query results: %d memoized, %d computed, %d regexp queries resolved ahead of time',
+                    self.context.query_stats['hits'], self.context.query_stats['misses'],
+                    self.context.query_stats['resolved'])
+        fallbacks = Counter()
+        for (fact, position), cells in self.context.answers.items():
+            if position:
+                fallbacks[fact] += cells
+        if fallbacks:
+            logger.info('Facts answered by a fallback query: %s',
+                        ', '.join(f'{fact} ({cells} cells)' for fact, cells in fallbacks.most_common()))
+        for provider in self.providers:
+            if provider.stats.calls:
+                logger.info('%s: %s', provider, provider.stats)
+        if self.context.skipped:
+            reasons = Counter(miss.reason for miss in self.context.skipped.values())
+            logger.info('Skipped %d cells with nothing to compare: %s', len(self.context.skipped),
+                        ', '.join(f'{count} {reason}' for reason, count in reasons.most_common()))
+
+    def start(self, dates: dict[str, Date]) -> Engine:
+        '''Reset the results and set up the facts and ratios, ahead of computing cells'''
+        self.START(dates=dates)
 
+        for group in itertools.chain(self.logic.facts.groups.group,
+                                     self.logic.ratios.groups.group):
+            self.GROUP(group=group)
         return self
 
+    def execute_cell(self, period: str, symbol: str, date: Date):
+        '''
+        Compute one (symbol, date) cell; the machine must be in
+        ProcessingSymbol. Cells known to have nothing to compare with these
+        providers are skipped (unless pinned, or answered by the fact store
+        since), and cells found to have nothing are remembered. Cells some
+        provider failed to answer otherwise are skipped for this run only.
+        '''
+        start = time.perf_counter()
+        key = ResultKey(period, symbol, date.year, date.quarter)
+        scope = self.providers.scope
+        miss = None if key in self.pinned else self.misses.get(symbol, period, date, scope)
+        if miss is not None and self.in_store(symbol, period, date):
+            logger.info('%dQ%d is in the fact store now, computing it', date.year, date.quarter,
+                        extra={'symbol': symbol, 'period': period, 'stage': 'store'})
+            self.misses.discard(symbol, period, date)
+            miss = None
+        if miss is not None:
+            logger.debug('Skipping %dQ%d, known to have nothing to compare: %s', date.year, date.quarter,
+                         miss.reason, extra={'symbol': symbol, 'period': period, 'stage': 'resolve'})
+            self.context.skipped[key] = miss
+            metrics.observe('engine.cell', symbol, time.perf_counter() - start)
+            return
+
+        try:
+            self.DATE(date=date)
+
+            for fact in self.logic.facts.fact:
+                self.FACT(fact=fact)
+                if hasattr(fact, 'eval'):
+                    self.EVAL(eval=fact.eval)
+                if hasattr(fact, 'query'):
+                    for query in fact.query:
+                        self.QUERY(query=query)
+
+            for ratio in self.logic.ratios.ratio:
+                self.RATIO(ratio=ratio)
+        except MISSES as e:
+            logger.warning('No filing found for %dQ%d, skipping: %s', date.year, date.quarter, e,
+                           extra={'symbol': symbol, 'period': period, 'stage': 'resolve'})
+            self.abandon_cell(key)
+            reason = NO_FILING if isinstance(e, NoFilingInfoException) else NO_STATEMENTS
+            self.context.skipped[key] = self.misses.add(symbol, period, date, reason, str(e), scope)
+        except NotCoveredError as e:
+            logger.warning('%s, skipping', e, extra={'symbol': symbol, 'period': period, 'stage': 'resolve'})
+            self.abandon_cell(key)
+            self.context.skipped[key] = self.misses.add_symbol(symbol, UNKNOWN_SYMBOL, str(e), scope)
+        except ProvidersFailedError as e:
+            logger.warning('Unable to resolve %dQ%d, skipping for now: %s', date.year, date.quarter, e,
+                           extra={'symbol': symbol, 'period': period, 'stage': 'resolve'})
+            self.abandon_cell(key)
+            self.context.skipped[key] = Miss(symbol, period, date.year, date.quarter, PROVIDER_ERROR, str(e),
+                                             time.time(), scope)
+        finally:
+            metrics.observe('engine.cell', symbol, time.perf_counter() - start)
+
+    def in_store(self, symbol: str, period: str, date: Date) -> bool:
+        '''
+        Whether the fact store answers a cell as it is, e.g. once a data set
+        has been ingested (see thingy.edgar.datasets), without loading
+        anything into it
+        '''
+        ciks = {provider.cik(symbol) for provider in self.providers} - {None}
+        return any(Report.from_store(self.fact_store, cik, period, date) is not None for cik in ciks)
+
+    def recompute(self, period: str, symbol: str, date: Date,
+                  filing: Optional[tuple[Provider, Any]] = None) -> Optional[ResultValue]:
+        '''
+        Recompute a single cell of the last execute(), leaving the others
+        alone, e.g. once a new filing is out (see thingy.watch). filing, a
+        (provider, filing info) pair, answers the cell when given, rather than
+        the fact store and the provider indexes, which may predate the filing.
+        '''
+        if not self.context:
+            raise RuntimeError('execute() must be run before recompute()')
+        if symbol not in self.context.metadata.symbols:
+            raise ValueError(f'{symbol} is not part of this comparison')
+
+        key = ResultKey(period, symbol, date.year, date.quarter)
+        self.drop_result(key)
+        self.context.skipped.pop(key, None)
+        dates = self.context.metadata.dates.setdefault(period, [])
+        if date not in dates:
+            dates.append(date)
+            dates.sort()
+        if filing is not None:
+            self.pinned[key] = filing
+
+        try:
+            self.set_state('ProcessingSymbol')
+            self.PERIOD(period=period)
+            self.SYMBOL(symbol=symbol)
+            self.execute_cell(period, symbol, date)
+            self.END()
+        finally:
+            self.pinned.pop(key, None)
+        if key in self.context.result:
+            self.misses.discard(symbol, period, date)
+        return self.context.result.get(key)
+
+    def abandon_cell(self, key: ResultKey):
+        '''
+        Leave a cell that cannot be computed: forget what was computed of it
+        and get back to ProcessingSymbol without validating it (see
+        on_exit_ProcessingSymbol_Date), ready for the next one
+        '''
+        self.drop_result(key)
+        self.context.report = None
+        self.set_state('ProcessingSymbol')
+
+    def drop_result(self, key: ResultKey):
+        '''Forget the result of a cell, e.g. one only partly computed'''
+        if (previous := self.context.result.pop(key, None)) is not None and previous.accession:
+            self.context.filings[previous.accession].remove(key)
+
+    @metrics.timed('engine.write')
     def write(self, target: str):
+        '''Render the report to target, streaming it out as it is rendered'''
         if not self.context:
             raise RuntimeError('execute() must be run before write()')
         with open(target, 'w') as f:
             try:
-                f.write(
-                    self.template_engine.render(
-                        ResultKey=ResultKey,
-                        **self.context.to_dict()
-                    )
-                )
+                render(self.template_engine, self.context, f)
             except BaseException:
-                ic(mako.exceptions.text_error_template().render())
+                import mako.exceptions
+                logger.error('Unable to render the report:\n%s', mako.exceptions.text_error_template().render())
                 raise
 
+    @metrics.timed('engine.export')
+    def export(self, target: str, format: Optional[str] = None) -> str:
+        '''Export the results as a table, see thingy.export; returns the path written'''
+        if not self.context:
+            raise RuntimeError('execute() must be run before export()')
+        return export_results(self.context, target, format)
+
+    def get_report(self, symbol: str, period: str, date: Date) -> Report:
+        '''
+        Resolve the filing for a (symbol, date) cell and return its Report,
+        trying each provider covering the symbol in turn. The provider
+        answering is recorded in the result, along with why the preferred
+        ones failed when it is a fallback, as they mix sources. When they
+        all fail for lack of a filing, the first miss (see MISSES) is raised,
+        or NotCoveredError if none of them knows the symbol after all, so that
+        the cell is skipped and remembered; when some failed otherwise, e.g.
+        on a server error, ProvidersFailedError is, so that it is skipped
+        without being remembered. Either way the run goes on.
+        '''
+        if (pinned := self.pinned.get(self.context.key)) is not None:
+            provider, filing_info = pinned
+            report = self.get_provider_report(provider, symbol, period, date, filing_info)
+            self.context.current_result.provider = provider.name
+            return report
+
+        errors, failures = list(), list()
+        for provider in self.providers.route(symbol):
+            try:
+                report = self.get_provider_report(provider, symbol, period, date)
+            except Exception as e:
+                logger.warning('%s failed for %s %s %dQ%d: %r', provider, symbol, period,
+                               date.year, date.quarter, e,
+                               extra={'symbol': symbol, 'period': period, 'stage': provider.name})
+                errors.append(e)
+                failures.append(f'{provider.name}: {e}')
+                continue
+            result = self.context.current_result
+            result.provider = provider.name
+            result.fallback = '; '.join(failures) or None
+            return report
+        if all(isinstance(e, NotCoveredError) for e in errors):
+            raise errors[0]
+        if all(isinstance(e, MISSES + (NotCoveredError,)) for e in errors):
+            raise next(e for e in errors if isinstance(e, MISSES))
+        raise ProvidersFailedError('; '.join(failures)) from next(e for e in errors if not isinstance(e, MISSES))
+
+    def get_provider_report(self, provider: Provider, symbol: str, period: str, date: Date,
+                            filing_info: Any = None) -> Report:
+        '''
+        Cells are first answered from the fact store, which holds every column
+        (including comparative ones) of the filings parsed so far. Otherwise
+        the filing is fetched and all of its columns are added to the store.
+
+        Several dates frequently resolve to the same filing (a missing quarter
+        falls back to the latest available one), so both the Filing and the
+        Report built from it are memoized by accession.
+
+        A given filing_info skips both the fact store and resolution.
+        '''
+        cik = provider.cik(symbol)
+
+        if cik is not None and filing_info is None:
+            # The store window follows the filer's fiscal year end (see
+            # Date.period_end_window). Store answers skip resolution: an
+            # amendment is seen once it is in the store (the latest filed
+            # datapoint is kept), e.g. from a data set or companyfacts.
+            provider.load_facts(symbol, self.fact_store)
+            key = ('store', cik, period, date.year, date.quarter)
+            if (report := self.reports.get(key)) is None:
+                report = Report.from_store(self.fact_store, cik, period, date)
+                if report is not None:
+                    self.reports[key] = report
+            if report is not None:
+                logger.debug('%s %s %dQ%d resolved from the fact store', symbol, period, date.year, date.quarter,
+                             extra={'symbol': symbol, 'period': period, 'accession': report.accession,
+                                    'stage': 'store'})
+                self.record_accession(symbol, period, date, report.accession)
+                return self.resolve_queries(cik, report)
+
+        fetched = None
+        if filing_info is None and (resolved := self.resolved.get(self.context.key)) is not None \
+                and resolved[0] is provider:
+            _, filing_info, fetched = resolved
+        if filing_info is None:
+            filing_info = provider.resolve(symbol, period, date)
+        accession = filing_info.accession
+        self.record_accession(symbol, period, date, accession)
+
+        def load_filing():
+            if fetched is not None:
+                return self.add_filing(provider, symbol, fetched)
+            return self.load_filing(provider, symbol, filing_info)
+
+        return self.reports.get_or_create(
+            (accession, period),
+            lambda: provider.parse(self.filings.get_or_create(accession, load_filing), period))
+
+    def resolve_queries(self, cik: Optional[str], report: Report) -> Report:
+        '''
+        Add the regexp queries resolved ahead of time for the filer to a
+        report built from the fact store; the catalog is built from the
+        labels of the store, which parsed filings may not share
+        '''
+        if self.catalog is not None:
+            self.catalog.resolve(cik, report)
+        return report
+
+    def load_filing(self, provider: Provider, symbol: str, filing_info: Any):
+        return self.add_filing(provider, symbol, provider.fetch(symbol, filing_info))
+
+    def add_filing(self, provider: Provider, symbol: str, filing: Any):
+        '''Add the columns of a filing fetched from provider to the fact store'''
+        if (cik := provider.cik(symbol)) is not None:
+            self.fact_store.add_filing(cik, filing)
+        return filing
+
+    def record_accession(self, symbol: str, period: str, date: Date, accession: str):
+        '''Remember which filing answered the current cell'''
+        key = self.context.key
+        if collapsed := [other for other in self.context.filings[accession] if other != key]:
+            logger.info('%s %s %dQ%d resolved to a filing already used by %s',
+                        symbol, period, date.year, date.quarter,
+                        ', '.join(f'{other.period} {other.year}Q{other.quarter}' for other in collapsed),
+                        extra={'symbol': symbol, 'period': period, 'accession': accession, 'stage': 'resolve'})
+        self.context.filings[accession].append(key)
+        self.context.current_result.accession = accession
+
     # -------------------------------------------------
     # State handlers
 
+    @metrics.timed()
     def on_enter_Starting(self, event: EventData):
         '''Clear and re-initialize state'''
         del self.context
@@ -101,40 +409,37 @@ class Engine(Machine):
             period: sorted(date_list)
             for period, date_list in dates.items()}
 
+    @metrics.timed()
     def on_enter_ProcessingGroup_Fact(self, event: EventData):
         group = event.kwargs['group']
         result = [Fact(fact) for fact in self.logic.facts.fact
                   if fact.get('group') == group.get('id')]
         self.context.metadata.facts[str(group)] = result
 
+    @metrics.timed()
     def on_enter_ProcessingGroup_Ratio(self, event: EventData):
         group = event.kwargs['group']
         result = [Ratio(ratio) for ratio in self.logic.ratios.ratio
                   if ratio.get('group') == group.get('id')]
         self.context.metadata.ratios[str(group)] = result
 
+    @metrics.timed()
     def on_enter_ProcessingPeriod(self, event: EventData):
         self.context.period = event.kwargs['period']
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol(self, event: EventData):
         '''Store state for future use.'''
         self.context.symbol = event.kwargs['symbol']
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date(self, event: EventData):
         '''Store date for future use and get associated filing'''
 
         self.context.date = event.kwargs['date']
-
-        if len(self.context.symbol) <= 4:
-            stock = EdgarStock(self.context.symbol)
-        else:
-            stock = MarketWatchStock(self.context.symbol)
-
-        filing = stock.get_filing(self.context.period,
-                                  self.context.date.year,
-                                  self.context.date.quarter)
-
-        self.context.report = Report.new(filing, self.context.period)
+        self.context.report = self.get_report(self.context.symbol,
+                                              self.context.period,
+                                              self.context.date)
 
     def on_exit_ProcessingSymbol_Date(self, event: EventData):
         '''Perform cleanup and validation.'''
@@ -142,20 +447,17 @@ class Engine(Machine):
         self.context.report = None
 
         if self.context.deferred_evals:
-            ic(self.context)
-            ic(self.context.deferred_evals)
-            raise ValueError('Not all deferred evals have been computed')
+            raise ValueError(f'Not all deferred evals have been computed: {self.context.deferred_evals}')
 
         missing = set(fact.get('id') for fact in self.logic.facts.fact) - set(self.context.current_result.facts)
         if missing:
-            ic(missing)
-            raise ValueError('Not all facts have data')
+            raise ValueError(f'Not all facts have data: {sorted(missing)}')
 
         missing = set(ratio.get('id') for ratio in self.logic.ratios.ratio) - set(self.context.current_result.ratios)
         if missing:
-            ic(missing)
-            raise ValueError('Not all ratios have data')
+            raise ValueError(f'Not all ratios have data: {sorted(missing)}')
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date_Fact(self, event: EventData):
         fact = Fact(event.kwargs['fact'])
         self.context.fact = fact
@@ -174,18 +476,18 @@ class Engine(Machine):
         if self.context.current_result.facts.get(self.context.fact.id) is None:
             # Perhaps it was just deferred?
             if self.context.fact.id not in deferred_facts:
-                ic(self.context.symbol)
-                ic(self.context.current_result.facts)
-                ic(self.context.fact.id)
-                ic(deferred_facts)
-                raise ValueError('No value computed for fact')
+                logger.error('Facts computed so far: %s, deferred: %s', self.context.current_result.facts,
+                             deferred_facts, extra={'symbol': self.context.symbol})
+                raise ValueError(f'No value computed for fact {self.context.fact.id}')
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date_Fact_DeferredEval(self, event: EventData):
         self.context.deferred_evals.append(DeferredEval(
             fact=self.context.fact,
             eval=event.kwargs['eval']
         ))
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date_Fact_Eval(self, event: EventData):
         # If a fact has been pasesed in, use that. Else, just use the current fact
         fact = event.kwargs.get('fact', self.context.fact)
@@ -194,16 +496,21 @@ class Engine(Machine):
         result = fact.execute_eval(eval=eval, fact_context=fact_context)
         fact_context[fact.id] = result
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date_Fact_Query(self, event: EventData):
         if self.context.fact.id in self.context.current_result.facts:
             return  # Don't compute a new value if we already have one
 
-        result = self.context.fact.execute_query(event.kwargs['query'], self.context.report)
+        result = self.context.fact.execute_query(event.kwargs['query'], self.context.report,
+                                                 self.context.query_stats)
 
         if result is not None:
             # Don't save None values
             self.context.current_result.facts[self.context.fact.id] = result
+            position = sum(1 for _ in event.kwargs['query'].itersiblings('query', preceding=True))
+            self.context.answers[(self.context.fact.id, position)] += 1
 
+    @metrics.timed()
     def on_enter_ProcessingSymbol_Date_Ratio(self, event: EventData):
         ratio = event.kwargs['ratio']
         result = Ratio.calculate_ratio(ratio, self.context.current_result.facts)
@@ -219,5 +526,4 @@ class Engine(Machine):
         )
 
     def group_is_fact_group(self, event: EventData) -> bool:
-        ic(event)
         return event.kwargs['group'].getparent().getparent().tag == 'facts'
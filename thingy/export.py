@@ -0,0 +1,142 @@
+'''
+Columnar export of engine results
+
+Facts and ratios are written as one tidy table, one row per (period, symbol,
+date, fact or ratio), so they can be loaded without scraping the HTML report:
+
+    period, symbol, year, quarter, kind, id, value, a, b, accession, provider
+
+kind is either "fact" or "ratio"; a and b are the sources of a ratio (value
+being a / b) and empty for facts. accession is the filing the row came from,
+and provider the data provider it was taken from.
+
+Parquet and Feather need pyarrow; without it results are written as CSV or
+JSON Lines. Rows are written in chunks, so the whole table is never built in
+memory.
+'''
+from __future__ import annotations
+import os
+import csv
+import json
+import itertools
+import importlib.util
+from typing import Iterator, Optional
+from thingy.state import State
+
+COLUMNS = ('period', 'symbol', 'year', 'quarter', 'kind', 'id', 'value', 'a', 'b', 'accession', 'provider')
+FORMATS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv', 'jsonl': '.jsonl'}
+CHUNK_SIZE = 10_000
+
+
+def iter_rows(state: State) -> Iterator[tuple]:
+    for key, result in state.result.items():
+        for fact_id, value in result.facts.items():
+            yield (key.period, key.symbol, key.year, key.quarter, 'fact', fact_id,
+                   value, None, None, result.accession, result.provider)
+        for ratio_id, metric in result.ratios.items():
+            yield (key.period, key.symbol, key.year, key.quarter, 'ratio', ratio_id,
+                   metric.ratio, metric.a, metric.b, result.accession, result.provider)
+
+
+def has_pyarrow() -> bool:
+    # pyarrow is only imported when Parquet or Feather is written
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def default_format() -> str:
+    return 'parquet' if has_pyarrow() else 'csv'
+
+
+def export(state: State, target: str, format: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> str:
+    '''
+    Write the results in state to target and return the path written.
+
+    :param format: one of FORMATS. If not given, it is taken from the
+        extension of target or, failing that, Parquet is used if pyarrow is
+        available and CSV otherwise. The extension of the format is added to
+        target unless it already has one of FORMATS.
+    :raises ValueError: if format is given and target has the extension of
+        another of FORMATS
+    '''
+    extension = os.path.splitext(target)[1]
+    if format is None:
+        format = next((name for name, suffix in FORMATS.items() if suffix == extension), None) or default_format()
+    if format not in FORMATS:
+        raise ValueError(f'Unsupported format: {format}')
+    if extension not in FORMATS.values():
+        target += FORMATS[format]
+    elif extension != FORMATS[format]:
+        raise ValueError(f'Cannot export {format} to {target}')
+    if format in ('parquet', 'feather') and not has_pyarrow():
+        raise ImportError(f'pyarrow is required to export {format}')
+
+    WRITERS[format](_chunks(iter_rows(state), chunk_size), target)
+    return target
+
+
+def _chunks(rows: Iterator[tuple], chunk_size: int) -> Iterator[list[tuple]]:
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield chunk
+
+
+def _schema():
+    import pyarrow
+    return pyarrow.schema([
+        ('period', pyarrow.string()),
+        ('symbol', pyarrow.string()),
+        ('year', pyarrow.int64()),
+        ('quarter', pyarrow.int64()),
+        ('kind', pyarrow.string()),
+        ('id', pyarrow.string()),
+        ('value', pyarrow.float64()),
+        ('a', pyarrow.float64()),
+        ('b', pyarrow.float64()),
+        ('accession', pyarrow.string()),
+        ('provider', pyarrow.string()),
+    ])
+
+
+def _record_batch(chunk: list[tuple], schema) -> pyarrow.RecordBatch:
+    import pyarrow
+    return pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+        schema=schema)
+
+
+def _write_parquet(chunks: Iterator[list[tuple]], target: str):
+    import pyarrow.parquet
+    schema = _schema()
+    with pyarrow.parquet.ParquetWriter(target, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(_record_batch(chunk, schema))
+
+
+def _write_feather(chunks: Iterator[list[tuple]], target: str):
+    # Feather (v2) is the Arrow IPC file format
+    import pyarrow.ipc
+    schema = _schema()
+    with pyarrow.ipc.new_file(target, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(_record_batch(chunk, schema))
+
+
+def _write_csv(chunks: Iterator[list[tuple]], target: str):
+    with open(target, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in chunks:
+            writer.writerows(chunk)
+
+
+def _write_jsonl(chunks: Iterator[list[tuple]], target: str):
+    with open(target, 'w') as f:
+        for chunk in chunks:
+            f.writelines(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in chunk)
+
+
+WRITERS = {
+    'parquet': _write_parquet,
+    'feather': _write_feather,
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+}
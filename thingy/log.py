@@ -0,0 +1,99 @@
+'''
+Logging
+
+Every module logs through its own logging.getLogger(__name__), with lazy %
+formatting so that nothing is formatted unless the record is emitted.
+Records may carry structured fields, passed as extra:
+
+    logger.debug('Processing SGML at %s', url, extra={'accession': accession, 'stage': 'sgml'})
+
+and rendered by StructuredFormatter as key=value pairs after the message.
+
+Messages logged once per cell (or per row of a statement) are rate-limited
+by attaching RATE_LIMIT to their logger (see rate_limited): past a burst,
+only a few records of each message are let through per interval and the
+number suppressed meanwhile is reported on the next one.
+'''
+from __future__ import annotations
+import sys
+import time
+import logging
+import threading
+from typing import Optional, TextIO
+
+FIELDS = ('symbol', 'period', 'accession', 'stage')
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class StructuredFormatter(logging.Formatter):
+    '''Appends the structured fields of a record, e.g. "... symbol=XOM stage=parse"'''
+
+    def __init__(self, fmt: str = FORMAT, datefmt: Optional[str] = None):
+        super().__init__(fmt, datefmt)
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = ' '.join(f'{name}={value}' for name in FIELDS
+                          if (value := getattr(record, name, None)) is not None)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            fields += f'{" " if fields else ""}suppressed={suppressed}'
+        return f'{message} {fields}' if fields else message
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Let through up to burst records of each message (its unformatted
+    template), then rate per second. Errors are never dropped.
+    '''
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, level: int = logging.ERROR):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = level
+        self._buckets = dict()  # (logger, message) -> [tokens, updated, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+RATE_LIMIT = RateLimitFilter()
+
+
+def rate_limited(logger: logging.Logger) -> logging.Logger:
+    '''Rate-limit the messages of logger, short of errors (see RATE_LIMIT)'''
+    if RATE_LIMIT not in logger.filters:
+        logger.addFilter(RATE_LIMIT)
+    return logger
+
+
+def configure(level: int = logging.INFO, stream: TextIO = None) -> logging.Handler:
+    '''Log to stream (stderr by default) with structured fields, like logging.basicConfig'''
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
@@ -1,9 +1,31 @@
+from __future__ import annotations
+import os
+import json
+import logging
 import datetime
-import pandas
-import dateutil.parser
-from bs4 import BeautifulSoup
-from thingy.edgar.requests_wrapper import GetRequest
+import lxml.html
+from thingy.edgar.requests_wrapper import GetRequest, RequestException
+from thingy.edgar.stock import NoFilingInfoException
 from dataclasses import dataclass
+from typing import Union
+
+logger = logging.getLogger(__name__)
+
+# Parsed pages are kept for the run, and on disk for PAGE_TTL
+PAGE_CACHE = dict()
+PAGE_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'market_watch')
+PAGE_TTL = datetime.timedelta(days=1)
+
+MULTIPLIERS = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
+
+TABLES_XPATH = '//*[contains(@class, "region--primary")]//table[contains(@class, "table")]'
+FIXED_CELLS_XPATH = './/td//div[contains(@class, "fixed--cell")]'
+# Quarter headers, e.g. 30-Jun-2020; other header cells (item, trend) are not dates
+HEADER_DATE_FORMAT = '%d-%b-%Y'
+
+
+class UnknownSymbolException(Exception):
+    '''MarketWatch has no financials for a symbol'''
 
 
 @dataclass
@@ -24,99 +46,217 @@ class Value:
     values: float
 
 
+@dataclass
+class Page:
+    '''
+    A financials page parsed into a table of line items × quarters, with the
+    quarters in chronological order
+    '''
+    items: list[str]
+    dates: list[datetime.date]
+    values: list[list[Union[float, str]]]
+    fetched: datetime.datetime
+
+    def closest(self, year: int, quarter: int) -> int:
+        '''Index of the quarter closest to year and quarter (0 means Q4)'''
+        quarter = quarter or 4
+        return min(range(len(self.dates)),
+                   key=lambda idx: (abs(self.dates[idx].year - year),
+                                    abs((self.dates[idx].month - 1) // 3 + 1 - quarter),
+                                    -idx))
+
+    def column(self, index: int) -> dict[str, Value]:
+        return {item: Value([item], [values[index]])
+                for item, values in zip(self.items, self.values)}
+
+    def total(self, start: int, stop: int) -> dict[str, Value]:
+        '''Sum of the quarters in [start, stop); text cells keep the latest quarter'''
+        columns = dict()
+        for item, values in zip(self.items, self.values):
+            quarters = values[start:stop]
+            if all(isinstance(value, float) for value in quarters):
+                columns[item] = Value([item], [sum(quarters)])
+            else:
+                columns[item] = Value([item], [quarters[-1]])
+        return columns
+
+    def is_fresh(self) -> bool:
+        return datetime.datetime.now() - self.fetched < PAGE_TTL
+
+    def to_dict(self) -> dict:
+        return {'items': self.items,
+                'dates': [date.isoformat() for date in self.dates],
+                'values': self.values,
+                'fetched': self.fetched.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Page:
+        return cls(items=data['items'],
+                   dates=[datetime.date.fromisoformat(date) for date in data['dates']],
+                   values=data['values'],
+                   fetched=datetime.datetime.fromisoformat(data['fetched']))
+
+
+@dataclass(frozen=True)
+class FilingInfo:
+    symbol: str
+    year: int
+    quarter: int
+    period: str = 'quarterly'
+
+    @property
+    def accession(self) -> str:
+        if self.period == 'annual':
+            return f'{self.symbol}-{self.year}FY'
+        return f'{self.symbol}-{self.year}Q{self.quarter}'
+
+
 class Filing:
-    def __init__(self, symbol: str, year: int, quarter: int):
+    def __init__(self, symbol: str, year: int, quarter: int, period: str = 'quarterly'):
         self.year = year
         self.quarter = quarter
+        self.period = period
         self.company = symbol
         self.base_url = base_url = f'https://www.marketwatch.com/investing/stock/{self.company.lower()}/financials'
         self.date_filed = datetime.datetime.today()
 
-    def _download(self, page: str) -> str:
-        url = f'{self.base_url}/{page}/quarter'
-        print(f'Downloading: {url}...')
-        return GetRequest(url).response.text
-
-    def _parse_record(self, key: str, value: str) -> list:
-
-        if value == '-':
-            return key, Value(key, [0])
-
-        multiplier = 1
-
-        if value[0] == '(' and value[-1] == ')':
-            value = value[1:-1]
-            multiplier = -1
-
-        if value[-1] == 'K':
-            value = float(value[:-1])
-            multiplier *= 1_000
-        elif value[-1] == 'M':
-            value = float(value[:-1])
-            multiplier *= 1_000_000
-        elif value[-1] == 'B':
-            value = float(value[:-1])
-            multiplier *= 1_000_000_000
-        elif value[-1] == 'T':
-            value = float(value[:-1])
-            multiplier *= 1_000_000_000_000
-
-        try:
-            value = float(value)
-        except ValueError:
-            pass
+    @property
+    def accession(self) -> str:
+        return FilingInfo(self.company, self.year, self.quarter, self.period).accession
 
-        return key, Value([key], [value * multiplier])
-
-    def _response_to_dict(self, response: str):
-        soup = BeautifulSoup(response, features='lxml')
-        tables = soup.select('.region--primary table.table')  # .select('tr td div.fixed--cell').decompose()
-
-        # Clean out duplicate tags
-        for table in tables:
-            for cell in table.select('tr td div.fixed--cell'):
-                cell.decompose()
-
-        df = pandas.DataFrame()
-
-        for table in pandas.read_html(str(tables)):
-            df = df.append(table)
-
-        datemap = dict()
-
-        for column in df.columns:
+    def _download(self, page: str, cache: bool = True) -> str:
+        url = f'{self.base_url}/{page}/quarter'
+        logger.info('Downloading %s', url, extra={'symbol': self.company, 'stage': 'fetch'})
+        return GetRequest(url, cache=cache).response.text
+
+    def _cache_path(self, page: str) -> str:
+        return os.path.join(PAGE_CACHE_PATH, f'{self.company.upper()}-{page}.json')
+
+    def get_page(self, page: str) -> Page:
+        '''
+        Return the parsed page, downloading it at most once per symbol per
+        PAGE_TTL. Every quarter of a Filing for the symbol is served from it.
+        '''
+        key = (self.company.upper(), page)
+        if (cached := PAGE_CACHE.get(key)) is not None and cached.is_fresh():
+            return cached
+
+        path = self._cache_path(page)
+        if cached is None and os.path.exists(path):
+            with open(path) as f:
+                cached = Page.from_dict(json.load(f))
+        if cached is None or not cached.is_fresh():
+            # The HTTP cache never expires, so bypass it to refresh a stale page
             try:
-                dateobj = pandas.to_datetime(column)
-            except dateutil.parser.ParserError:
+                response = self._download(page, cache=cached is None)
+            except RequestException as e:
+                if e.status_code == 404:
+                    raise UnknownSymbolException(f'MarketWatch has no {page} page for {self.company}') from e
+                raise
+            cached = self._response_to_page(response)
+            os.makedirs(PAGE_CACHE_PATH, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(cached.to_dict(), f)
+            os.replace(f'{path}.tmp', path)
+
+        PAGE_CACHE[key] = cached
+        return cached
+
+    @staticmethod
+    def _parse_cells(texts: list[str]) -> list[Union[float, str]]:
+        '''
+        Parse cell texts such as "1.5B", "(20.3M)" or "-" all in one go.
+        Cells that are not numbers are kept as text; empty ones are NaN.
+        '''
+        import pandas  # slow to import, and only needed once pages are parsed
+
+        texts = pandas.Series(texts, dtype=object)
+        negative = texts.str.startswith('(') & texts.str.endswith(')')
+        unsigned = texts.where(~negative, texts.str[1:-1])
+        multiplier = unsigned.str[-1].map(MULTIPLIERS)
+        numbers = pandas.to_numeric(
+            unsigned.where(multiplier.isna(), unsigned.str[:-1]).str.replace(',', '', regex=False),
+            errors='coerce')
+        numbers = numbers * multiplier.fillna(1) * negative.map({True: -1, False: 1})
+        numbers[texts == '-'] = 0.0
+        values = numbers.astype(object)
+        is_text = numbers.isna() & (texts != '')
+        values[is_text] = texts[is_text]
+        return values.tolist()
+
+    def _response_to_page(self, response: str) -> Page:
+        tree = lxml.html.fromstring(response)
+        items, cells, dates = list(), list(), None
+
+        for table in tree.xpath(TABLES_XPATH):
+            # The first cell of a row carries the label twice, once in a div.fixed--cell
+            for duplicate in table.xpath(FIXED_CELLS_XPATH):
+                duplicate.drop_tree()
+
+            rows = table.xpath('.//tr')
+            if not rows:
                 continue
 
-            key = (abs(dateobj.year - self.year),
-                   abs(dateobj.quarter - self.quarter))
-
-            datemap[key] = column
-
-        return dict(
-            self._parse_record(row[0], row[1])
-            for idx, row in df[['Item Item', datemap[min(datemap.keys())]]].iterrows()
-        )
+            positions = dict()
+            for position, cell in enumerate(rows[0].xpath('./th|./td')):
+                try:
+                    date = datetime.datetime.strptime(cell.text_content().strip(), HEADER_DATE_FORMAT).date()
+                except ValueError:
+                    continue
+                positions[date] = position
+            dates = dates or sorted(positions)
+            columns = [positions.get(date) for date in dates]
+
+            for row in rows[1:]:
+                texts = [' '.join(cell.text_content().split()) for cell in row.xpath('./td')]
+                if not texts:
+                    continue
+                items.append(texts[0])
+                cells.extend(texts[column] if column is not None and column < len(texts) else ''
+                             for column in columns)
+
+        # Parse every cell of the page at once; cells are laid out row by row
+        values = self._parse_cells(cells)
+        width = len(dates or ())
+        table = dict()
+        for row, item in enumerate(items):
+            table[item] = values[row * width:(row + 1) * width]
+
+        return Page(items=list(table),
+                    dates=list(dates or ()),
+                    values=list(table.values()),
+                    fetched=datetime.datetime.now())
+
+    def _get_report(self, page_name: str, snapshot: bool = False) -> Report:
+        page = self.get_page(page_name)
+        if not page.dates:
+            # Unknown symbols get a search page, without financials tables
+            raise UnknownSymbolException(f'MarketWatch has no {page_name} of {self.company}')
+        index = page.closest(self.year, self.quarter)
+
+        if self.period != 'annual':
+            return Report([FinancialInfo(
+                map=page.column(index),
+                date=f'{self.year}Q{self.quarter}'
+            )])
+
+        # Annual figures are the four quarters ending closest to Q4
+        date = page.dates[index].isoformat()
+        if snapshot:
+            return Report([FinancialInfo(map=page.column(index), date=date, months=None)])
+        if index < 3:
+            raise NoFilingInfoException(
+                f'Not enough quarters of {page_name} to total {self.year} for {self.company}')
+        return Report([FinancialInfo(map=page.total(index - 3, index + 1), date=date, months=12)])
 
     def get_balance_sheets(self):
-        return Report([FinancialInfo(
-            map=self._response_to_dict(self._download('balance-sheet')),
-            date=f'{self.year}Q{self.quarter}'
-        )])
+        return self._get_report('balance-sheet', snapshot=True)
 
     def get_cash_flows(self):
-        return Report([FinancialInfo(
-            map=self._response_to_dict(self._download('cash-flow')),
-            date=f'{self.year}Q{self.quarter}'
-        )])
+        return self._get_report('cash-flow')
 
     def get_income_statements(self):
-        return Report([FinancialInfo(
-            map=self._response_to_dict(self._download('income')),
-            date=f'{self.year}Q{self.quarter}'
-        )])
+        return self._get_report('income')
 
 
 class Stock:
@@ -124,12 +264,24 @@ class Stock:
     def __init__(self, symbol: str):
         self.symbol = symbol
 
-    def get_filing(self, period: str, year: int, quarter: int):
-        if period != 'quarterly':
-            raise NotImplementedError(f'Period not supported: {period}')
+    def get_filing(self, period: str, year: int, quarter: int) -> Filing:
+        return self.load_filing(self.get_filing_info(period, year, quarter))
 
-        return Filing(
+    def get_filing_info(self, period: str, year: int, quarter: int) -> FilingInfo:
+        if period not in ('annual', 'quarterly'):
+            raise ValueError(f'Unknown period: {period}')
+
+        return FilingInfo(
             symbol=self.symbol,
             year=year,
-            quarter=quarter
+            quarter=0 if period == 'annual' else quarter,
+            period=period
+        )
+
+    def load_filing(self, filing_info: FilingInfo) -> Filing:
+        return Filing(
+            symbol=filing_info.symbol,
+            year=filing_info.year,
+            quarter=filing_info.quarter,
+            period=filing_info.period
         )
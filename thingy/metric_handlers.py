@@ -1,9 +1,12 @@
+import logging
 import py_expression_eval
 from lxml.objectify import ObjectifiedElement
 from typing import Any, Optional
-from icecream import ic
 from thingy.collections import Report, Date
 from dataclasses import dataclass
+from collections import Counter
+
+logger = logging.getLogger(__name__)
 
 
 class CashedExpressionParser(py_expression_eval.Parser):
@@ -34,37 +37,33 @@ class Fact:
     def execute_eval(self, eval: ObjectifiedElement, fact_context: dict[str, float]) -> float:
         try:
             return self.expression_parser.evaluate(eval, fact_context)
-        except BaseException as e:
-            ic(eval)
-            ic(fact_context)
+        except BaseException:
+            logger.error('Unable to evaluate %s of %s with %s', eval, self.id, fact_context)
             raise
 
     def eval_has_prerequisites(self, eval: ObjectifiedElement, fact_context: dict[str, float]) -> bool:
         variables = self.expression_parser.variables(eval)
         if missing := (set(variables) - set(fact_context)):
-            ic(f'The following variables have not yet been defined: {missing}. Deferring')
+            logger.debug('The following variables have not yet been defined: %s. Deferring', missing)
             return False
         return True
 
-    def execute_query(self, query: ObjectifiedElement, report_data: Report) -> Optional[float]:
+    def execute_query(self, query: ObjectifiedElement, report_data: Report,
+                      stats: Optional[Counter] = None) -> Optional[float]:
 
-        if (result := self._compute_query(query, report_data)):
+        if (result := self._compute_query(query, report_data, stats)):
             return self._compute_query_post(result, query)
 
     @staticmethod
-    def _compute_query(query: ObjectifiedElement, report_data: Report) -> list:
-
-        if not (source := getattr(report_data, query.get('source'), None)):
-            raise ValueError(f'Unknown source: {query.get("source")}')
+    def _compute_query(query: ObjectifiedElement, report_data: Report,
+                       stats: Optional[Counter] = None) -> list:
 
-        payload = [line.strip() for line in str(query).split('\n')]
+        return report_data.query(query.get('source'), query.get('mode'), Fact.get_payload(query), stats)
 
-        if query.get('mode') == 'select':
-            return source.get_all(*payload)
-        elif query.get('mode') == 'regexp':
-            return source.search(*payload)
-
-        raise ValueError(f'Unsupported mode: {query.get("mode")}')
+    @staticmethod
+    def get_payload(query: ObjectifiedElement) -> tuple[str]:
+        '''The concepts, labels or patterns of a query, one per line'''
+        return tuple(line.strip() for line in str(query).split('\n'))
 
     @staticmethod
     def _compute_query_post(compute_result: list,
@@ -111,10 +110,8 @@ class Ratio:
             A = cls.calculate_compute(ratio.compute.get('source.a'), fact_context)
             B = cls.calculate_compute(ratio.compute.get('source.b'), fact_context)
         except BaseException:
-            ic(ratio.get('id'))
-            ic(ratio.compute.get('source.a'))
-            ic(ratio.compute.get('source.b'))
-            ic(fact_context)
+            logger.error('Unable to compute %s = (%s) / (%s) with %s', ratio.get('id'),
+                         ratio.compute.get('source.a'), ratio.compute.get('source.b'), fact_context)
             raise
         return cls.Metric(a=A, b=B, ratio=A / B)
 
@@ -0,0 +1,162 @@
+'''
+Opt-in performance instrumentation.
+
+Everything here is a no-op unless metrics are enabled, either by setting the
+THINGY_METRICS environment variable or by calling enable(). When enabled,
+timings, counters and per-symbol latency histograms are collected and can be
+exported as a JSON summary and as a Chrome trace (chrome://tracing,
+https://ui.perfetto.dev).
+'''
+from __future__ import annotations
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+import contextlib
+from collections import defaultdict
+from typing import Callable, Optional
+
+# Upper bounds (in seconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Keep the trace from growing without bound on very long runs
+MAX_TRACE_EVENTS = 250_000
+
+
+class Metrics:
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._origin = time.perf_counter()
+        self.timings = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0})
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(dict)
+        self.trace = list()
+
+    # -------------------------------------------------
+    # Collection
+
+    def record(self, stage: str, start: float, end: float, args: Optional[dict] = None):
+        elapsed = end - start
+        with self._lock:
+            timing = self.timings[stage]
+            timing['count'] += 1
+            timing['total'] += elapsed
+            timing['max'] = max(timing['max'], elapsed)
+
+            if len(self.trace) < MAX_TRACE_EVENTS:
+                event = {'name': stage,
+                         'cat': stage.split('.', 1)[0],
+                         'ph': 'X',
+                         'ts': (start - self._origin) * 1e6,
+                         'dur': elapsed * 1e6,
+                         'pid': os.getpid(),
+                         'tid': threading.get_ident()}
+                if args:
+                    event['args'] = args
+                self.trace.append(event)
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    def observe(self, name: str, label: str, seconds: float):
+        '''Add a latency sample to the histogram for (name, label)'''
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms[name].get(label)
+            if histogram is None:
+                histogram = self.histograms[name][label] = {
+                    'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                    'buckets': [0] * (len(HISTOGRAM_BUCKETS) + 1)}
+            histogram['count'] += 1
+            histogram['total'] += seconds
+            histogram['min'] = min(histogram['min'], seconds)
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['buckets'][bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, start, time.perf_counter(), args)
+
+    def timed(self, stage: Optional[str] = None) -> Callable:
+        '''Decorator timing every call of the wrapped function'''
+        def decorator(func: Callable) -> Callable:
+            name = stage or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter())
+            return wrapper
+        return decorator
+
+    # -------------------------------------------------
+    # Export
+
+    def summary(self) -> dict:
+        labels = [f'<={bound}s' for bound in HISTOGRAM_BUCKETS] + [f'>{HISTOGRAM_BUCKETS[-1]}s']
+        with self._lock:
+            return {
+                'elapsed': time.perf_counter() - self._origin,
+                'timings': {stage: dict(timing, mean=timing['total'] / timing['count'])
+                            for stage, timing in sorted(self.timings.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {
+                    name: {label: dict(histogram,
+                                       mean=histogram['total'] / histogram['count'],
+                                       buckets=dict(zip(labels, histogram['buckets'])))
+                           for label, histogram in sorted(series.items())}
+                    for name, series in sorted(self.histograms.items())},
+            }
+
+    def write_summary(self, target: str):
+        with open(target, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_trace(self, target: str):
+        with self._lock:
+            events = list(self.trace)
+        with open(target, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def dump(self, prefix: str):
+        '''Write <prefix>.metrics.json and <prefix>.trace.json'''
+        self.write_summary(f'{prefix}.metrics.json')
+        self.write_trace(f'{prefix}.trace.json')
+
+
+METRICS = Metrics(enabled=bool(os.environ.get('THINGY_METRICS')))
+
+timed = METRICS.timed
+timer = METRICS.timer
+count = METRICS.count
+observe = METRICS.observe
+
+
+def enable():
+    METRICS.enabled = True
+
+
+def disable():
+    METRICS.enabled = False
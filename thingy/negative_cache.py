@@ -0,0 +1,197 @@
+'''
+Negative cache: cells and symbols known to have nothing to compare
+
+Finding out that a symbol has no filing for a date is the most expensive
+answer there is: Stock.get_filing_info walks back through the quarters and
+the previous year, fetching an index each time, before giving up. Those
+outcomes are kept here, in the fact store database, so that re-runs skip
+known-missing cells without a single request. Each miss has a reason:
+
+ - no_filing: no filing answers the cell (NoFilingInfoException)
+ - no_statements: the filing answering the cell has no financial statements
+   (NoFinancialDataException)
+ - unknown_symbol: no provider covers the symbol: its CIK is unknown and
+   MarketWatch has no financials for it
+
+Cells skipped because a provider failed otherwise, e.g. a server error, have
+the provider_error reason but are not remembered: they may well be answered
+on the next run.
+
+Misses depend on the providers asked, so they are kept per scope, the names
+of the providers of the registry (see ProviderRegistry.scope): adding or
+reordering providers starts afresh. The engine still computes a known-missing
+cell when the fact store answers it, e.g. once a data set has been ingested.
+
+A miss expires when a filing could have changed the outcome. Filings answering
+a date are filed within a window, the quarter (or year) of the date: once
+it is over, the outcome is final and only checked again yearly. Until then,
+and for the latest filing (year 0) or unknown symbols, it is checked again
+after the next filing deadline (by which filers on a calendar year must have
+filed) or at the end of the window, whichever comes first.
+'''
+from __future__ import annotations
+import time
+import sqlite3
+import datetime
+import threading
+import dataclasses
+from typing import Optional
+from thingy.collections import Date
+from thingy.edgar.store import FACT_STORE_PATH
+
+# Reasons
+NO_FILING = 'no_filing'
+NO_STATEMENTS = 'no_statements'
+UNKNOWN_SYMBOL = 'unknown_symbol'
+PROVIDER_ERROR = 'provider_error'
+
+# Last days to file for calendar year filers, extensions (Form 12b-25) included:
+# 10-K 90 + 15 days after the end of the year, 10-Q 45 + 5 days after the end of a quarter
+DEADLINES = ((4, 15), (5, 20), (8, 19), (11, 19))
+FINAL_TTL = 365 * 24 * 3600  # seconds
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS misses (
+    scope TEXT NOT NULL,        -- names of the providers asked
+    symbol TEXT NOT NULL,
+    period TEXT NOT NULL,       -- '' for misses of the whole symbol
+    year INTEGER NOT NULL,
+    quarter INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (scope, symbol, period, year, quarter)
+) WITHOUT ROWID;
+'''
+
+UPSERT = '''
+INSERT INTO misses (scope, symbol, period, year, quarter, reason, detail, created, expires)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (scope, symbol, period, year, quarter) DO UPDATE SET
+    reason = excluded.reason,
+    detail = excluded.detail,
+    created = excluded.created,
+    expires = excluded.expires
+'''
+
+
+@dataclasses.dataclass(frozen=True)
+class Miss:
+    symbol: str
+    period: str                 # '' for misses of the whole symbol
+    year: int
+    quarter: int
+    reason: str
+    detail: str
+    expires: float              # time.time()
+    scope: str = ''             # see ProviderRegistry.scope
+
+    @property
+    def date(self) -> Date:
+        return Date(self.year, self.quarter)
+
+
+def window_end(period: str, date: Date) -> datetime.date:
+    '''Last day on which the filing answering date may be filed'''
+    if period == 'quarterly' and date.quarter:
+        # Filed in the quarter after the one it covers, see Date.period_end_window
+        return datetime.date(date.year + date.quarter // 4, 3 * date.quarter % 12 + 1, 1) - datetime.timedelta(days=1)
+    return datetime.date(date.year, 12, 31)
+
+
+def next_deadline(day: datetime.date) -> datetime.date:
+    '''The first filing deadline on or after day'''
+    return min(deadline
+               for year in (day.year, day.year + 1)
+               for month, day_of_month in DEADLINES
+               if (deadline := datetime.date(year, month, day_of_month)) >= day)
+
+
+def expires(period: str, date: Optional[Date], now: float) -> float:
+    '''
+    When a miss of date (None for the whole symbol) found at now should be
+    checked again
+    '''
+    today = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).date()
+    if date is not None and date.year:
+        last = window_end(period, date)
+        if today > last:
+            return now + FINAL_TTL  # the indexes of the window are complete
+        recheck = min(next_deadline(today), last)
+    else:
+        recheck = next_deadline(today)
+    # At the end of the deadline, UTC
+    return datetime.datetime.combine(recheck + datetime.timedelta(days=1), datetime.time(),
+                                     datetime.timezone.utc).timestamp()
+
+
+class NegativeCache:
+
+    def __init__(self, path: str = FACT_STORE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Opened lazily so that merely creating an Engine has no side effects
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def get(self, symbol: str, period: str, date: Date, scope: str = '',
+            now: Optional[float] = None) -> Optional[Miss]:
+        '''
+        The miss of a cell (or of its whole symbol) found with the providers
+        of scope that has not expired yet, if any
+        '''
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT symbol, period, year, quarter, reason, detail, expires, scope FROM misses WHERE scope = ? '
+                "AND symbol = ? AND ((period = ? AND year = ? AND quarter = ?) OR period = '') AND expires > ? "
+                "ORDER BY period = '' DESC LIMIT 1",
+                (scope, symbol, period, date.year, date.quarter, time.time() if now is None else now)).fetchone()
+        return None if row is None else Miss(*row)
+
+    def add(self, symbol: str, period: str, date: Date, reason: str, detail: str, scope: str = '',
+            now: Optional[float] = None) -> Miss:
+        '''Remember that a cell has nothing to compare with the providers of scope'''
+        now = time.time() if now is None else now
+        return self._add(Miss(symbol, period, date.year, date.quarter, reason, detail, expires(period, date, now),
+                              scope), now)
+
+    def add_symbol(self, symbol: str, reason: str, detail: str, scope: str = '',
+                   now: Optional[float] = None) -> Miss:
+        '''Remember that none of the cells of a symbol have anything to compare with the providers of scope'''
+        now = time.time() if now is None else now
+        return self._add(Miss(symbol, '', 0, 0, reason, detail, expires('', None, now), scope), now)
+
+    def _add(self, miss: Miss, now: float) -> Miss:
+        with self._lock, self.connection:
+            self.connection.execute(UPSERT, (miss.scope, miss.symbol, miss.period, miss.year, miss.quarter,
+                                             miss.reason, miss.detail, now, miss.expires))
+        return miss
+
+    def discard(self, symbol: str, period: str, date: Date):
+        '''
+        Forget the misses of a cell and of its symbol, whatever their scope,
+        e.g. once a filing answers it
+        '''
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM misses WHERE symbol = ? AND ((period = ? AND year = ? AND quarter = ?) OR period = '')",
+                (symbol, period, date.year, date.quarter))
+
+    def clear(self, symbol: Optional[str] = None) -> int:
+        '''Forget every miss (of symbol, if given), returning how many were'''
+        with self._lock, self.connection:
+            if symbol is None:
+                return self.connection.execute('DELETE FROM misses').rowcount
+            return self.connection.execute('DELETE FROM misses WHERE symbol = ?', (symbol,)).rowcount
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,378 @@
+'''
+Pipelined execution: download, parse and compute cells at the same time
+
+Engine.execute handles one cell after the other: resolve the filing,
+download it, parse it, evaluate the facts. The network sits idle while
+parsing, and the CPU while downloading. A Pipeline runs the same cells
+through three stages instead:
+
+ - download: a pool of threads resolving the filing of each cell and
+   downloading its submission (within the limits of each provider)
+ - parse: a pool of processes parsing submissions into ParsedFilings, which
+   are small enough to send back (see edgar.filing.parse_submission)
+ - compute: the engine, evaluating the facts and ratios of each cell in order
+
+The stages are connected by bounded queues, and no more than depth cells are
+in flight between the start of their download and the end of their compute,
+so downloads cannot run ahead of parsing (or parsing of computing) and fill
+up memory; download threads wait instead, which shows as blocked time.
+
+Cells the fact store answers are not downloaded, and cells several dates
+resolve to the same filing share its download. Anything the pipeline could
+not prepare (e.g. a provider that only fetches filings whole, or a failed
+download) is left to the engine, which handles it as Engine.execute would.
+
+Stage utilization and queue depths are logged at the end of a run (and kept
+in Pipeline.stats), to tune the number of downloaders and parsers:
+
+    python -m thingy.pipeline XOM CVX --quarterly 2020Q3 2020Q4 --annual 2020 \\
+        --downloaders 8 --parsers 4 --report report.html
+'''
+from __future__ import annotations
+import os
+import sys
+import time
+import queue
+import logging
+import argparse
+import threading
+import dataclasses
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Optional
+from thingy import log
+from thingy.collections import Date, Report
+from thingy.edgar.filing import ParsedFiling, parse_submission
+from thingy.edgar.store import FactStore
+from thingy.engine import Engine
+from thingy.providers import Provider
+from thingy.state import ResultKey
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADERS = 4
+DEPTH = 16
+
+
+def _parse(url: str, company: str, submission: str) -> tuple[float, ParsedFiling]:
+    '''parse_submission, timed; runs in the parse processes'''
+    start = time.perf_counter()
+    filing = parse_submission(url, company, submission)
+    return time.perf_counter() - start, filing
+
+
+@dataclasses.dataclass
+class StageStats:
+    workers: int
+    items: int = 0
+    errors: int = 0
+    busy: float = 0.0  # seconds spent working, summed over workers
+    blocked: float = 0.0  # seconds spent waiting for room downstream
+
+    def utilization(self, elapsed: float) -> float:
+        return self.busy / (elapsed * self.workers) if elapsed > 0 and self.workers else 0.0
+
+
+class BoundedQueue(queue.Queue):
+    '''A queue.Queue keeping track of its depth'''
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.puts = 0
+        self.max_depth = 0
+        self._depths = 0
+        self._stats_lock = threading.Lock()
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None):
+        super().put(item, block, timeout)
+        depth = self.qsize()
+        with self._stats_lock:
+            self.puts += 1
+            self._depths += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def mean_depth(self) -> float:
+        '''Depth right after each put, on average'''
+        return self._depths / self.puts if self.puts else 0.0
+
+
+@dataclasses.dataclass
+class Cell:
+    index: int
+    period: str
+    symbol: str
+    date: Date
+    provider: Optional[Provider] = None
+    filing_info: Any = None
+    submission: Optional[str] = None  # only on the cell downloading it
+    filing: Optional[Future] = None  # of the ParsedFiling, None when left to the engine
+
+    @property
+    def key(self) -> ResultKey:
+        return ResultKey(self.period, self.symbol, self.date.year, self.date.quarter)
+
+
+class Pipeline:
+    def __init__(self, engine: Engine, downloaders: int = DOWNLOADERS, parsers: Optional[int] = None,
+                 depth: int = DEPTH, executor: Optional[Executor] = None):
+        '''
+        :param parsers: parse processes (default: one per CPU), or 0 to parse
+            in a thread of this process
+        :param depth: cells in flight at most, and size of the queues
+        :param executor: to parse with instead of a pool of parsers processes,
+            e.g. to share one between pipelines
+        '''
+        self.engine = engine
+        self.downloaders = downloaders
+        self.parsers = (os.cpu_count() or 1) if parsers is None else parsers
+        self.depth = depth
+        self.executor = executor
+        self.stats = dict()
+        self.queues = dict()
+        self.elapsed = 0.0
+
+    def execute(self, dates: dict[str, list[Date]]) -> Engine:
+        engine = self.engine.start(dates)
+        metadata = engine.context.metadata
+        cells = [Cell(index, period, symbol, date)
+                 for index, (period, symbol, date) in enumerate(
+                     (period, symbol, date)
+                     for period, date_list in metadata.dates.items()
+                     for symbol in metadata.symbols
+                     for date in date_list)]
+
+        self.stats = {'download': StageStats(self.downloaders),
+                      'parse': StageStats(max(self.parsers, 1)),
+                      'compute': StageStats(1)}
+        self.queues = {'parse': BoundedQueue(self.depth), 'compute': BoundedQueue(self.depth)}
+        self._cells = iter(cells)
+        self._claims = dict()  # accession -> Future of its ParsedFiling
+        self._lock = threading.Lock()
+        self._window = threading.Semaphore(self.depth)
+        self._stopped = False
+
+        executor = self.executor
+        if executor is None and self.parsers:
+            # Not forked: the download threads may be holding locks
+            executor = ProcessPoolExecutor(self.parsers, mp_context=multiprocessing.get_context('spawn'))
+        threads = [threading.Thread(target=self._download, name=f'thingy-download-{number}', daemon=True)
+                   for number in range(self.downloaders)]
+        threads.append(threading.Thread(target=self._dispatch, args=(executor, len(cells)),
+                                        name='thingy-parse', daemon=True))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            self._compute(len(cells))
+        finally:
+            self._stopped = True
+            self._window.release(self.downloaders)
+            if executor is not None and self.executor is None:
+                executor.shutdown(cancel_futures=True)
+            self.elapsed = time.perf_counter() - start
+
+        engine.finish()
+        self.log_stats()
+        return engine
+
+    # -------------------------------------------------
+    # Stages
+
+    def _download(self):
+        stats = self.stats['download']
+        while True:
+            start = time.perf_counter()
+            self._window.acquire()
+            waited = time.perf_counter() - start
+            with self._lock:
+                cell = None if self._stopped else next(self._cells, None)
+                stats.blocked += waited
+            if cell is None:
+                self._window.release()
+                return
+
+            start = time.perf_counter()
+            try:
+                self._prepare(cell)
+            except Exception as e:
+                logger.warning('Unable to download %s %s %dQ%d ahead: %r', cell.symbol, cell.period,
+                               cell.date.year, cell.date.quarter, e,
+                               extra={'symbol': cell.symbol, 'period': cell.period, 'stage': 'download'})
+                with self._lock:
+                    stats.errors += 1
+            with self._lock:
+                stats.items += 1
+                stats.busy += time.perf_counter() - start
+            self.queues['parse'].put(cell)
+
+    def _prepare(self, cell: Cell):
+        '''
+        Resolve and download the filing of cell, unless the fact store answers
+        it or it is known to have nothing to compare
+        '''
+        engine = self.engine
+        if engine.misses.get(cell.symbol, cell.period, cell.date, engine.providers.scope) is not None:
+            return
+        for provider in engine.providers.route(cell.symbol):
+            try:
+                if (cik := provider.cik(cell.symbol)) is not None:
+                    provider.load_facts(cell.symbol, engine.fact_store)
+                    if Report.from_store(engine.fact_store, cik, cell.period, cell.date) is not None:
+                        return
+                filing_info = provider.resolve(cell.symbol, cell.period, cell.date)
+            except Exception:
+                continue  # the engine tries the next provider, and reports the failure
+            break
+        else:
+            return
+
+        cell.provider, cell.filing_info = provider, filing_info
+        if filing_info.accession in engine.filings:
+            return  # computed already
+        with self._lock:
+            claimed = filing_info.accession not in self._claims
+            if claimed:
+                self._claims[filing_info.accession] = Future()
+            cell.filing = self._claims[filing_info.accession]
+        if claimed:
+            try:
+                cell.submission = provider.download(cell.symbol, filing_info)
+            except BaseException as e:
+                cell.filing.set_exception(e)
+                raise
+            if cell.submission is None:
+                cell.filing.set_result(None)  # fetched whole by the engine
+
+    def _dispatch(self, executor: Optional[Executor], count: int):
+        stats = self.stats['parse']
+
+        def done(claim: Future, parsing: Future):
+            try:
+                elapsed, filing = parsing.result()
+            except BaseException as e:
+                with self._lock:
+                    stats.errors += 1
+                claim.set_exception(e)
+                return
+            with self._lock:
+                stats.items += 1
+                stats.busy += elapsed
+            claim.set_result(filing)
+
+        for _ in range(count):
+            cell = self.queues['parse'].get()
+            if cell.submission is not None and not self._stopped:
+                args = (cell.filing_info.url, cell.symbol, cell.submission)
+                cell.submission = None
+                try:
+                    if executor is None:
+                        parsing = Future()
+                        parsing.set_result(_parse(*args))
+                    else:
+                        parsing = executor.submit(_parse, *args)
+                except Exception as e:  # e.g. a broken pool; the engine fetches the filing itself
+                    parsing = Future()
+                    parsing.set_exception(e)
+                parsing.add_done_callback(lambda parsing, claim=cell.filing: done(claim, parsing))
+            start = time.perf_counter()
+            self.queues['compute'].put(cell)
+            with self._lock:
+                stats.blocked += time.perf_counter() - start
+
+    def _compute(self, count: int):
+        '''Compute the cells in order, as Engine.execute does'''
+        engine = self.engine
+        stats = self.stats['compute']
+        pending = dict()
+        period = symbol = None
+        for index in range(count):
+            while index not in pending:
+                cell = self.queues['compute'].get()
+                pending[cell.index] = cell
+            cell = pending.pop(index)
+
+            filing = None
+            if cell.filing is not None:
+                try:
+                    filing = cell.filing.result()
+                except Exception:
+                    pass  # the engine fetches it again, and reports the failure
+
+            start = time.perf_counter()
+            if cell.period != period:
+                period, symbol = cell.period, None
+                engine.PERIOD(period=period)
+            if cell.symbol != symbol:
+                symbol = cell.symbol
+                engine.SYMBOL(symbol=symbol)
+            if cell.provider is not None:
+                engine.resolved[cell.key] = (cell.provider, cell.filing_info, filing)
+            try:
+                engine.execute_cell(cell.period, cell.symbol, cell.date)
+            finally:
+                engine.resolved.pop(cell.key, None)
+                if cell.filing_info is not None:
+                    with self._lock:
+                        # Cells in flight already share it, the next ones find it in engine.filings
+                        self._claims.pop(cell.filing_info.accession, None)
+                stats.items += 1
+                stats.busy += time.perf_counter() - start
+                self._window.release()
+
+    # -------------------------------------------------
+
+    def log_stats(self):
+        for name, stats in self.stats.items():
+            logger.info('%s stage: %d cells, %d errors, %d workers %.0f%% busy, %.1f s blocked downstream', name,
+                        stats.items, stats.errors, stats.workers, stats.utilization(self.elapsed) * 100,
+                        stats.blocked, extra={'stage': name})
+        for name, stats in self.queues.items():
+            logger.info('%s queue: mean depth %.1f, max %d of %d', name, stats.mean_depth, stats.max_depth,
+                        stats.maxsize, extra={'stage': name})
+
+
+def main(argv: list[str] = None) -> int:
+    from thingy import snapshot
+    from thingy.service import parse_date
+    from thingy.view import load_template
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--quarterly', nargs='*', default=[], type=parse_date, metavar='YYYYQN')
+    parser.add_argument('--annual', nargs='*', default=[], type=parse_date, metavar='YYYY')
+    parser.add_argument('--report', help='HTML report to write')
+    parser.add_argument('--export', help='export (see thingy.export) to write')
+    parser.add_argument('--template', default=os.path.join(snapshot.ROOT_PATH, 'templates', 'template.html.mako'))
+    parser.add_argument('--downloaders', type=int, default=DOWNLOADERS)
+    parser.add_argument('--parsers', type=int, help='parse processes (default: one per CPU, 0: none)')
+    parser.add_argument('--depth', type=int, default=DEPTH, help='cells in flight at most')
+    parser.add_argument('--store', help='fact store to keep across runs (default: THINGY_FACT_STORE, else none)')
+    parser.add_argument('--companyfacts', metavar='SOURCE',
+                        help="companyfacts documents (a directory or companyfacts.zip, or 'sec' to download them) "
+                             'to answer cells from ahead of EDGAR')
+    args = parser.parse_args(argv)
+
+    log.configure(logging.INFO)
+    dates = {period: date_list for period, date_list in (('quarterly', args.quarterly), ('annual', args.annual))
+             if date_list}
+    if not dates:
+        parser.error('at least one --quarterly or --annual date is required')
+
+    current = snapshot.load()
+    fact_store = FactStore(args.store) if args.store else FactStore.configured()
+    engine = Engine(symbols=[symbol.upper() for symbol in args.symbols], logic=current.logic,
+                    template_engine=load_template(args.template) if args.report else None,
+                    providers=current.providers(args.companyfacts), machine=current.machine,
+                    fact_store=fact_store, catalog=current.catalog(fact_store))
+    Pipeline(engine, args.downloaders, args.parsers, args.depth).execute(dates)
+    if args.report:
+        engine.write(args.report)
+    if args.export:
+        engine.export(args.export)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+'''
+Data providers
+
+A provider turns a (symbol, period, date) cell into a Report in three steps:
+
+ - resolve: find the filing answering the cell (cheap, index lookups)
+ - fetch: download the filing
+ - parse: build the Report from the filing
+
+Providers holding every fact of a company at once (see FactProvider) load
+them into the fact store instead, from which the engine answers cells before
+resolving anything.
+
+Providers are kept in a ProviderRegistry, in order of preference. A symbol is
+routed to every provider covering it, and when one fails the next is tried.
+
+Each provider limits its own concurrency and request rate, so a throttled
+provider only slows down its own symbols, and keeps latency/error stats.
+'''
+from __future__ import annotations
+import os
+import abc
+import csv
+import time
+import zipfile
+import contextlib
+import threading
+import dataclasses
+from collections import Counter
+from typing import Any, Callable, Optional
+from thingy import metrics
+from thingy.collections import Date, Report
+from thingy.edgar import companyfacts
+from thingy.edgar.edgar import SYMBOLS_DATA_PATH
+from thingy.edgar.store import FactStore
+from thingy.edgar.stock import NoFilingInfoException, Stock as EdgarStock
+from thingy.market_watch import Stock as MarketWatchStock, UnknownSymbolException
+
+
+# Source of CompanyFactsProvider downloading documents from SEC, see ProviderRegistry.default
+COMPANYFACTS_SEC = 'sec'
+
+
+def read_symbols(path: str = SYMBOLS_DATA_PATH) -> dict[str, str]:
+    '''symbol -> cik, from a symbols index (the first row of a symbol wins)'''
+    with open(path, newline='') as f:
+        return {row['symbol']: row['cik'] for row in reversed(list(csv.DictReader(f)))}
+
+
+class TokenBucket:
+    '''
+    Allow rate operations per second on average, and bursts of up to
+    capacity operations
+    '''
+
+    def __init__(self, rate: Optional[float], capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Take a token, waiting for one if necessary'''
+        if self.rate is None:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclasses.dataclass
+class ProviderStats:
+    calls: Counter = dataclasses.field(default_factory=Counter)
+    errors: Counter = dataclasses.field(default_factory=Counter)
+    latency: Counter = dataclasses.field(default_factory=Counter)  # seconds, by operation
+
+    def mean_latency(self, operation: str) -> float:
+        return self.latency[operation] / self.calls[operation] if self.calls[operation] else 0.0
+
+    def __str__(self):
+        return ', '.join(
+            f'{operation}: {self.calls[operation]} calls, {self.errors[operation]} errors, '
+            f'{self.mean_latency(operation) * 1000:.1f} ms mean'
+            for operation in sorted(self.calls))
+
+
+class Provider(abc.ABC):
+    '''
+    Base class for data providers. Subclasses implement covers(), get_stock()
+    and, if needed, override resolve(), fetch() and parse(). Providers of
+    facts rather than filings derive from FactProvider.
+    '''
+    name = 'provider'
+
+    def __init__(self, max_concurrency: int = 4, rate: Optional[float] = None, burst: int = 1):
+        self.stocks = dict()
+        self.stats = ProviderStats()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{type(self).__name__}()'
+
+    @abc.abstractmethod
+    def covers(self, symbol: str) -> bool:
+        '''Whether the provider has data for symbol'''
+
+    @abc.abstractmethod
+    def get_stock(self, symbol: str) -> Any:
+        '''The stock of symbol (see stock()), resolving and loading its filings'''
+
+    def cik(self, symbol: str) -> Optional[str]:
+        '''CIK of the symbol, if the provider knows it (see FactStore)'''
+        return None
+
+    def load_facts(self, symbol: str, store: FactStore):
+        '''Add what the provider knows of symbol to store, ahead of resolve()'''
+
+    def stock(self, symbol: str) -> Any:
+        with self._lock:
+            if symbol not in self.stocks:
+                self.stocks[symbol] = self.get_stock(symbol)
+            return self.stocks[symbol]
+
+    def call(self, operation: str, func: Callable, *args, limited: bool = True) -> Any:
+        '''
+        Run func(*args), within the concurrency and rate limits of the
+        provider unless not limited (no requests are made), recording its
+        latency and errors
+        '''
+        with self._semaphore if limited else contextlib.nullcontext():
+            if limited:
+                self._bucket.acquire()
+            start = time.perf_counter()
+            failed = False
+            try:
+                return func(*args)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.stats.calls[operation] += 1
+                    self.stats.errors[operation] += failed
+                    self.stats.latency[operation] += elapsed
+                metrics.observe(f'provider.{self.name}', operation, elapsed)
+                if failed:
+                    metrics.count(f'provider.{self.name}.{operation}.errors')
+
+    def resolve(self, symbol: str, period: str, date: Date) -> Any:
+        '''Return the info (with an accession) of the filing for a cell'''
+        stock = self.stock(symbol)
+        return self.call('resolve', stock.get_filing_info, period, date.year, date.quarter)
+
+    def fetch(self, symbol: str, filing_info: Any) -> Any:
+        return self.call('fetch', self.stock(symbol).load_filing, filing_info)
+
+    def parse(self, filing: Any, period: str) -> Report:
+        return self.call('parse', Report.new, filing, period, limited=False)
+
+    def download(self, symbol: str, filing_info: Any) -> Optional[str]:
+        '''
+        The submission of a filing, left for edgar.filing.parse_submission to
+        parse (see thingy.pipeline), or None if the provider only fetches
+        filings whole
+        '''
+        stock = self.stock(symbol)
+        if not hasattr(stock, 'download_filing'):
+            return None
+        return self.call('download', stock.download_filing, filing_info)
+
+
+class EdgarProvider(Provider):
+    name = 'edgar'
+
+    def __init__(self, symbols_path: str = SYMBOLS_DATA_PATH, max_concurrency: int = 4,
+                 rate: Optional[float] = 10, burst: int = 10, index: Optional[dict[str, str]] = None):
+        '''
+        :param index: symbol -> cik, read from symbols_path if not given (see
+            thingy.snapshot)
+        '''
+        # SEC fair access policy: no more than 10 requests per second
+        super().__init__(max_concurrency=max_concurrency, rate=rate, burst=burst)
+        self.symbols_path = symbols_path
+        self._index = index
+
+    @property
+    def index(self) -> dict[str, str]:
+        '''symbol -> cik, from the symbols index'''
+        if self._index is None:
+            self._index = read_symbols(self.symbols_path)
+        return self._index
+
+    def covers(self, symbol: str) -> bool:
+        return symbol in self.index
+
+    def cik(self, symbol: str) -> Optional[str]:
+        return self.index.get(symbol)
+
+    def get_stock(self, symbol: str) -> EdgarStock:
+        return EdgarStock(symbol, cik=self.cik(symbol))
+
+
+class FactProvider(Provider):
+    '''
+    Base class for providers of facts: load_facts() adds every fact of a
+    company to the fact store, which answers its cells. There are no filings
+    to resolve, so cells the facts do not answer are missing.
+    '''
+
+    @abc.abstractmethod
+    def load_facts(self, symbol: str, store: FactStore):
+        '''Add every fact of symbol to store'''
+
+    def get_stock(self, symbol: str) -> None:
+        return None
+
+    def resolve(self, symbol: str, period: str, date: Date) -> Any:
+        # Only reached when the facts loaded do not answer the cell
+        raise NoFilingInfoException(f'No {self.name} of {symbol} for {period} {date.year}Q{date.quarter}')
+
+
+class CompanyFactsProvider(FactProvider):
+    '''
+    Every fact of a company from its companyfacts document (see
+    thingy.edgar.companyfacts), loaded into the fact store the first time the
+    company is asked for. Cells the document does not answer are left to the
+    next provider.
+    '''
+    name = 'companyfacts'
+
+    def __init__(self, source: Optional[str] = None, symbols_path: str = SYMBOLS_DATA_PATH,
+                 max_concurrency: int = 4, rate: Optional[float] = 10, burst: int = 10,
+                 index: Optional[dict[str, str]] = None):
+        '''
+        :param source: a directory of CIK##########.json or companyfacts.zip;
+            documents are downloaded from SEC if not given
+        :param index: symbol -> cik, read from symbols_path if not given
+        '''
+        super().__init__(max_concurrency=max_concurrency, rate=rate, burst=burst)
+        self.source = source
+        self.symbols_path = symbols_path
+        self._index = index
+        self._archive = None
+        self._names = None
+        self._loaded = set()  # (store, cik) already loaded
+        self._load_lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.source!r})'
+
+    @property
+    def index(self) -> dict[str, str]:
+        '''symbol -> cik, from the symbols index'''
+        if self._index is None:
+            self._index = read_symbols(self.symbols_path)
+        return self._index
+
+    @property
+    def archive(self):
+        '''Where documents are read from (see companyfacts.open_company_facts)'''
+        if self.source is None or os.path.isdir(self.source):
+            return self.source
+        with self._lock:
+            if self._archive is None:
+                self._archive = zipfile.ZipFile(self.source)
+                self._names = set(self._archive.namelist())
+            return self._archive
+
+    def covers(self, symbol: str) -> bool:
+        if (cik := self.cik(symbol)) is None:
+            return False
+        if self.source is None:
+            return True
+        name = companyfacts.get_file_name(cik)
+        if os.path.isdir(self.source):
+            return os.path.exists(os.path.join(self.source, name))
+        return self.archive is not None and name in self._names
+
+    def cik(self, symbol: str) -> Optional[str]:
+        return self.index.get(symbol)
+
+    def load_facts(self, symbol: str, store: FactStore):
+        cik = self.cik(symbol)
+        with self._load_lock:
+            if (store, cik) in self._loaded:
+                return
+            self._loaded.add((store, cik))
+
+        def load():
+            with companyfacts.open_company_facts(cik, self.archive) as f:
+                return companyfacts.ingest(cik, f, store)
+        try:
+            self.call('load', load, limited=self.source is None)
+        except Exception:
+            with self._load_lock:
+                self._loaded.discard((store, cik))
+            raise
+
+
+class MarketWatchProvider(Provider):
+    name = 'market_watch'
+
+    def __init__(self, max_concurrency: int = 2, rate: Optional[float] = 1, burst: int = 3):
+        super().__init__(max_concurrency=max_concurrency, rate=rate, burst=burst)
+        self.unknown = set()  # symbols MarketWatch turned out to have no financials for
+
+    def covers(self, symbol: str) -> bool:
+        # MarketWatch has no index: any symbol is covered until its pages say otherwise
+        return symbol not in self.unknown
+
+    def parse(self, filing: Any, period: str) -> Report:
+        # Pages are only downloaded once the statements are asked for
+        try:
+            return self.call('parse', Report.new, filing, period)
+        except UnknownSymbolException as e:
+            with self._lock:
+                self.unknown.add(filing.company)
+            raise NotCoveredError(str(e)) from e
+
+    def get_stock(self, symbol: str) -> MarketWatchStock:
+        return MarketWatchStock(symbol)
+
+
+class NotCoveredError(LookupError):
+    '''No provider covers a symbol'''
+
+
+class ProvidersFailedError(RuntimeError):
+    '''Every provider covering a symbol failed, not all of them for lack of a filing'''
+
+
+class ProviderRegistry:
+    '''Providers, in order of preference'''
+
+    def __init__(self, providers: Optional[list[Provider]] = None):
+        self.providers = list(providers or ())
+
+    def __iter__(self):
+        return iter(self.providers)
+
+    def register(self, provider: Provider, index: Optional[int] = None):
+        if index is None:
+            self.providers.append(provider)
+        else:
+            self.providers.insert(index, provider)
+
+    @property
+    def scope(self) -> str:
+        '''Names of the providers, in order: what misses depend on (see NegativeCache)'''
+        return ','.join(provider.name for provider in self.providers)
+
+    def route(self, symbol: str) -> list[Provider]:
+        '''Providers covering symbol, in order of preference'''
+        if not (providers := [provider for provider in self.providers if provider.covers(symbol)]):
+            raise NotCoveredError(f'No provider covers {symbol}')
+        return providers
+
+    @classmethod
+    def default(cls, companyfacts: Optional[str] = None, symbols_path: str = SYMBOLS_DATA_PATH,
+                index: Optional[dict[str, str]] = None) -> ProviderRegistry:
+        '''
+        EDGAR then MarketWatch, after companyfacts if given
+
+        :param companyfacts: source of CompanyFactsProvider, a directory of
+            CIK##########.json or companyfacts.zip, or COMPANYFACTS_SEC to
+            download documents
+        :param index: symbol -> cik, read from symbols_path if not given
+        '''
+        providers = [EdgarProvider(symbols_path, index=index), MarketWatchProvider()]
+        if companyfacts is not None:
+            providers.insert(0, CompanyFactsProvider(None if companyfacts == COMPANYFACTS_SEC else companyfacts,
+                                                     symbols_path, index=index))
+        return cls(providers)
@@ -0,0 +1,401 @@
+'''
+Universe screening: the facts and ratios of engine.xml for every company
+
+The engine walks a handful of symbols cell by cell through its state
+machine. Screening instead answers one date for every company of the
+symbols index at once, from the fact store only (fill it first, see
+thingy.edgar.datasets and thingy.edgar.companyfacts):
+
+    python -m thingy.screen 2020Q3 --where 'current_ratio > 1.5' \\
+        --sort debt_to_equity --ascending --top 50 --output screen.csv
+
+Companies are processed in batches, so memory is bounded by the facts of one
+batch. A batch is read into tables, one row per company and concept or label
+(see Batch), holding the statements Report.from_columns would build. Each
+query is then answered for the whole batch at once, with the same fall through as the
+engine (see FallThruDict), and so are evals and ratios, on arrays. The
+patterns of a regexp query are matched once per batch against the distinct
+labels and concepts of its companies.
+
+Every ratio also gets its percentile within the company's peer group: the
+companies sharing the first --peer-digits digits of its SIC code (see the
+companies table of the fact store). Percentiles are taken over the whole
+universe, before filtering.
+
+Facts and ratios that cannot be computed (no filing, a missing concept,
+division by zero) are left empty (NaN); filters on them are false.
+'''
+from __future__ import annotations
+import sys
+import json
+import logging
+import argparse
+from collections import Counter
+from typing import Iterable, Optional
+import numpy
+import pandas
+from lxml.objectify import ObjectifiedElement
+from thingy import log
+from thingy.collections import Date, FallThruDict, Report
+from thingy.edgar.store import FactStore, FACT_STORE_PATH
+from thingy.metric_handlers import CashedExpressionParser, Fact, Ratio
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+PEER_DIGITS = 2
+COMPANY_COLUMNS = ['symbols', 'cik', 'name', 'sic', 'accession']
+DATAPOINT_COLUMNS = ['cik', 'statement', 'concept', 'period_end', 'months', 'value', 'labels', 'accession',
+                     'date_filed']
+# Months of the columns making up a statement, most wanted first, 0 for
+# snapshots (see Report.get_recent_report)
+MONTHS = {'annual': (12, 0), 'quarterly': (3, 6, 9, 0)}
+
+
+class Terms:
+    '''
+    The rows of a (company, term, ...) table grouped by term, to read the
+    values of one term for every company of a batch at once
+    '''
+
+    def __init__(self, frame: pandas.DataFrame, size: int):
+        frame = frame.sort_values('term', kind='stable')
+        self.size = size
+        self.columns = {column: frame[column].to_numpy() for column in frame.columns}
+        terms = self.columns['term']
+        starts = numpy.flatnonzero(numpy.r_[True, terms[1:] != terms[:-1]]) if len(terms) else []
+        stops = numpy.append(starts[1:], len(terms))
+        self.rows = {terms[start]: slice(start, stop) for start, stop in zip(starts, stops)}
+
+    def get(self, term: str, column: str) -> numpy.ndarray:
+        '''column of term for every company, NaN for those without term'''
+        values = numpy.full(self.size, numpy.nan)
+        if (rows := self.rows.get(term)) is not None:
+            values[self.columns['company'][rows]] = self.columns[column][rows]
+        return values
+
+
+class Batch:
+    '''
+    The statements of a batch of companies, as Report.from_columns builds
+    them from the fact store, indexed by term (see Terms) so that queries
+    are answered for the whole batch at once, with the same fall through as
+    FallThruDict:
+
+     - keys: source -> (company, term, value, rank), one row per concept of
+       the company's statement, value scaled as in FallThruDict
+     - labels: source -> (company, term, non_zero, last, rank), one row per
+       (lowercase) label of the company's statement, with the first non-zero
+       and the last values of the concepts carrying it
+
+    company is the position of the company in the batch, rank orders the
+    labels, then the keys, of a company as in FallThruDict.search. Companies
+    without all of the statements (whose Report would be None) have no rows.
+    '''
+
+    def __init__(self, datapoints: list[tuple], ciks: list[str], period: str, stats: Optional[Counter] = None,
+                 windows: Optional[dict[str, tuple]] = None):
+        '''
+        :param datapoints: rows of FactStore.get_datapoints for ciks
+        :param stats: counts the queries of the batch (hits, misses) as
+            Report.query does
+        :param windows: cik -> period end window (see
+            Date.period_end_window) of the datapoints of each company, when
+            they were fetched for a wider one
+        '''
+        self.size = len(ciks)
+        self.stats = Counter() if stats is None else stats
+        self.queries = dict()
+
+        frame = pandas.DataFrame(datapoints, columns=DATAPOINT_COLUMNS)
+        if windows is not None:
+            starts = frame['cik'].map({cik: start.isoformat() for cik, (start, _) in windows.items()})
+            ends = frame['cik'].map({cik: end.isoformat() for cik, (_, end) in windows.items()})
+            frame = frame[(frame['period_end'] >= starts) & (frame['period_end'] <= ends)].reset_index(drop=True)
+        frame['company'] = frame['cik'].map({cik: position for position, cik in enumerate(ciks)}).astype(int)
+        frame['row'] = numpy.arange(len(frame))
+        statements = {source: self.select(frame, source, period) for source in Report.SOURCES}
+        complete = set.intersection(*(set(statement['company']) for statement in statements.values()))
+
+        self.keys, self.labels = dict(), dict()
+        parsed = dict()  # the same labels come back for many companies
+        for source, statement in statements.items():
+            statement = statement[statement['company'].isin(complete)]
+            for labels in statement['labels'].unique():
+                if labels not in parsed:
+                    parsed[labels] = list(dict.fromkeys(label.lower() for label in json.loads(labels)))
+            labels = statement.assign(term=statement['labels'].map(parsed)).explode('term').dropna(subset=['term'])
+            labels = labels.assign(rank=numpy.arange(len(labels)))
+            grouped = labels.groupby(['company', 'term'], sort=False)
+            labels = grouped.agg(last=('value', 'last'), rank=('rank', 'first')).join(
+                labels[labels['value'] != 0].groupby(['company', 'term'], sort=False)['value'].first().rename(
+                    'non_zero')).reset_index()
+            # Keys come after every label of the company
+            keys = statement.rename(columns={'key': 'term'}).assign(rank=statement['order'] + len(labels) + 1)
+            self.keys[source] = Terms(keys[['company', 'term', 'value', 'rank']], self.size)
+            self.labels[source] = Terms(labels[['company', 'term', 'non_zero', 'last', 'rank']], self.size)
+
+        # The filing of a Report is the latest one of its balance sheet
+        latest = statements['balance_sheet'].sort_values(['date_filed', 'accession'], kind='stable')
+        latest = latest[latest['company'].isin(complete)].groupby('company')['accession'].last()
+        self.accessions = [latest.get(company) for company in range(self.size)]
+
+    @staticmethod
+    def select(frame: pandas.DataFrame, source: str, period: str) -> pandas.DataFrame:
+        '''
+        The concepts of the latest column of the most wanted months of each
+        company for source, in statement order
+        '''
+        snapshot = source == 'balance_sheet'
+        ranks = {months: rank for rank, months in enumerate(MONTHS[period])}
+        candidates = frame[frame['statement'].isin(('', source)) & ((frame['months'] == 0) == snapshot)]
+        candidates = candidates.assign(rank=candidates['months'].map(ranks)).dropna(subset=['rank'])
+        chosen = candidates.sort_values(['company', 'rank', 'period_end'], ascending=[True, True, False],
+                                        kind='stable').drop_duplicates('company')
+        column = candidates.merge(chosen[['company', 'period_end', 'months']], on=['company', 'period_end', 'months'])
+
+        # Datapoints without a statement come first, those of the statement win
+        column = column.assign(specific=column['statement'] != '').sort_values(
+            ['company', 'specific', 'row'], kind='stable')
+        column['order'] = numpy.arange(len(column))
+        column = column.groupby(['company', 'concept'], sort=False).agg(
+            order=('order', 'first'), value=('value', 'last'), months=('months', 'last'), labels=('labels', 'last'),
+            accession=('accession', 'last'), date_filed=('date_filed', 'last')).reset_index().sort_values('order')
+        if period == 'quarterly':
+            column['value'] = column['value'] / numpy.where(column['months'] > 0, column['months'] / 3, 1)
+        return column.rename(columns={'concept': 'key'})
+
+    def lookup(self, source: str, term: str) -> numpy.ndarray:
+        '''FallThruDict.get of term (a key or a label) for every company, NaN when not found'''
+        keys, labels = self.keys[source], self.labels[source]
+        key = keys.get(term, 'value')
+        non_zero, last = labels.get(term.lower(), 'non_zero'), labels.get(term.lower(), 'last')
+        # The value of the key if non-zero, else the first non-zero one of
+        # the concepts carrying the label, else the last value found
+        return numpy.where((key != 0) & ~numpy.isnan(key), key,
+                           numpy.where(~numpy.isnan(non_zero), non_zero,
+                                       numpy.where(~numpy.isnan(last), last, key)))
+
+    def get_all(self, source: str, payload: tuple[str]) -> numpy.ndarray:
+        '''Report.query in select mode: one column per term of payload, NaN when not found'''
+        return numpy.column_stack([self.lookup(source, term) for term in payload] or [numpy.full(self.size, numpy.nan)])
+
+    def search(self, source: str, patterns: tuple[str]) -> numpy.ndarray:
+        '''
+        Report.query in regexp mode: the values of the labels and keys
+        matching the patterns, in the order of FallThruDict.search, NaN past
+        the matches of a company
+        '''
+        matcher = FallThruDict.compile_patterns(patterns)
+        columns = [(self.labels[source], label) for label in self.labels[source].rows if matcher(label)]
+        columns.extend((self.keys[source], key) for key in self.keys[source].rows if matcher(key))
+        if not columns:
+            return numpy.full((self.size, 1), numpy.nan)
+
+        ranks = numpy.column_stack([terms.get(term, 'rank') for terms, term in columns])
+        values = numpy.column_stack([self.lookup(source, term) for terms, term in columns])
+        values[numpy.isnan(ranks)] = numpy.nan
+        order = numpy.argsort(numpy.where(numpy.isnan(ranks), numpy.inf, ranks), axis=1, kind='stable')
+        return numpy.take_along_axis(values, order, axis=1)
+
+    def query(self, query: ObjectifiedElement) -> numpy.ndarray:
+        '''Fact.execute_query for every company, NaN when the query has no answer'''
+        source, mode, payload = query.get('source'), query.get('mode'), Fact.get_payload(query)
+        key = (source, mode, payload)
+        outcome = 'hits' if key in self.queries else 'misses'
+        self.stats[outcome] += 1
+        if outcome == 'misses':
+            if source not in Report.SOURCES:
+                raise ValueError(f'Unknown source: {source}')
+            if mode == 'select':
+                self.queries[key] = self.get_all(source, payload)
+            elif mode == 'regexp':
+                self.queries[key] = self.search(source, payload)
+            else:
+                raise ValueError(f'Unsupported mode: {mode}')
+        results = self.queries[key]
+
+        found = ~numpy.isnan(results)
+        answered = found.any(axis=1)
+        if not query.get('post'):
+            values = results[numpy.arange(self.size), found.argmax(axis=1)]
+        elif query.get('post') == 'sum':
+            values = numpy.nansum(results, axis=1)
+        elif query.get('post') == 'static':
+            values = numpy.full(self.size, float(query.get('value')))
+        else:
+            raise ValueError(f'Unsupported post: {query.get("post")}')
+        return numpy.where(answered, values, numpy.nan)
+
+
+class Screener:
+
+    def __init__(self, logic: ObjectifiedElement, store: FactStore, index: dict[str, str],
+                 batch_size: int = BATCH_SIZE):
+        '''
+        :param index: symbol -> cik of the universe (see providers.read_symbols)
+        '''
+        self.facts = self.evaluation_order([Fact(fact) for fact in logic.facts.fact])
+        self.ratios = [Ratio(ratio) for ratio in logic.ratios.ratio]
+        self.store = store
+        self.batch_size = batch_size
+        self.query_stats = Counter()
+
+        self.symbols = dict()  # cik -> symbols
+        for symbol, cik in sorted(index.items()):
+            self.symbols.setdefault(cik, []).append(symbol)
+
+    @staticmethod
+    def evaluation_order(facts: list[Fact]) -> list[Fact]:
+        '''Facts, each after those its eval refers to'''
+        ordered = [fact for fact in facts if not hasattr(fact.fact, 'eval')]
+        pending = [fact for fact in facts if hasattr(fact.fact, 'eval')]
+        while pending:
+            known = {fact.id for fact in ordered}
+            ready = [fact for fact in pending
+                     if set(Fact.expression_parser.variables(fact.fact.eval)) <= known]
+            if not ready:
+                raise ValueError(f'Unable to order the evals of {sorted(fact.id for fact in pending)}')
+            ordered.extend(ready)
+            pending = [fact for fact in pending if fact not in ready]
+        return ordered
+
+    def compute(self, period: str, date: Date, ciks: list[str]) -> pandas.DataFrame:
+        '''Facts and ratios of a batch of companies'''
+        # Each company's window follows its fiscal year, as in Report.from_store
+        fiscal_year_ends = self.store.get_fiscal_year_ends(ciks)
+        windows = {cik: date.period_end_window(period, fiscal_year_ends.get(cik)) for cik in ciks}
+        start = min(start for start, _ in windows.values())
+        end = max(end for _, end in windows.values())
+        batch = Batch(self.store.get_datapoints(ciks, start, end), ciks, period, self.query_stats, windows)
+        companies = self.store.get_companies(ciks)
+
+        values = dict()
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for fact in self.facts:
+                # The first query answered, for each company, as in Engine
+                queried = numpy.full(len(ciks), numpy.nan)
+                for query in (fact.fact.query if hasattr(fact.fact, 'query') else ()):
+                    queried = numpy.where(numpy.isnan(queried), batch.query(query), queried)
+                if hasattr(fact.fact, 'eval'):
+                    evaluated = numpy.asarray(fact.execute_eval(str(fact.fact.eval), values), dtype=float)
+                    queried = numpy.where(numpy.isnan(evaluated), queried, evaluated)
+                values[fact.id] = queried
+
+            ratios = dict()
+            for ratio in self.ratios:
+                a = numpy.asarray(Ratio.calculate_compute(ratio.source.a, values), dtype=float)
+                b = numpy.asarray(Ratio.calculate_compute(ratio.source.b, values), dtype=float)
+                result = a / b
+                result[~numpy.isfinite(result)] = numpy.nan
+                ratios[ratio.id] = result
+
+        return pandas.DataFrame({
+            'symbols': [' '.join(self.symbols[cik]) for cik in ciks],
+            'cik': ciks,
+            'name': [companies.get(cik, {}).get('name') for cik in ciks],
+            'sic': [companies.get(cik, {}).get('sic') for cik in ciks],
+            'accession': batch.accessions,
+            **values,
+            **ratios,
+        })
+
+    def run(self, period: str, date: Date) -> pandas.DataFrame:
+        '''Facts and ratios of every company of the universe for one date'''
+        if date.period_end_window(period) is None:
+            raise ValueError(f'Unable to screen {period} {date.year}Q{date.quarter}')
+
+        ciks = sorted(self.symbols, key=int)
+        batches = list()
+        for start in range(0, len(ciks), self.batch_size):
+            batches.append(self.compute(period, date, ciks[start:start + self.batch_size]))
+            logger.debug('Screened %d of %d companies', min(start + self.batch_size, len(ciks)), len(ciks),
+                         extra={'period': period, 'stage': 'screen'})
+
+        frame = pandas.concat(batches, ignore_index=True) if batches else pandas.DataFrame(
+            columns=COMPANY_COLUMNS + [fact.id for fact in self.facts] + [ratio.id for ratio in self.ratios])
+        logger.info('Screened %d companies, %d with filings', len(frame), frame['accession'].notna().sum(),
+                    extra={'period': period, 'stage': 'screen'})
+        return frame
+
+
+def add_percentiles(frame: pandas.DataFrame, columns: Iterable[str], digits: int = PEER_DIGITS) -> pandas.DataFrame:
+    '''
+    Add <column>_percentile, the percentile (0-100] of each of columns within
+    the peer group (SIC code prefix) of the company
+    '''
+    frame = frame.assign(peer_group=[sic[:digits] if isinstance(sic, str) else None for sic in frame['sic']])
+    groups = frame.groupby('peer_group', dropna=False)
+    for column in columns:
+        frame[f'{column}_percentile'] = groups[column].rank(pct=True) * 100
+    return frame
+
+
+def where(frame: pandas.DataFrame, expressions: Iterable[str]) -> pandas.DataFrame:
+    '''Rows matching every expression, e.g. "current_ratio > 1.5"'''
+    parser = CashedExpressionParser()
+    mask = numpy.ones(len(frame), dtype=bool)
+    for expression in expressions:
+        variables = parser.variables(expression)
+        if unknown := [variable for variable in variables if variable not in frame]:
+            raise ValueError(f'Unknown columns in {expression!r}: {unknown}')
+        with numpy.errstate(invalid='ignore'):
+            mask &= numpy.asarray(parser.evaluate(
+                expression, {variable: frame[variable].to_numpy(dtype=float) for variable in variables}), dtype=bool)
+    return frame[mask]
+
+
+def screen(screener: Screener, period: str, date: Date, expressions: Iterable[str] = (),
+           sort: Optional[str] = None, ascending: bool = False, top: Optional[int] = None,
+           digits: int = PEER_DIGITS) -> pandas.DataFrame:
+    '''Run screener, add peer percentiles, then filter, sort and keep the top rows'''
+    frame = add_percentiles(screener.run(period, date), [ratio.id for ratio in screener.ratios], digits)
+    frame = where(frame, expressions)
+    if sort is not None:
+        frame = frame.sort_values(sort, ascending=ascending, na_position='last', kind='stable')
+    if top is not None:
+        frame = frame.head(top)
+    return frame.reset_index(drop=True)
+
+
+def main(argv: list[str] = None) -> int:
+    from thingy import snapshot
+    from thingy.providers import read_symbols
+    from thingy.service import parse_date
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('date', type=parse_date, metavar='YYYYQN|YYYY')
+    parser.add_argument('--period', choices=('quarterly', 'annual'),
+                        help='default: annual for years, quarterly for quarters')
+    parser.add_argument('--where', action='append', default=[], metavar='EXPRESSION',
+                        help='keep the rows matching (repeat to combine), e.g. "current_ratio > 1.5"')
+    parser.add_argument('--sort', help='column to sort by, descending unless --ascending')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--top', type=int, help='keep the first N rows')
+    parser.add_argument('--peer-digits', type=int, default=PEER_DIGITS, help='SIC code digits of a peer group')
+    parser.add_argument('--columns', nargs='*', help='columns to output (default: all)')
+    parser.add_argument('--output', default='-', help='CSV file (default: stdout)')
+    parser.add_argument('--symbols', help='symbols index (default: the one of the snapshot)')
+    parser.add_argument('--store', default=FACT_STORE_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    log.configure(logging.INFO)
+    period = args.period or ('annual' if args.date.quarter == 0 else 'quarterly')
+    current = snapshot.load()
+    index = read_symbols(args.symbols) if args.symbols else current.symbols
+    store = FactStore(args.store)
+    try:
+        screener = Screener(current.logic, store, index, args.batch_size)
+        frame = screen(screener, period, args.date, args.where, args.sort, args.ascending, args.top,
+                       args.peer_digits)
+    finally:
+        store.close()
+    if args.columns:
+        frame = frame[args.columns]
+    frame.to_csv(sys.stdout if args.output == '-' else args.output, index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
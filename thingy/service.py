@@ -0,0 +1,300 @@
+'''
+Long-running service answering queries over HTTP
+
+Keeps everything a run needs warm between requests: the compiled logic and
+state machine configuration, the providers (with the symbols index and their
+stocks), the master index, filings, reports and the fact store. engine.xml is
+reloaded whenever it changes on disk.
+
+    python -m thingy.service --port 8000
+
+Endpoints:
+
+    POST /query    {"symbols": ["XOM", "CVX"],
+                    "dates": {"quarterly": ["2020Q3", "2020Q2"], "annual": [2019]},
+                    "format": "json"}
+                   format "json" (default) returns the results as export rows,
+                   "html" returns the rendered report
+    GET /metrics   cache, provider and request stats, plus thingy.metrics
+    GET /health
+'''
+from __future__ import annotations
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import http.server
+import lxml.objectify
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from thingy import log, metrics
+from thingy.cache import LRUCache
+from thingy.catalog import Catalog
+from thingy.collections import Date
+from thingy.edgar.edgar import MASTER_INDEX_CACHE
+from thingy.edgar.store import FactStore
+from thingy.engine import Engine, machine_config, FILING_CACHE_SIZE, REPORT_CACHE_SIZE
+from thingy.export import COLUMNS, iter_rows
+from thingy.negative_cache import NegativeCache
+from thingy.providers import ProviderRegistry
+from thingy.view import load_template, render
+
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+LOGIC_PATH = os.path.join(ROOT_PATH, 'engine.xml')
+TEMPLATE_PATH = os.path.join(ROOT_PATH, 'templates', 'template.html.mako')
+
+WORKERS = 4
+BACKLOG = 16  # requests accepted and waiting for a worker, at most
+MAX_REQUEST_SIZE = 1 << 20
+
+
+class Service:
+    '''
+    Warm state shared by every request; each query runs on its own Engine
+    '''
+
+    def __init__(self, logic_path: str = LOGIC_PATH, template_path: str = TEMPLATE_PATH,
+                 providers: Optional[ProviderRegistry] = None, fact_store: Optional[FactStore] = None,
+                 filing_cache_size: int = FILING_CACHE_SIZE, report_cache_size: int = REPORT_CACHE_SIZE):
+        self.logic_path = logic_path
+        self.template_path = template_path
+        self.providers = ProviderRegistry.default() if providers is None else providers
+        self.fact_store = FactStore.configured() if fact_store is None else fact_store
+        self.misses = NegativeCache(self.fact_store.path)
+        self.catalog = None
+        self.filings = LRUCache(filing_cache_size, name='filings')
+        self.reports = LRUCache(report_cache_size, name='reports')
+        self.stats = Counter()
+        self._template = None
+        self._logic = None
+        self._logic_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def logic(self) -> tuple[lxml.objectify.ObjectifiedElement, dict]:
+        '''The logic and its machine configuration, reloaded if engine.xml changed'''
+        mtime = os.stat(self.logic_path).st_mtime_ns
+        with self._lock:
+            if mtime != self._logic_mtime:
+                with open(self.logic_path) as f:
+                    logic = lxml.objectify.fromstring(f.read())
+                self._logic = logic, machine_config(logic)
+                if self.catalog is None:
+                    self.catalog = Catalog.of(self.fact_store, logic)
+                else:
+                    self.catalog.sync(logic)
+                if self._logic_mtime is not None:
+                    logger.info('Reloaded %s', self.logic_path)
+                    self.stats['logic.reloads'] += 1
+                self._logic_mtime = mtime
+            return self._logic
+
+    @property
+    def template(self):
+        with self._lock:
+            if self._template is None:
+                self._template = load_template(self.template_path)
+            return self._template
+
+    def engine(self, symbols: list[str]) -> Engine:
+        logic, machine = self.logic
+        return Engine(symbols=symbols, logic=logic, template_engine=self.template,
+                      fact_store=self.fact_store, providers=self.providers,
+                      filings=self.filings, reports=self.reports, machine=machine, misses=self.misses,
+                      catalog=self.catalog)
+
+    def query(self, symbols: list[str], dates: dict[str, list[Date]]) -> Engine:
+        start = time.perf_counter()
+        try:
+            return self.engine(symbols).execute(dates)
+        finally:
+            with self._lock:
+                self.stats['queries'] += 1
+                self.stats['query.seconds'] += time.perf_counter() - start
+
+    def summary(self) -> dict:
+        caches = (self.filings, self.reports, MASTER_INDEX_CACHE)
+        return {
+            'service': dict(self.stats),
+            'caches': {name: {'size': len(cache), 'hits': cache.hits, 'misses': cache.misses}
+                       for name, cache in zip(('filings', 'reports', 'master_index'), caches)},
+            'providers': {provider.name: {'calls': dict(provider.stats.calls),
+                                          'errors': dict(provider.stats.errors),
+                                          'latency': dict(provider.stats.latency)}
+                          for provider in self.providers},
+            'metrics': metrics.METRICS.summary(),
+        }
+
+
+def parse_date(value) -> Date:
+    '''2020Q3 -> Date(2020, 3); 2019 (or "2019") -> Date(2019, 0)'''
+    if match := re.fullmatch(r'(\d{4})(?:Q([0-4]))?', str(value).strip().upper()):
+        return Date(int(match.group(1)), int(match.group(2) or 0))
+    raise ValueError(f'Invalid date: {value!r}')
+
+
+def parse_query(body: dict) -> tuple[list[str], dict[str, list[Date]], str]:
+    if not isinstance(body, dict):
+        raise ValueError('Expected a JSON object')
+    symbols = body.get('symbols')
+    dates = body.get('dates')
+    format = body.get('format', 'json')
+    if not symbols or not isinstance(symbols, list):
+        raise ValueError('symbols must be a non-empty list')
+    if not dates or not isinstance(dates, dict):
+        raise ValueError('dates must map periods to lists of dates')
+    if unknown := set(dates) - {'quarterly', 'annual'}:
+        raise ValueError(f'Unknown periods: {", ".join(sorted(unknown))}')
+    if format not in ('json', 'html'):
+        raise ValueError(f'Unsupported format: {format}')
+    return ([str(symbol).upper() for symbol in symbols],
+            {period: [parse_date(date) for date in date_list] for period, date_list in dates.items()},
+            format)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    service: Service = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.service.summary())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_json(404, {'error': f'Not found: {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_SIZE:
+                raise ValueError('Request too large')
+            symbols, dates, format = parse_query(json.loads(self.rfile.read(length) or b'{}'))
+        except ValueError as e:  # includes malformed JSON
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            engine = self.service.query(symbols, dates)
+        except Exception as e:
+            logger.exception('Query failed: %s %s', symbols, dates)
+            self.send_json(500, {'error': repr(e)})
+            return
+
+        if format == 'json':
+            self.send_json(200, {'columns': COLUMNS, 'rows': list(iter_rows(engine.context)),
+                                 'skipped': [{'period': key.period, 'symbol': key.symbol, 'year': key.year,
+                                              'quarter': key.quarter, 'reason': miss.reason, 'detail': miss.detail}
+                                             for key, miss in engine.context.skipped.items()]})
+        else:
+            # Stream the report; without a Content-Length the connection is closed at the end
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            writer = Utf8Writer(self.wfile)
+            render(engine.template_engine, engine.context, writer)
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+
+class Utf8Writer:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str):
+        self.stream.write(text.encode())
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    '''
+    HTTP server handling requests on a bounded pool of worker threads. Once
+    backlog requests are waiting for a worker, no more connections are
+    accepted until one is done, so clients queue up in the listen backlog
+    rather than in memory.
+    '''
+
+    def __init__(self, address: tuple[str, int], handler: type, workers: int = WORKERS, backlog: int = BACKLOG):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thingy-service')
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self.pool.submit(self._process_request, request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def serve(service: Service, host: str = '127.0.0.1', port: int = 8000, workers: int = WORKERS,
+          backlog: int = BACKLOG) -> PooledHTTPServer:
+    '''Return a server for service; call serve_forever() on it to start serving'''
+    handler = type('ServiceHandler', (Handler,), {'service': service})
+    return PooledHTTPServer((host, port), handler, workers=workers, backlog=backlog)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--backlog', type=int, default=BACKLOG)
+    parser.add_argument('--logic', default=LOGIC_PATH)
+    parser.add_argument('--template', default=TEMPLATE_PATH)
+    parser.add_argument('--store', help='fact store to keep across runs (default: THINGY_FACT_STORE, else none)')
+    parser.add_argument('--companyfacts', metavar='SOURCE',
+                        help="companyfacts documents (a directory or companyfacts.zip, or 'sec' to download them) "
+                             'to answer cells from ahead of EDGAR')
+    args = parser.parse_args(argv)
+
+    log.configure(logging.INFO)
+    service = Service(logic_path=args.logic, template_path=args.template,
+                      providers=ProviderRegistry.default(args.companyfacts),
+                      fact_store=FactStore(args.store) if args.store else None)
+    service.logic  # fail early on bad logic
+    server = serve(service, args.host, args.port, args.workers, args.backlog)
+    logger.info('Serving on http://%s:%d', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
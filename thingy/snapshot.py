@@ -0,0 +1,128 @@
+'''
+Startup snapshot
+
+Everything a run needs before it can start working (the logic, its state
+machine configuration and the symbols index) is kept in a single pickle, so
+a cold start is one read rather than parsing engine.xml, converting the
+machine configuration and reading symbols.csv:
+
+    python -m thingy.snapshot    # (re)build thingy/data/snapshot.pickle
+
+load() rebuilds the snapshot whenever one of its sources has changed, so it
+never has to be built by hand.
+'''
+from __future__ import annotations
+import os
+import sys
+import pickle
+import logging
+import argparse
+import lxml.objectify
+from dataclasses import dataclass
+from typing import Optional
+from thingy.catalog import Catalog
+from thingy.edgar.edgar import SYMBOLS_DATA_PATH
+from thingy.edgar.store import FactStore
+from thingy.engine import machine_config
+from thingy.providers import ProviderRegistry, read_symbols
+
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+LOGIC_PATH = os.path.join(ROOT_PATH, 'engine.xml')
+SNAPSHOT_PATH = os.path.join(ROOT_PATH, 'data', 'snapshot.pickle')
+
+# Bumped whenever the layout of Snapshot changes
+VERSION = 1
+
+
+@dataclass
+class Snapshot:
+    logic_xml: bytes
+    machine: dict
+    symbols: dict[str, str]
+    logic_path: str
+    symbols_path: str
+    mtimes: tuple[int, int]  # of logic_path and symbols_path, when it was built
+    version: int = VERSION
+
+    @property
+    def logic(self) -> lxml.objectify.ObjectifiedElement:
+        return lxml.objectify.fromstring(self.logic_xml)
+
+    def is_fresh(self) -> bool:
+        return self.version == VERSION and self.mtimes == (_mtime(self.logic_path), _mtime(self.symbols_path))
+
+    def providers(self, companyfacts: Optional[str] = None) -> ProviderRegistry:
+        '''The default providers (see ProviderRegistry.default), with the symbols index of the snapshot'''
+        return ProviderRegistry.default(companyfacts, self.symbols_path, dict(self.symbols))
+
+    def catalog(self, fact_store: FactStore) -> Optional[Catalog]:
+        '''The catalog of fact_store, resolving the queries of the logic of the snapshot (see Catalog.of)'''
+        return Catalog.of(fact_store, self.logic)
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def build(logic_path: str = LOGIC_PATH, symbols_path: str = SYMBOLS_DATA_PATH) -> Snapshot:
+    # Taken before reading, so that a file changing meanwhile makes the snapshot stale
+    mtimes = (_mtime(logic_path), _mtime(symbols_path))
+    with open(logic_path, 'rb') as f:
+        logic_xml = f.read()
+    return Snapshot(logic_xml=logic_xml,
+                    machine=machine_config(lxml.objectify.fromstring(logic_xml)),
+                    symbols=read_symbols(symbols_path),
+                    logic_path=logic_path,
+                    symbols_path=symbols_path,
+                    mtimes=mtimes)
+
+
+def save(snapshot: Snapshot, path: str = SNAPSHOT_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+
+def load(path: str = SNAPSHOT_PATH, logic_path: str = LOGIC_PATH,
+         symbols_path: str = SYMBOLS_DATA_PATH) -> Snapshot:
+    '''The snapshot at path, rebuilt (and saved) if it is missing or stale'''
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.loads(f.read())
+        if ((snapshot.logic_path, snapshot.symbols_path) == (logic_path, symbols_path)
+                and snapshot.is_fresh()):
+            return snapshot
+    except FileNotFoundError:
+        pass
+    except Exception as e:  # an unreadable snapshot is only a cache miss
+        logger.warning('Ignoring snapshot %s: %r', path, e)
+
+    snapshot = build(logic_path, symbols_path)
+    try:
+        save(snapshot, path)
+    except OSError as e:
+        logger.warning('Unable to save snapshot %s: %r', path, e)
+    return snapshot
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=SNAPSHOT_PATH)
+    parser.add_argument('--logic', default=LOGIC_PATH)
+    parser.add_argument('--symbols', default=SYMBOLS_DATA_PATH)
+    args = parser.parse_args(argv)
+
+    snapshot = build(args.logic, args.symbols)
+    save(snapshot, args.output)
+    print(f'Saved {args.output}: {len(snapshot.symbols)} symbols, {len(snapshot.logic_xml)} bytes of logic')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
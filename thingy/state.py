@@ -1,11 +1,11 @@
 import dataclasses
-from typing import Union, Any
+from typing import Union, Any, Optional
 from lxml.objectify import ObjectifiedElement
 from thingy.collections import Report
 from thingy.collections import FallThruDict, Date
-from collections import defaultdict
-from icecream import ic
+from collections import defaultdict, Counter
 from thingy.metric_handlers import Fact, Ratio
+from thingy.negative_cache import Miss
 
 
 @dataclasses.dataclass(frozen=True)
@@ -20,6 +20,11 @@ class ResultKey:
 class ResultValue:
     facts: dict[str, float]
     ratios: dict[str, Ratio.Metric]
+    accession: Optional[str] = None
+    # Name of the provider that answered the cell, and why the preferred
+    # ones could not when it is a fallback (see Engine.get_report)
+    provider: Optional[str] = None
+    fallback: Optional[str] = None
 
 
 @dataclasses.dataclass
@@ -55,6 +60,13 @@ class State:
     result: dict[ResultKey, ResultValue] = dataclasses.field(
         default_factory=lambda: defaultdict(
             lambda: ResultValue(facts=dict(), ratios=dict())))
+    filings: dict[str, list[ResultKey]] = dataclasses.field(
+        default_factory=lambda: defaultdict(list))
+    query_stats: Counter = dataclasses.field(default_factory=Counter)
+    # Cells with nothing to compare, see thingy.negative_cache
+    skipped: dict[ResultKey, Miss] = dataclasses.field(default_factory=dict)
+    # (fact id, position of the query answering it) -> cells, see thingy.catalog
+    answers: Counter = dataclasses.field(default_factory=Counter)
     metadata: Metadata = dataclasses.field(
         default_factory=lambda: Metadata(
             facts=defaultdict(dict),
@@ -71,8 +83,8 @@ class State:
     @property
     def key(self) -> ResultKey:
         if not all((self.period, self.symbol, self.date)):
-            ic(self)
-            raise ValueError('Unable to create key')
+            raise ValueError(f'Unable to create key: period={self.period!r}, '
+                             f'symbol={self.symbol!r}, date={self.date!r}')
         return ResultKey(period=self.period,
                          symbol=self.symbol,
                          year=self.date.year,
@@ -10,7 +10,7 @@
   <link rel="stylesheet" href="https://cdn.simplecss.org/simple.min.css">
   <link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/v/ju-1.12.1/jq-3.3.1/dt-1.10.23/cr-1.5.3/fh-3.1.8/rr-1.2.7/datatables.min.css"/>
   <title>
-    Comparative analysis of ${metadata.symbols} :: Market Thingy
+    Comparative analysis of ${view.symbols} :: Market Thingy
   </title>
   <script type="text/javascript" src="https://cdn.datatables.net/v/ju-1.12.1/jq-3.3.1/dt-1.10.23/cr-1.5.3/fh-3.1.8/rr-1.2.7/datatables.min.js"></script>
   <script type="text/javascript" src="https://cdnjs.cloudflare.com/ajax/libs/jquery-sparklines/2.1.2/jquery.sparkline.min.js"></script>
@@ -51,7 +51,7 @@
     This is a comparative analysis of the following stocks:
 
     <ul>
-      %for symbol in metadata.symbols:
+      %for symbol in view.symbols:
         <li>${symbol}</li>
       %endfor
     </ul>
@@ -62,51 +62,35 @@
 
     <div id='tabs'>
       <ul>
-        %for period in ['quarterly', 'annual']:
-          <li><a href='#tabs-${period}-reports'>${period.title()} Reports</a></li>
+        %for period in view.periods:
+          <li><a href='#tabs-${period.period}-reports'>${period.title} Reports</a></li>
         %endfor
       </ul>
 
-      %for period in ['quarterly', 'annual']:
-        <div id='tabs-${period}-reports'>
+      %for period in view.periods:
+        <div id='tabs-${period.period}-reports'>
 
-          %for fact_group, facts in metadata.facts.items():
-            <h2>${fact_group} (${period.title()})</h2>
+          %for table in period.fact_tables:
+            <h2>${table.group} (${period.title})</h2>
             <table>
               <thead>
                 <tr>
                   <td></td>
-                  %for fact in facts:
+                  %for fact in table.facts:
                     <th>${fact.label}</th>
                   %endfor
 
                 </tr>
               </thead>
               <tbody>
-                %for symbol in metadata.symbols:
+                %for row in table.rows:
                   <tr>
-                    <th>${symbol}</th>
-                    %for fact in facts:
+                    <th>${row.symbol}</th>
+                    %for cell in row.cells:
                       <td>
-                        <%
-                        key = ResultKey(period=period,
-                                symbol=symbol,
-                                year=metadata.dates[period][-1].year,
-                                quarter=metadata.dates[period][-1].quarter)
-                        %>
-                        $${f'{result[key].facts[fact.id]:,}'}
+                        ${cell.value}
                         <span class="sparkline bar facts">
-                        <%
-                          values = list()
-                          for date in metadata.dates[period]:
-                            key = ResultKey(period=period,
-                                    symbol=symbol,
-                                    year=date.year,
-                                    quarter=date.quarter)
-                            if key in result:
-                              values.append(str(int(result[key].facts[fact.id])))
-                        %>
-                        ${','.join(values)}
+                        ${cell.sparkline}
                         </span>
                       </td>
                     %endfor
@@ -118,13 +102,13 @@
 
           <h1>Ratios</h1>
 
-          %for ratio_group, ratios in metadata.ratios.items():
-            <h2>${ratio_group} (${period.title()})</h2>
+          %for table in period.ratio_tables:
+            <h2>${table.group} (${period.title})</h2>
 
             <blockquote>
               <h3>Definitions</h3>
               <ul>
-              %for ratio in ratios:
+              %for ratio in table.ratios:
                 <li><b>${ratio.label}</b> - ${ratio.description}</li>
               %endfor
               </ul>
@@ -134,7 +118,7 @@
               <thead>
                 <tr>
                   <td></td>
-                  %for ratio in ratios:
+                  %for ratio in table.ratios:
                     <th>
                       ${ratio.label}
                       <div class="source a"><span>&#9679;</span>${ratio.source.a}</div>
@@ -144,38 +128,17 @@
                 </tr>
               </thead>
               <tbody>
-                %for symbol in metadata.symbols:
+                %for row in table.rows:
                   <tr>
-                    <th>${symbol}</th>
-                    %for ratio in ratios:
+                    <th>${row.symbol}</th>
+                    %for cell in row.cells:
                       <td>
-                        <%
-                        key = ResultKey(period=period,
-                                symbol=symbol,
-                                year=metadata.dates[period][-1].year,
-                                quarter=metadata.dates[period][-1].quarter)
-                        %>
-                        ${f'{result[key].ratios[ratio.id].ratio:.2f}'}
+                        ${cell.ratio}
                         <span class="sparkline pie ratio">
-                        ${result[key].ratios[ratio.id].a}, ${result[key].ratios[ratio.id].b}
+                        ${cell.pie}
                         </span>
                         <span class="sparkline bar ratio">
-                          <%
-                          values = list()
-                          for date in metadata.dates[period]:
-                            key = ResultKey(period=period,
-                                    symbol=symbol,
-                                    year=date.year,
-                                    quarter=date.quarter)
-                            if key in result:
-                              values.append(
-                                ':'.join((
-                                  str(result[key].ratios[ratio.id].a),
-                                  str(result[key].ratios[ratio.id].b)
-                                ))
-                            )
-                          %>
-                          ${','.join(values)}
+                          ${cell.sparkline}
                         </span>
                       </td>
                     %endfor
@@ -186,13 +149,64 @@
           %endfor
         </div>
       %endfor
+
+    %if view.fallbacks:
+      <h1>Other sources</h1>
+      <p>The preferred providers could not answer these, so they were taken from another one.</p>
+      <table>
+        <thead>
+          <tr>
+            <th>Symbol</th>
+            <th>Period</th>
+            <th>Date</th>
+            <th>Taken from</th>
+            <th>Reason</th>
+          </tr>
+        </thead>
+        <tbody>
+          %for cell in view.fallbacks:
+            <tr>
+              <th>${cell.symbol}</th>
+              <td>${cell.period}</td>
+              <td>${cell.date}</td>
+              <td>${cell.provider}</td>
+              <td>${cell.reason | h}</td>
+            </tr>
+          %endfor
+        </tbody>
+      </table>
+    %endif
+
+    %if view.skipped:
+      <h1>Skipped</h1>
+      <p>Nothing to compare was found for these, so they are left empty.</p>
+      <table>
+        <thead>
+          <tr>
+            <th>Symbol</th>
+            <th>Period</th>
+            <th>Date</th>
+            <th>Reason</th>
+            <th>Tried again after</th>
+          </tr>
+        </thead>
+        <tbody>
+          %for cell in view.skipped:
+            <tr title="${cell.detail | h}">
+              <th>${cell.symbol}</th>
+              <td>${cell.period}</td>
+              <td>${cell.date}</td>
+              <td>${cell.reason}</td>
+              <td>${cell.until}</td>
+            </tr>
+          %endfor
+        </tbody>
+      </table>
+    %endif
   </main>
 
   <footer>
-    <%
-    import datetime
-    %>
-    This file was generated by MarketThingy at ${datetime.datetime.now().isoformat()}
+    This file was generated by MarketThingy at ${view.generated}
   </footer>
 </body>
 </html>
@@ -0,0 +1,8 @@
+import pytest
+from thingy.tests.doubles import load_logic
+
+
+@pytest.fixture
+def logic():
+    '''The logic of engine.xml'''
+    return load_logic()
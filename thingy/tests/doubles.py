@@ -0,0 +1,67 @@
+'''
+Test doubles serving pre-generated submissions (see benchmarks.synthetic),
+so that engine runs need no network access, and the engines running them
+'''
+from __future__ import annotations
+import os
+import lxml.objectify
+from typing import Iterable, Optional
+from lxml.objectify import ObjectifiedElement
+from thingy.edgar.edgar import FilingInfo
+from thingy.edgar.filing import Filing
+from thingy.edgar.store import FactStore
+from thingy.engine import Engine
+from thingy.providers import Provider, ProviderRegistry
+
+LOGIC_PATH = os.path.join(os.path.dirname(__file__), '..', 'engine.xml')
+
+
+def load_logic() -> ObjectifiedElement:
+    '''The logic of engine.xml (see also the logic fixture)'''
+    with open(LOGIC_PATH) as f:
+        return lxml.objectify.fromstring(f.read())
+
+
+def new_engine(tmp_path, providers: ProviderRegistry, symbols: Iterable[str] = ('AAA',), store: str = 'facts',
+               logic: Optional[ObjectifiedElement] = None, **engine_args) -> Engine:
+    '''
+    An Engine over providers, without a template unless given, keeping its
+    facts and misses in tmp_path/<store>.sqlite
+    '''
+    engine_args.setdefault('template_engine', None)
+    return Engine(symbols=list(symbols), logic=load_logic() if logic is None else logic, providers=providers,
+                  fact_store=FactStore(str(tmp_path / f'{store}.sqlite')), **engine_args)
+
+
+class SyntheticStock:
+    '''Stand-in for edgar.stock.Stock serving a pre-generated submission'''
+
+    def __init__(self, symbol: str, submission: str, accession: str):
+        self.symbol = symbol
+        self.submission = submission
+        self.accession = accession
+
+    def get_filing_info(self, period: str, year: int, quarter: int) -> FilingInfo:
+        return FilingInfo(self.symbol, '10-Q', '0', f'{year}-01-01',
+                          f'edgar/data/0/{self.accession}.txt')
+
+    def load_filing(self, filing_info: FilingInfo) -> Filing:
+        return Filing(filing_info.url, company=self.symbol, text=self.submission)
+
+    def download_filing(self, filing_info: FilingInfo) -> str:
+        return self.submission
+
+
+class SyntheticProvider(Provider):
+    name = 'synthetic'
+
+    def __init__(self, submission: str, accession: str):
+        super().__init__()
+        self.submission = submission
+        self.accession = accession
+
+    def covers(self, symbol: str) -> bool:
+        return True
+
+    def get_stock(self, symbol: str) -> SyntheticStock:
+        return SyntheticStock(symbol, self.submission, self.accession)
@@ -0,0 +1,48 @@
+import pytest
+from thingy.cache import LRUCache
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1  # 'b' is now the least recently used
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert ('a' in cache, 'c' in cache, len(cache)) == (True, True, 2)
+
+    cache['a'] = 4  # setting refreshes too
+    cache['d'] = 5
+    assert 'c' not in cache
+    assert cache['a'] == 4
+
+
+def test_get_or_create():
+    cache = LRUCache(2)
+    calls = list()
+
+    def factory():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_create('a', factory) == 1
+    assert cache.get_or_create('a', factory) == 1
+    assert len(calls) == 1
+
+
+def test_counters():
+    cache = LRUCache(1)
+    assert cache.get('a') is None
+    assert cache.get('a', 0) == 0
+    cache['a'] = 1
+    assert cache.get('a') == 1
+    with pytest.raises(KeyError):
+        cache['b']
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    cache.clear()
+    assert len(cache) == 0
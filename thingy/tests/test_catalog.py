@@ -0,0 +1,177 @@
+import os
+import shutil
+import datetime
+from collections import Counter
+import lxml.objectify
+from benchmarks.synthetic import BALANCE_SHEET_CONCEPTS, SubmissionSpec, generate_submission
+from thingy.catalog import Catalog, regexp_queries
+from thingy.collections import Date, FallThruDict, Report
+from thingy.edgar.financials import FinancialElement, FinancialInfo
+from thingy.edgar.store import FactStore
+from thingy.providers import ProviderRegistry
+from thingy.service import Service
+from thingy.tests.doubles import LOGIC_PATH, SyntheticProvider, new_engine
+
+PERIOD_END = datetime.date(2020, 6, 30)
+FILED = datetime.date(2020, 8, 5)
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_store(tmp_path):
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    rows = list()
+    for cik, liabilities_label in (('1', 'Total liabilities'), ('2', 'Liabilities, total')):
+        accession = f'{int(cik):010d}-20-000001'
+        for concept, labels, value in (
+                ('us-gaap_Assets', ['Total assets'], 1000),
+                ('us-gaap_AssetsCurrent', ['Total current assets'], 200),
+                ('us-gaap_Liabilities', [liabilities_label], 400),
+                ('us-gaap_LiabilitiesCurrent', ['Total current liabilities'], 100),
+                ('us-gaap_LongTermDebtNoncurrent', ['Long-term debt', 'LongTerm debt'], 250),
+                ('us-gaap_RetainedEarningsAccumulatedDeficit', ['Retained earnings'], 50)):
+            rows.append((cik, 'balance_sheet', concept, PERIOD_END, None, value, labels, accession, FILED))
+        rows.append((cik, 'income_statements', 'us-gaap_Revenues', PERIOD_END, 3, 100, ['Revenues'],
+                     accession, FILED))
+        rows.append((cik, 'cash_flow', 'us-gaap_NetIncomeLoss', PERIOD_END, 3, 10, [], accession, FILED))
+    # Datapoints without a statement, e.g. from companyfacts
+    rows.append(('2', '', 'us-gaap_DebtCurrent', PERIOD_END, None, 30, ['Debt, current'],
+                 '0000000002-20-000001', FILED))
+    store.add_facts(rows)
+    return store
+
+
+def test_build(tmp_path):
+    new_store(tmp_path)
+    catalog = Catalog(str(tmp_path / 'facts.sqlite'))
+    assert catalog.build() == 9
+
+    [entry] = catalog.lookup('us-gaap_Liabilities')
+    assert (entry.statement, entry.filers, entry.frequency) == ('balance_sheet', 2, 2)
+    assert sorted(entry.labels) == ['Liabilities, total', 'Total liabilities']
+    assert [entry.concept for entry in catalog.find_label('TOTAL LIABILITIES')] == ['us-gaap_Liabilities']
+    assert catalog.lookup('nope') == []
+
+    assert {entry.concept for entry in catalog.search('longterm')} == {'us-gaap_LongTermDebtNoncurrent'}
+    assert {entry.concept for entry in catalog.search('debt', statement='balance_sheet')} == {
+        'us-gaap_LongTermDebtNoncurrent', 'us-gaap_DebtCurrent'}
+    assert catalog.search('debt', statement='cash_flow') == [catalog.lookup('us-gaap_DebtCurrent')[0]]
+    assert len(catalog.search('', limit=3)) == 3
+
+    # Rebuilding a single filer leaves the others alone
+    assert catalog.build(['2']) == 9
+    assert catalog.lookup('us-gaap_Liabilities')[0].filers == 2
+
+
+def test_resolved_queries(tmp_path, logic):
+    store = new_store(tmp_path)
+    catalog = Catalog(store.path)
+    catalog.build()
+    queries = regexp_queries(logic)
+    assert catalog.compile(logic) == 2 * len(queries)
+
+    for cik in ('1', '2'):
+        scanned = Report.from_store(store, cik, 'quarterly', Date(2020, 3))
+        resolved = catalog.resolve(cik, Report.from_store(store, cik, 'quarterly', Date(2020, 3)))
+        assert set(resolved.resolved) == set(queries)
+        for source, patterns in queries:
+            assert resolved.query(source, 'regexp', patterns) == scanned.query(source, 'regexp', patterns)
+        assert resolved.stats['resolved'] == len(queries)
+
+    # Patterns matching some of the labels and concepts only
+    logic = lxml.objectify.fromstring(
+        "<root><facts><fact id='debt'>"
+        "<query source='balance_sheet' mode='regexp'>.*debt</query>"
+        "<query source='cash_flow' mode='regexp'>us-gaap_net.*</query>"
+        "</fact></facts></root>")
+    assert catalog.compile(logic, ['2']) == 2
+    resolved = catalog.resolve('2', Report.from_store(store, '2', 'quarterly', Date(2020, 3)))
+    assert resolved.resolved == {
+        ('balance_sheet', ('.*debt',)): (('debt, current', 'long-term debt', 'longterm debt'),
+                                         ('us-gaap_DebtCurrent', 'us-gaap_LongTermDebtNoncurrent')),
+        ('cash_flow', ('us-gaap_net.*',)): ((), ('us-gaap_NetIncomeLoss',))}
+    scanned = Report.from_store(store, '2', 'quarterly', Date(2020, 3))
+    assert resolved.query('balance_sheet', 'regexp', ('.*debt',)) == \
+        scanned.query('balance_sheet', 'regexp', ('.*debt',)) == [30, 250, 250, 30, 250]
+    assert resolved.query('cash_flow', 'regexp', ('us-gaap_net.*',)) == [10]
+
+    # Filings stored since the catalog was built are searched
+    assert catalog.resolutions('1', ['0000000001-20-000001', '0000000001-21-000001']) == {}
+    # as are datapoints they relabel, e.g. as a comparative column
+    store.add_facts([('2', 'balance_sheet', 'us-gaap_LongTermDebtNoncurrent', PERIOD_END, None, 250,
+                      ['Debt, noncurrent'], '0000000002-21-000001', datetime.date(2021, 8, 5))])
+    relabeled = catalog.resolve('2', Report.from_store(store, '2', 'quarterly', Date(2020, 3)))
+    assert relabeled.resolved == {}
+    assert relabeled.query('balance_sheet', 'regexp', ('.*debt',)) == [30, 250, 30, 250]
+    # Parsed reports are searched too
+    stored = Report.from_store(store, '1', 'quarterly', Date(2020, 3))
+    parsed = Report(**{source: FallThruDict(FinancialInfo(PERIOD_END, None, {
+        concept: FinancialElement(fact.labels, fact.values) for concept, fact in getattr(stored, source).items()}),
+        'quarterly') for source in Report.SOURCES}, accession=stored.accession)
+    assert catalog.resolve('1', parsed).resolved == {}
+
+
+def new_provider():
+    # Without these, facts fall back to later queries, regexp ones included
+    missing = ('us-gaap_Liabilities', 'us-gaap_LongTermDebt', 'us-gaap_RetainedEarningsAccumulatedDeficit')
+    spec = SubmissionSpec(documents=2)
+    spec.statements['R2.htm'] = (spec.statements['R2.htm'][0],
+                                 [row for row in BALANCE_SHEET_CONCEPTS if row[0] not in missing])
+    provider = SyntheticProvider(generate_submission(spec), spec.accession)
+    provider.cik = lambda symbol: '1'
+    return provider
+
+
+def test_engine(tmp_path):
+    catalog = Catalog(str(tmp_path / 'facts.sqlite'))
+    dates = {'quarterly': [Date(2020, 3), Date(2020, 4)]}
+    expected = new_engine(tmp_path, ProviderRegistry([new_provider()]), catalog=catalog).execute(dates)
+    assert expected.context.query_stats['resolved'] == 0
+
+    catalog.build()
+    catalog.compile(expected.logic)
+    engine = new_engine(tmp_path, ProviderRegistry([new_provider()]), catalog=catalog).execute(dates)
+    assert engine.context.result == expected.context.result
+    assert engine.context.query_stats['resolved']
+
+    # Both runs recorded the queries answering their facts
+    answers = Counter()
+    for (fact, position), cells in engine.context.answers.items():
+        answers[(fact, position)] += 2 * cells
+    fallbacks = {fallback.fact: fallback for fallback in catalog.fallbacks()}
+    for fact, fallback in fallbacks.items():
+        assert fallback.answers == {position: cells for (other, position), cells in answers.items() if other == fact}
+        assert fallback.fallbacks and 0 < fallback.rate <= 1
+    assert set(fallbacks) == {'total_liabilities', 'long_term_debt', 'retained_earnings'}
+
+
+def test_service(tmp_path):
+    logic_path = tmp_path / 'engine.xml'
+    shutil.copy(LOGIC_PATH, logic_path)
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    service = Service(logic_path=str(logic_path), providers=ProviderRegistry([new_provider()]), fact_store=store)
+    dates = {'quarterly': [Date(2020, 3), Date(2020, 4)]}
+    expected = service.query(['AAA'], dates)
+    assert expected.catalog is service.catalog is not None
+    assert expected.context.query_stats['resolved'] == 0
+    assert {fallback.fact for fallback in service.catalog.fallbacks()} == {
+        'total_liabilities', 'long_term_debt', 'retained_earnings'}
+
+    # Built without resolving the queries: they are resolved once the logic changes
+    service.catalog.build()
+    assert service.query(['AAA'], dates).context.query_stats['resolved'] == 0
+    os.utime(logic_path, ns=(os.stat(logic_path).st_atime_ns, os.stat(logic_path).st_mtime_ns + 1))
+    assert service.query(['AAA'], dates).context.result == expected.context.result
+    assert service.catalog.resolutions('1', [expected.context.result[key].accession
+                                             for key in expected.context.result])
+    # Reports built since are answered from the resolutions
+    service.reports.clear()
+    engine = service.query(['AAA'], dates)
+    assert engine.context.result == expected.context.result
+    assert engine.context.query_stats['resolved']
+    assert service.catalog.sync(engine.logic) == 0
+
+    # In-memory stores have no catalog
+    assert Catalog.of(FactStore(':memory:'), engine.logic) is None
@@ -0,0 +1,121 @@
+import pytest
+from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from thingy.collections import FallThruDict, Report
+from thingy.edgar.financials import FinancialElement, FinancialInfo
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_fall_thru_dict(months=3, period='quarterly'):
+    return FallThruDict(FinancialInfo(datetime(2020, 6, 30), months, {
+        'us-gaap_Assets': FinancialElement(['Total assets'], [60.0], [60.0]),
+        'us-gaap_Cash': FinancialElement(['Cash', 'Cash and cash equivalents'], [0.0], [0.0]),
+        'us-gaap_CashAndShortTermInvestments': FinancialElement(['Cash'], [12.0], [12.0]),
+        'us-gaap_Liabilities': FinancialElement(['Total liabilities', 'Total Liabilities'], [15.0, 15.0], [15.0, 15.0]),
+    }), period)
+
+
+def test_get_by_key():
+    assert new_fall_thru_dict()['us-gaap_Assets'] == 60.0
+
+
+def test_get_by_label_ignores_case():
+    assert new_fall_thru_dict()['TOTAL ASSETS'] == 60.0
+
+
+def test_values_are_summed():
+    assert new_fall_thru_dict()['us-gaap_Liabilities'] == 30.0
+
+
+def test_quarterly_scaling():
+    assert new_fall_thru_dict(months=6)['us-gaap_Assets'] == 30.0
+    assert new_fall_thru_dict(months=6, period='annual')['us-gaap_Assets'] == 60.0
+
+
+def test_non_zero_first():
+    fall_thru_dict = new_fall_thru_dict()
+    # the key match is zero, so the first non-zero label match wins
+    assert fall_thru_dict[['us-gaap_Cash', 'Cash']] == 12.0
+    # only zero values available
+    assert fall_thru_dict['Cash and cash equivalents'] == 0.0
+
+
+def test_contains():
+    fall_thru_dict = new_fall_thru_dict()
+    assert 'us-gaap_Assets' in fall_thru_dict
+    assert 'total assets' in fall_thru_dict
+    assert ['nope', 'Total Liabilities'] in fall_thru_dict
+    assert 'nope' not in fall_thru_dict
+
+
+def test_get_default():
+    fall_thru_dict = new_fall_thru_dict()
+    assert fall_thru_dict.get('nope', default=-1) == -1
+    assert fall_thru_dict.get_all('us-gaap_Assets', 'nope', 'Total liabilities') == [60.0, 30.0]
+
+
+def test_missing_key():
+    with pytest.raises(KeyError):
+        new_fall_thru_dict()['nope']
+
+
+def test_search():
+    fall_thru_dict = new_fall_thru_dict()
+    # labels first, then keys, each in report order and only once
+    assert fall_thru_dict.search('.*liabilities', 'total') == [60.0, 30.0, 30.0]
+    assert fall_thru_dict.search('us-gaap_cash') == [0.0, 12.0]
+    # every pattern is applied to labels, not just the first one
+    assert fall_thru_dict.search('nope', 'total assets') == [60.0]
+    assert fall_thru_dict.search('nope') == []
+    # numbered backreferences keep referring to their own pattern's groups
+    assert fall_thru_dict.search('(nope)', r'total (l)iabi\1ities') == [30.0]
+    assert fall_thru_dict.search('(?i)total assets', 'nope') == [60.0]
+
+
+def test_resolved_search():
+    fall_thru_dict = new_fall_thru_dict()
+    # the same values as search(), in the same order, whatever the order of the labels and keys given
+    assert fall_thru_dict.resolved_search(('total liabilities', 'nope', 'total assets'),
+                                          ('us-gaap_Cash', 'us-gaap_Assets')) == \
+        fall_thru_dict.search('total (assets|liabilities)', 'us-gaap_(assets|cash)$') == [60.0, 30.0, 60.0, 0.0]
+    assert fall_thru_dict.resolved_search(('cash and cash equivalents', 'cash'), ()) == \
+        fall_thru_dict.search('cash') == [12.0, 0.0]
+    assert fall_thru_dict.resolved_search((), ('nope',)) == []
+
+
+def test_report_query_memoization():
+    fall_thru_dict = new_fall_thru_dict()
+    report = Report(balance_sheet=fall_thru_dict, cash_flow=fall_thru_dict, income_statements=fall_thru_dict)
+    stats = Counter()
+
+    assert report.query('balance_sheet', 'select', ('us-gaap_Assets', 'nope'), stats) == [60.0]
+    assert report.query('balance_sheet', 'select', ('us-gaap_Assets', 'nope'), stats) == [60.0]
+    assert report.query('cash_flow', 'regexp', ('total assets',), stats) == [60.0]
+    assert stats == Counter(hits=1, misses=2)
+    assert report.stats == stats
+
+    with pytest.raises(ValueError):
+        report.query('queries', 'select', ('us-gaap_Assets',))
+    with pytest.raises(ValueError):
+        report.query('balance_sheet', 'fuzzy', ('us-gaap_Assets',))
+
+    report.resolved[('income_statements', ('.*assets',))] = (('total assets',), ())
+    assert report.query('income_statements', 'regexp', ('.*assets',)) == [60.0]
+    assert report.stats['resolved'] == 1
+
+
+def test_report_query_is_thread_safe():
+    fall_thru_dict = new_fall_thru_dict()
+    report = Report(balance_sheet=fall_thru_dict, cash_flow=fall_thru_dict, income_statements=fall_thru_dict)
+
+    def query(i):
+        return report.query('balance_sheet', 'regexp', (f'total {"assets" if i % 2 else "liabilities"}',))
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(query, range(2000)))
+    assert results == [[30.0], [60.0]] * 1000
+    assert report.stats == Counter(hits=1998, misses=2)
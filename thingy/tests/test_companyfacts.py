@@ -0,0 +1,180 @@
+import io
+import os
+import json
+import zipfile
+import datetime
+import pytest
+from benchmarks.synthetic import BALANCE_SHEET_CONCEPTS, CASH_FLOW_CONCEPTS, INCOME_STATEMENT_CONCEPTS
+from thingy import snapshot
+from thingy.collections import Date, Report
+from thingy.edgar import companyfacts
+from thingy.edgar.stock import NoFilingInfoException
+from thingy.edgar.store import FactStore
+from thingy.negative_cache import NO_FILING, PROVIDER_ERROR
+from thingy.providers import COMPANYFACTS_SEC, CompanyFactsProvider, Provider, ProviderRegistry
+from thingy.state import ResultKey
+from thingy.tests.doubles import new_engine
+
+ACCESSION = '0000000001-20-000001'
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_fact(start, end, value, form='10-Q', accession=ACCESSION, filed='2020-08-05'):
+    fact = {'end': end, 'val': value, 'accn': accession, 'fy': 2020, 'fp': 'Q2', 'form': form, 'filed': filed}
+    if start is not None:
+        fact['start'] = start
+    return fact
+
+
+def new_document():
+    taxonomy = dict()
+    for concepts, start in ((BALANCE_SHEET_CONCEPTS, None),
+                            (INCOME_STATEMENT_CONCEPTS + CASH_FLOW_CONCEPTS, '2020-04-01')):
+        for index, (concept, label) in enumerate(concepts, start=1):
+            taxonomy[concept.split('_')[1]] = {'label': label, 'description': 'The ' + label, 'units': {'USD': [
+                new_fact(start, '2020-06-30', index * 100),
+                new_fact(start and '2019-04-01', '2019-06-30', index * 10),
+                new_fact(start, '2020-06-30', -1, form='8-K', accession='0000000001-20-000002'),
+            ]}}
+    taxonomy['Revenues']['units']['USD'].append(new_fact('2020-01-01', '2020-06-30', 12345))
+    return {'cik': 1, 'entityName': 'SYNTHETIC CORP', 'facts': {
+        'dei': {'EntityPublicFloat': {'label': 'Entity Public Float', 'units': {'USD': [
+            new_fact(None, '2019-12-31', 1e9, form='10-K')]}}},
+        'us-gaap': taxonomy}}
+
+
+class FailingProvider(Provider):
+    name = 'failing'
+
+    def covers(self, symbol):
+        return True
+
+    def get_stock(self, symbol):
+        return None
+
+    def resolve(self, symbol, period, date):
+        raise LookupError(symbol)
+
+
+class NoFilingProvider(FailingProvider):
+    name = 'no_filing'
+
+    def resolve(self, symbol, period, date):
+        raise NoFilingInfoException('No filing info found.')
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'companyfacts'
+    path.mkdir()
+    (path / 'CIK0000000001.json').write_text(json.dumps(new_document(), indent=1))
+    return str(path)
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 4096])
+def test_scanner(read_size):
+    document = {'a': [1, 2.5e-3, {'b': None}], 'c': {}, 'd': {'e': 'f\\"g', 'h': 1234567890}, 'i': True}
+    scanner = companyfacts.Scanner(io.StringIO(json.dumps(document, indent=2)), read_size)
+    decoded = dict()
+    for key in scanner.members():
+        if key == 'd':
+            decoded[key] = {inner: scanner.value() for inner in scanner.members()}
+        else:
+            decoded[key] = scanner.value()
+    assert decoded == document
+
+
+def test_get_facts(source):
+    with companyfacts.open_company_facts('1', source) as f:
+        facts = list(companyfacts.get_facts('1', f, read_size=64))
+    assert len(facts) == 2 * 16 + 1  # two columns of 16 concepts and six months of revenues, no cover page facts
+    assert ('1', '', 'us-gaap_Revenues', datetime.date(2020, 6, 30), 6, 12345.0, ['Total revenues'],
+            ACCESSION, datetime.date(2020, 8, 5)) in facts
+    assert ('1', '', 'us-gaap_Assets', datetime.date(2020, 6, 30), None, 300.0, ['Total assets'],
+            ACCESSION, datetime.date(2020, 8, 5)) in facts
+
+    assert companyfacts.get_months(datetime.date(2019, 7, 1), datetime.date(2020, 6, 30)) == 12
+    assert companyfacts.get_months(datetime.date(2020, 1, 1), datetime.date(2020, 9, 30)) == 9
+
+
+def test_cover_page_facts_are_skipped(tmp_path):
+    # A quarter ending in May, with the shares outstanding as of the cover, later in the same window
+    document = {'cik': 3, 'entityName': 'MAY CORP', 'facts': {
+        'dei': {'EntityCommonStockSharesOutstanding': {'label': 'Entity Common Stock, Shares Outstanding',
+                                                       'units': {'shares': [new_fact(None, '2020-06-25', 1e6)]}}},
+        'us-gaap': {'Assets': {'label': 'Total assets', 'units': {'USD': [new_fact(None, '2020-05-31', 500)]}},
+                    'Revenues': {'label': 'Total revenues', 'units': {'USD': [
+                        new_fact('2020-03-01', '2020-05-31', 50)]}}}}}
+    path = tmp_path / 'companyfacts'
+    path.mkdir()
+    (path / 'CIK0000000003.json').write_text(json.dumps(document))
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    CompanyFactsProvider(str(path), index={'MAY': '3'}).load_facts('MAY', store)
+
+    report = Report.from_store(store, '3', 'quarterly', Date(2020, 3))
+    assert report.balance_sheet.get('us-gaap_Assets') == 500
+    assert report.balance_sheet.get('dei_EntityCommonStockSharesOutstanding') is None
+
+
+def test_zip_source(source, tmp_path):
+    path = str(tmp_path / 'companyfacts.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.write(os.path.join(source, 'CIK0000000001.json'), 'CIK0000000001.json')
+    provider = CompanyFactsProvider(path, index={'SYN': '1', 'OTH': '2'})
+    assert provider.covers('SYN')
+    assert not provider.covers('OTH') and not provider.covers('NONE')
+
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    provider.load_facts('SYN', store)
+    report = Report.from_store(store, '1', 'quarterly', Date(2020, 3))
+    assert report.accession == ACCESSION
+    assert report.balance_sheet.get('us-gaap_Assets') == 300
+    assert report.income_statements.get('Total revenues') == 100
+
+    with pytest.raises(companyfacts.CompanyFactsException):
+        companyfacts.open_company_facts('2', path)
+
+
+def test_engine(source, tmp_path):
+    provider = CompanyFactsProvider(source, index={'SYN': '1'})
+    engine = new_engine(tmp_path, ProviderRegistry([provider, FailingProvider()]), ['SYN']).execute(
+        {'quarterly': [Date(2019, 3), Date(2020, 3)]})
+
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2020, 3)].accession == ACCESSION
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2019, 3)].accession == ACCESSION
+    assert provider.stats.calls['load'] == 1  # one document read for every date
+
+
+def test_registered_ahead_of_edgar(source, tmp_path):
+    symbols_path = tmp_path / 'symbols.csv'
+    symbols_path.write_text('symbol,cik\nSYN,1\n')
+    current = snapshot.build(snapshot.LOGIC_PATH, str(symbols_path))
+    assert current.providers().scope == 'edgar,market_watch'
+    registry = current.providers(source)
+    assert registry.scope == 'companyfacts,edgar,market_watch'
+    provider = registry.route('SYN')[0]
+    assert isinstance(provider, CompanyFactsProvider) and provider.source == source
+    assert provider.stock('SYN') is None  # facts only
+    assert ProviderRegistry.default(COMPANYFACTS_SEC, index={'SYN': '1'}).providers[0].source is None
+
+    engine = new_engine(tmp_path, registry, ['SYN'], logic=current.logic, machine=current.machine).execute(
+        {'quarterly': [Date(2020, 3)]})
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2020, 3)].provider == 'companyfacts'
+
+
+@pytest.mark.parametrize('fallback, reason', [(NoFilingProvider, NO_FILING), (FailingProvider, PROVIDER_ERROR)])
+def test_engine_skips_missing_cells(source, tmp_path, fallback, reason):
+    provider = CompanyFactsProvider(source, index={'SYN': '1'})
+    engine = new_engine(tmp_path, ProviderRegistry([provider, fallback()]), ['SYN']).execute(
+        {'quarterly': [Date(2015, 3)]})
+
+    # Neither provider has the quarter: a miss, only remembered when the
+    # other provider found nothing either
+    missing = ResultKey('quarterly', 'SYN', 2015, 3)
+    assert missing not in engine.context.result
+    assert engine.context.skipped[missing].reason == reason
+    remembered = engine.misses.get('SYN', 'quarterly', Date(2015, 3), engine.providers.scope)
+    assert (remembered is not None) == (reason == NO_FILING)
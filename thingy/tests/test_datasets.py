@@ -0,0 +1,86 @@
+import zipfile
+import pytest
+from thingy.collections import Date, Report
+from thingy.edgar.datasets import DatasetException, get_concept, ingest, open_dataset
+from thingy.edgar.store import FactStore
+
+SUB = [
+    ('adsh', 'cik', 'name', 'sic', 'fye', 'form', 'period', 'filed'),
+    ('0000000001-20-000001', '1', 'SYNTHETIC INC', '1311', '1231', '10-Q', '20200630', '20200805'),
+    ('0000000001-20-000002', '1', 'SYNTHETIC INC', '1311', '1231', '8-K', '20200630', '20200806'),
+    ('0000000002-20-000001', '2', 'OTHER CORP', '2911', '1231', '10-Q', '20200630', '20200810'),
+    ('0000000003-20-000001', '3', 'MAY CORP', '2911', '0228', '10-Q', '20200531', '20200710'),
+]
+TAG = [
+    ('tag', 'version', 'custom', 'abstract', 'datatype', 'iord', 'crdr', 'tlabel', 'doc'),
+    ('Assets', 'us-gaap/2020', '0', '0', 'monetary', 'I', 'D', 'Assets', 'Sum of the carrying amounts'),
+    ('Revenues', 'us-gaap/2020', '0', '0', 'monetary', 'D', 'C', 'Revenues', 'Amount of revenue'),
+]
+NUM = [
+    ('adsh', 'tag', 'version', 'coreg', 'ddate', 'qtrs', 'uom', 'value', 'footnote'),
+    ('0000000001-20-000001', 'Assets', 'us-gaap/2020', '', '20200630', '0', 'USD', '2000', ''),
+    ('0000000001-20-000001', 'Assets', 'us-gaap/2020', '', '20191231', '0', 'USD', '1500', ''),
+    ('0000000001-20-000001', 'Assets', 'us-gaap/2020', 'SUBSIDIARY', '20200630', '0', 'USD', '900', ''),
+    ('0000000001-20-000001', 'Revenues', 'us-gaap/2020', '', '20200630', '1', 'USD', '300', ''),
+    ('0000000001-20-000001', 'Revenues', 'us-gaap/2020', '', '20200630', '2', 'USD', '550', ''),
+    ('0000000001-20-000001', 'Widgets', '0000000001-20-000001', '', '20200630', '1', 'USD', '7', ''),
+    ('0000000001-20-000001', 'Revenues', 'us-gaap/2020', '', '20200630', '1', 'USD', '', ''),
+    ('0000000001-20-000002', 'Assets', 'us-gaap/2020', '', '20200630', '0', 'USD', '1', ''),
+    ('0000000002-20-000001', 'Assets', 'us-gaap/2020', '', '20200630', '0', 'USD', '9000', ''),
+    ('0000000002-20-000001', 'Revenues', 'us-gaap/2020', '', '20200630', '1', 'USD', '800', ''),
+    # A quarter ending in May, with the shares outstanding as of the cover, later in the window
+    ('0000000003-20-000001', 'Assets', 'us-gaap/2020', '', '20200531', '0', 'USD', '500', ''),
+    ('0000000003-20-000001', 'Revenues', 'us-gaap/2020', '', '20200531', '1', 'USD', '50', ''),
+    ('0000000003-20-000001', 'EntityCommonStockSharesOutstanding', 'dei/2019', '', '20200625', '0', 'shares',
+     '1000000', ''),
+]
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def write_dataset(path, **tables):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as dataset:
+        for name, rows in tables.items():
+            dataset.writestr(f'{name}.txt', ''.join('\t'.join(row) + '\n' for row in rows))
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = write_dataset(tmp_path / '2020q3.zip', sub=SUB, tag=TAG, num=NUM)
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    with open_dataset(path) as dataset:
+        assert ingest(dataset, store, chunk_size=2) == 9
+    return store
+
+
+def test_get_concept():
+    assert get_concept('Assets', 'us-gaap/2020') == 'us-gaap_Assets'
+    assert get_concept('Widgets', '0000000001-20-000001') == 'custom_Widgets'
+
+
+def test_ingest(store):
+    assert store.get_company('1') == {'cik': '1', 'name': 'SYNTHETIC INC', 'sic': '1311', 'fiscal_year_end': '1231'}
+
+    report = Report.from_store(store, '1', 'quarterly', Date(2020, 3))
+    assert report.accession == '0000000001-20-000001'
+    assert report.balance_sheet.get('us-gaap_Assets') == 2000
+    assert report.balance_sheet.get('Assets') == 2000  # by label
+    assert report.income_statements.get('us-gaap_Revenues') == 300
+    assert report.cash_flow.get('custom_Widgets') == 7
+
+    other = Report.from_store(store, '2', 'quarterly', Date(2020, 3))
+    assert other.balance_sheet.get('us-gaap_Assets') == 9000
+
+    # Cover page values are not taken for the balance sheet
+    may = Report.from_store(store, '3', 'quarterly', Date(2020, 3))
+    assert may.balance_sheet.get('us-gaap_Assets') == 500
+    assert may.balance_sheet.get('dei_EntityCommonStockSharesOutstanding') is None
+
+
+def test_missing_table(tmp_path):
+    path = write_dataset(tmp_path / 'broken.zip', sub=SUB)
+    with open_dataset(path) as dataset, pytest.raises(DatasetException):
+        ingest(dataset, FactStore(str(tmp_path / 'facts.sqlite')))
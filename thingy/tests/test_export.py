@@ -0,0 +1,57 @@
+import csv
+import json
+import pytest
+from thingy.export import export
+from thingy.metric_handlers import Ratio
+from thingy.state import State, ResultKey
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_state():
+    state = State()
+    for quarter in (1, 2, 3):
+        result = state.result[ResultKey('quarterly', 'AAA', 2020, quarter)]
+        result.accession = f'A-{quarter}'
+        result.provider = 'edgar'
+        result.facts['assets'] = 100.0 * quarter
+        result.ratios['current'] = Ratio.Metric(a=10.0, b=4.0, ratio=2.5)
+    return state
+
+
+def test_export_csv(tmp_path):
+    target = export(new_state(), str(tmp_path / 'results.csv'), chunk_size=2)
+    with open(target, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 6
+    assert rows[0] == {'period': 'quarterly', 'symbol': 'AAA', 'year': '2020', 'quarter': '1', 'kind': 'fact',
+                       'id': 'assets', 'value': '100.0', 'a': '', 'b': '', 'accession': 'A-1',
+                       'provider': 'edgar'}
+    assert (rows[1]['kind'], rows[1]['a'], rows[1]['b']) == ('ratio', '10.0', '4.0')
+
+
+def test_export_jsonl(tmp_path):
+    target = export(new_state(), str(tmp_path / 'results'), format='jsonl')
+    assert target.endswith('.jsonl')
+    with open(target) as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[-1]['value'] == 2.5 and rows[-1]['accession'] == 'A-3'
+
+
+def test_export_format_mismatch(tmp_path):
+    with pytest.raises(ValueError):
+        export(new_state(), str(tmp_path / 'results.csv'), format='jsonl')
+    assert not (tmp_path / 'results.csv').exists()
+    assert export(new_state(), str(tmp_path / 'results.csv'), format='csv').endswith('results.csv')
+
+
+@pytest.mark.parametrize('format', ['parquet', 'feather'])
+def test_export_arrow(tmp_path, format):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.feather
+    target = export(new_state(), str(tmp_path / 'results'), format=format, chunk_size=4)
+    table = pyarrow.feather.read_table(target) if format == 'feather' else pyarrow.parquet.read_table(target)
+    assert table.num_rows == 6
+    assert table.column('value').to_pylist()[:2] == [100.0, 2.5]
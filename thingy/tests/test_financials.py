@@ -0,0 +1,60 @@
+import json
+import pickle
+import pytest
+from datetime import datetime
+from thingy.collections import FallThruDict
+from thingy.edgar.financials import FinancialElement, FinancialInfo, FinancialReportEncoder
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_financial_info():
+    # As built while parsing a statement
+    return FinancialInfo(datetime(2020, 6, 30), 6, {
+        'us-gaap_Revenues': FinancialElement.Builder(['Revenues'], [120.0]),
+        'us-gaap_Adjustments': FinancialElement.Builder(['Adjustment', 'Adjustment'], [3.0, -1.0]),
+        'us-gaap_Empty': FinancialElement.Builder([], []),
+    })
+
+
+def test_build():
+    info = new_financial_info()
+    assert list(info.values) == [120.0, 3.0, -1.0]
+    assert list(info.map) == ['us-gaap_Revenues', 'us-gaap_Adjustments', 'us-gaap_Empty']
+    adjustments = info.map['us-gaap_Adjustments']
+    assert adjustments.labels == ('Adjustment', 'Adjustment')
+    assert adjustments.values == adjustments.values_raw == [3.0, -1.0]
+    assert info.map['us-gaap_Empty'].values == []
+
+    # Elements given directly are copied into the shared array too
+    element = FinancialElement(['Assets'], [1.0, 2.0])
+    assert element.values == [1.0, 2.0]
+    assert FinancialInfo(datetime(2020, 6, 30), None, {'us-gaap_Assets': element}).map['us-gaap_Assets'].values == \
+        [1.0, 2.0]
+
+
+def test_map_is_read_only():
+    info = new_financial_info()
+    with pytest.raises(TypeError):
+        info.map['us-gaap_Assets'] = FinancialElement(['Assets'], [1.0])
+    assert 'us-gaap_Assets' not in info.map
+
+
+def test_value_sums():
+    fall_thru_dict = FallThruDict(new_financial_info(), 'quarterly')
+    # Six months scaled down to a quarter
+    assert fall_thru_dict['us-gaap_Revenues'] == 60.0
+    assert fall_thru_dict['adjustment'] == 1.0
+    assert fall_thru_dict['us-gaap_Empty'] == 0.0
+    assert FallThruDict(new_financial_info(), 'annual')['us-gaap_Adjustments'] == 2.0
+
+
+def test_pickle():
+    info = new_financial_info()
+    copy = pickle.loads(pickle.dumps(info))
+    assert (copy.date, copy.months) == (info.date, info.months)
+    assert json.dumps(copy, cls=FinancialReportEncoder) == json.dumps(info, cls=FinancialReportEncoder)
+    # Elements still share the array of their FinancialInfo
+    assert all(element._values is copy.values for element in copy.map.values())
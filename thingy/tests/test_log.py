@@ -0,0 +1,67 @@
+import io
+import logging
+from thingy.log import RateLimitFilter, StructuredFormatter
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def make_logger(name: str, rate_limit: RateLimitFilter = None) -> tuple[logging.Logger, io.StringIO]:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(StructuredFormatter('%(levelname)s %(message)s'))
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.filters = [rate_limit] if rate_limit is not None else []
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger, stream
+
+
+def test_structured_fields():
+    logger, stream = make_logger('thingy.tests.structured')
+    logger.info('Parsed %d rows', 3, extra={'symbol': 'XOM', 'accession': '0001-20-000001', 'stage': 'parse'})
+    logger.info('Plain')
+    assert stream.getvalue().splitlines() == [
+        'INFO Parsed 3 rows symbol=XOM accession=0001-20-000001 stage=parse',
+        'INFO Plain',
+    ]
+
+
+def test_rate_limit():
+    logger, stream = make_logger('thingy.tests.rate_limit', RateLimitFilter(rate=1e-9, burst=2))
+    for i in range(5):
+        logger.warning('Cell %d is not numeric', i)
+    logger.info('Another message')
+    logger.error('Errors are never dropped')
+    logger.error('Errors are never dropped')
+    assert stream.getvalue().splitlines() == [
+        'WARNING Cell 0 is not numeric',
+        'WARNING Cell 1 is not numeric',
+        'INFO Another message',
+        'ERROR Errors are never dropped',
+        'ERROR Errors are never dropped',
+    ]
+
+
+def test_rate_limit_reports_suppressed(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('thingy.log.time.monotonic', lambda: now[0])
+    logger, stream = make_logger('thingy.tests.suppressed', RateLimitFilter(rate=1, burst=1))
+    for _ in range(4):
+        logger.info('Noisy')
+    now[0] += 1
+    logger.info('Noisy')
+    assert stream.getvalue().splitlines() == ['INFO Noisy', 'INFO Noisy suppressed=3']
+
+
+def test_disabled_is_not_formatted():
+    class Explosive:
+        def __str__(self):
+            raise AssertionError('formatted')
+
+    logger, stream = make_logger('thingy.tests.disabled', RateLimitFilter())
+    logger.setLevel(logging.INFO)
+    logger.debug('Never formatted: %s', Explosive())
+    assert stream.getvalue() == ''
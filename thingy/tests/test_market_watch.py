@@ -0,0 +1,88 @@
+import math
+import datetime
+import pytest
+from thingy.edgar.requests_wrapper import RequestException
+from thingy.market_watch import Filing, Page, Stock, PAGE_CACHE, UnknownSymbolException
+
+# Two tables of a quarterly financials page, trimmed; the second has its quarters in another order
+PAGE_HTML = '''
+<html><body>
+<div class="region region--primary">
+  <table class="table table--overflow">
+    <thead><tr>
+      <th>Item</th><th>2019</th><th>30-Jun-2020</th><th>31-Mar-2020</th><th>5-quarter trend</th>
+    </tr></thead>
+    <tbody>
+      <tr><td><div class="fixed--cell">Sales/Revenue</div>Sales/Revenue</td>
+          <td>1</td><td>1.5B</td><td>(20.3M)</td><td></td></tr>
+      <tr><td><div class="fixed--cell">Auditor</div>Auditor</td><td>X</td><td>B</td><td>A</td><td></td></tr>
+    </tbody>
+  </table>
+  <table class="table">
+    <tr><th>Item</th><th>31-Mar-2020</th><th>30-Jun-2020</th></tr>
+    <tr><td>Net Income</td><td>-</td><td>1,234</td></tr>
+  </table>
+</div>
+<table class="table"><tr><th>Item</th><th>30-Sep-2020</th></tr><tr><td>Elsewhere</td><td>1</td></tr></table>
+</body></html>
+'''
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+    fetched = datetime.datetime.now()
+    dates = [datetime.date(2019, 12, 31), datetime.date(2020, 3, 31), datetime.date(2020, 6, 30),
+             datetime.date(2020, 9, 30), datetime.date(2020, 12, 31)]
+    PAGE_CACHE[('TEST', 'balance-sheet')] = Page(['Total Assets'], dates, [[1.0, 2.0, 3.0, 4.0, 5.0]], fetched)
+    for page in ('cash-flow', 'income'):
+        PAGE_CACHE[('TEST', page)] = Page(['Net Income', 'Auditor'], dates,
+                                          [[10.0, 20.0, 30.0, 40.0, 50.0], ['A', 'A', 'A', 'B', 'C']], fetched)
+
+
+def teardown_module(module):
+    PAGE_CACHE.clear()
+
+
+def get_filing(period, year, quarter):
+    stock = Stock('TEST')
+    return stock.load_filing(stock.get_filing_info(period, year, quarter))
+
+
+def test_quarterly_closest_column():
+    filing = get_filing('quarterly', 2020, 2)
+    assert filing.get_balance_sheets().reports[0].map['Total Assets'].values == [3.0]
+    # Missing quarters fall back to the closest one
+    filing = get_filing('quarterly', 2021, 4)
+    assert filing.get_income_statements().reports[0].map['Net Income'].values == [50.0]
+
+
+def test_annual_totals_quarters():
+    filing = get_filing('annual', 2020, 0)
+    balance_sheet = filing.get_balance_sheets().reports[0]
+    income_statement = filing.get_income_statements().reports[0]
+    assert (balance_sheet.months, balance_sheet.map['Total Assets'].values) == (None, [5.0])
+    assert (income_statement.months, income_statement.map['Net Income'].values) == (12, [140.0])
+    assert income_statement.map['Auditor'].values == ['C']
+
+
+def test_parse_cells():
+    values = Filing._parse_cells(['1.5B', '(20.3M)', '-', '1,234', '12.5%', ''])
+    assert values[:5] == [1.5e9, -20.3e6, 0.0, 1234.0, '12.5%']
+    assert math.isnan(values[5])
+    assert Filing._parse_cells([]) == []
+
+
+def test_response_to_page():
+    page = Filing('TEST', 2020, 2)._response_to_page(PAGE_HTML)
+    # Only quarter headers are dates, in chronological order
+    assert page.dates == [datetime.date(2020, 3, 31), datetime.date(2020, 6, 30)]
+    assert page.items == ['Sales/Revenue', 'Auditor', 'Net Income']
+    assert page.values == [[-20.3e6, 1.5e9], ['A', 'B'], [0.0, 1234.0]]
+
+
+def test_unknown_symbol(monkeypatch):
+    def not_found(filing, page, cache=True):
+        raise RequestException('404: Not Found', status_code=404)
+    monkeypatch.setattr(Filing, '_download', not_found)
+    with pytest.raises(UnknownSymbolException):
+        Stock('NOPE').get_filing('quarterly', 2020, 2).get_balance_sheets()
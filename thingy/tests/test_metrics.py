@@ -0,0 +1,53 @@
+import json
+from thingy.metrics import Metrics
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def test_disabled_metrics_collect_nothing():
+    metrics = Metrics()
+
+    @metrics.timed()
+    def work():
+        return 1
+
+    assert work() == 1
+    metrics.count('calls')
+    metrics.observe('cell', 'AAA', 0.2)
+    with metrics.timer('stage'):
+        pass
+    assert (metrics.timings, metrics.counters, metrics.histograms, metrics.trace) == ({}, {}, {}, [])
+
+
+def test_dump(tmp_path):
+    metrics = Metrics(enabled=True)
+
+    @metrics.timed('engine.work')
+    def work():
+        return 1
+
+    assert work() == 1
+    with metrics.timer('provider.fetch', symbol='AAA'):
+        pass
+    metrics.count('cache.hit')
+    metrics.count('cache.hit', 2)
+    metrics.observe('engine.cell', 'AAA', 0.02)
+    metrics.observe('engine.cell', 'AAA', 100)
+
+    metrics.dump(str(tmp_path / 'run'))
+    events = json.loads((tmp_path / 'run.trace.json').read_text())['traceEvents']
+    assert [(event['name'], event['cat'], event['ph']) for event in events] == [
+        ('engine.work', 'engine', 'X'), ('provider.fetch', 'provider', 'X')]
+    assert 'args' not in events[0]
+    assert events[1]['args'] == {'symbol': 'AAA'}
+    assert events[0]['ts'] <= events[1]['ts']
+    assert all(event['dur'] >= 0 and event['pid'] and event['tid'] for event in events)
+
+    summary = json.loads((tmp_path / 'run.metrics.json').read_text())
+    assert summary['timings']['engine.work']['count'] == 1
+    assert summary['counters'] == {'cache.hit': 3}
+    histogram = summary['histograms']['engine.cell']['AAA']
+    assert (histogram['count'], histogram['min'], histogram['max']) == (2, 0.02, 100)
+    assert (histogram['buckets']['<=0.05s'], histogram['buckets']['>60s']) == (1, 1)
@@ -0,0 +1,203 @@
+import os
+import datetime
+import pytest
+import mako.template
+from benchmarks.synthetic import BALANCE_SHEET_CONCEPTS, CASH_FLOW_CONCEPTS, INCOME_STATEMENT_CONCEPTS
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date
+from thingy.edgar.stock import NoFilingInfoException
+from thingy.market_watch import Page, PAGE_CACHE
+from thingy.negative_cache import NegativeCache, NO_FILING, PROVIDER_ERROR, UNKNOWN_SYMBOL, FINAL_TTL, expires
+from thingy.providers import MarketWatchProvider, NotCoveredError, ProviderRegistry
+from thingy.state import ResultKey
+from thingy.view import build_view
+from thingy.tests.doubles import SyntheticProvider, new_engine
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates', 'template.html.mako')
+SPEC = SubmissionSpec(documents=2)
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def timestamp(*args) -> float:
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp()
+
+
+class GappyProvider(SyntheticProvider):
+    '''No filing for the fourth quarters'''
+
+    def __init__(self):
+        super().__init__(generate_submission(SPEC), SPEC.accession)
+        self.resolved = 0
+
+    def resolve(self, symbol, period, date):
+        self.resolved += 1
+        if date.quarter == 4:
+            raise NoFilingInfoException('No filing info found.')
+        return super().resolve(symbol, period, date)
+
+
+class FlakyProvider(SyntheticProvider):
+    '''Fails with a server error until it is back up'''
+
+    def __init__(self):
+        super().__init__(generate_submission(SPEC), SPEC.accession)
+        self.up = False
+
+    def resolve(self, symbol, period, date):
+        if not self.up:
+            raise ConnectionError('503 Server Error: Service Unavailable')
+        return super().resolve(symbol, period, date)
+
+
+def test_expires():
+    # Filings answering 2020Q3 are filed from July to September 2020
+    now = timestamp(2020, 8, 1)
+    assert expires('quarterly', Date(2020, 3), now) == timestamp(2020, 8, 20)  # after the 10-Q deadline
+    now = timestamp(2020, 9, 1)
+    assert expires('quarterly', Date(2020, 3), now) == timestamp(2020, 10, 1)  # after the window
+    now = timestamp(2020, 10, 1)
+    assert expires('quarterly', Date(2020, 3), now) == now + FINAL_TTL
+    assert expires('annual', Date(2020, 0), now) == timestamp(2020, 11, 20)
+    assert expires('annual', Date(0, 0), timestamp(2020, 12, 1)) == timestamp(2021, 4, 16)
+    assert expires('', None, now) == timestamp(2020, 11, 20)
+
+
+def test_negative_cache(tmp_path):
+    cache = NegativeCache(str(tmp_path / 'facts.sqlite'))
+    now = timestamp(2020, 8, 1)
+    miss = cache.add('AAA', 'quarterly', Date(2020, 3), NO_FILING, 'nope', now=now)
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), now=now) == miss
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), now=miss.expires) is None
+    assert cache.get('AAA', 'annual', Date(2020, 3), now=now) is None
+
+    symbol_miss = cache.add_symbol('BBB', UNKNOWN_SYMBOL, 'nope', now=now)
+    assert cache.get('BBB', 'annual', Date(2019, 0), now=now) == symbol_miss
+
+    # Misses are kept per scope, the providers they were found with
+    scoped = cache.add('AAA', 'quarterly', Date(2020, 3), NO_FILING, 'nope', 'edgar', now=now)
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), 'edgar', now=now) == scoped
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), 'edgar,market_watch', now=now) is None
+
+    cache.discard('AAA', 'quarterly', Date(2020, 3))
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), now=now) is None
+    assert cache.get('AAA', 'quarterly', Date(2020, 3), 'edgar', now=now) is None
+    assert cache.clear() == 1
+
+
+def test_engine_skips_known_missing_cells(tmp_path):
+    dates = {'quarterly': [Date(2020, 3), Date(2020, 4)]}
+    provider = GappyProvider()
+    engine = new_engine(tmp_path, ProviderRegistry([provider])).execute(dates)
+    missing = ResultKey('quarterly', 'AAA', 2020, 4)
+    assert list(engine.context.skipped) == [missing]
+    assert engine.context.skipped[missing].reason == NO_FILING
+    assert provider.resolved == 2
+
+    # Known-missing cells cost nothing the next time around
+    provider = GappyProvider()
+    again = new_engine(tmp_path, ProviderRegistry([provider]),
+                       template_engine=mako.template.Template(filename=TEMPLATE_PATH)).execute(dates)
+    assert again.context.result == engine.context.result
+    assert list(again.context.skipped) == [missing]
+    assert provider.resolved == 1
+
+    # and are listed in the report
+    (skipped,) = build_view(again.context).skipped
+    assert (skipped.symbol, skipped.period, skipped.date, skipped.reason) == ('AAA', 'Quarterly', '2020Q4', 'no filing')
+    again.write(str(tmp_path / 'report.html'))
+    assert '<h1>Skipped</h1>' in (tmp_path / 'report.html').read_text()
+
+    # A filing found later (see thingy.watch) answers the cell and clears the miss
+    filing_info = SyntheticProvider.resolve(provider, 'AAA', 'quarterly', Date(2020, 4))
+    assert again.recompute('quarterly', 'AAA', Date(2020, 4), filing=(provider, filing_info)) is not None
+    assert not again.context.skipped
+    assert again.misses.get('AAA', 'quarterly', Date(2020, 4)) is None
+
+
+def test_other_providers_are_asked(tmp_path):
+    dates = {'quarterly': [Date(2020, 4)]}
+    missing = ResultKey('quarterly', 'AAA', 2020, 4)
+    engine = new_engine(tmp_path, ProviderRegistry([GappyProvider()])).execute(dates)
+    assert list(engine.context.skipped) == [missing]
+
+    # A fallback provider answers the fourth quarter
+    registry = ProviderRegistry([GappyProvider(), SyntheticProvider(generate_submission(SPEC), SPEC.accession)])
+    assert registry.scope == 'synthetic,synthetic'
+    again = new_engine(tmp_path, registry).execute(dates)
+    assert not again.context.skipped
+    assert missing in again.context.result
+
+
+def test_provider_errors_are_not_remembered(tmp_path):
+    dates = {'quarterly': [Date(2020, 4)]}
+    missing = ResultKey('quarterly', 'AAA', 2020, 4)
+    flaky = FlakyProvider()
+    registry = ProviderRegistry([GappyProvider(), flaky])
+    engine = new_engine(tmp_path, registry).execute(dates)
+    assert engine.context.skipped[missing].reason == PROVIDER_ERROR
+    assert engine.misses.get('AAA', 'quarterly', Date(2020, 4), registry.scope) is None
+
+    # Once the provider is back up, the cell is computed
+    flaky.up = True
+    again = new_engine(tmp_path, registry).execute(dates)
+    assert not again.context.skipped
+    assert missing in again.context.result
+
+
+def test_stored_cells_are_computed(tmp_path):
+    dates = {'quarterly': [Date(2020, 4)]}
+    missing = ResultKey('quarterly', 'AAA', 2020, 4)
+    provider = GappyProvider()
+    provider.cik = lambda symbol: '1'
+    engine = new_engine(tmp_path, ProviderRegistry([provider])).execute(dates)
+    assert list(engine.context.skipped) == [missing]
+
+    # A data set answering the fourth quarter is ingested since (see thingy.edgar.datasets)
+    period_end, filed = datetime.date(2020, 9, 30), datetime.date(2020, 11, 5)
+    engine.fact_store.add_facts(
+        ('1', '', concept, period_end, months, index * 100.0, [label], '0000000001-20-000004', filed)
+        for concepts, months in ((BALANCE_SHEET_CONCEPTS, None), (INCOME_STATEMENT_CONCEPTS + CASH_FLOW_CONCEPTS, 3))
+        for index, (concept, label) in enumerate(concepts, start=1))
+    provider = GappyProvider()
+    provider.cik = lambda symbol: '1'
+    again = new_engine(tmp_path, ProviderRegistry([provider])).execute(dates)
+    assert not again.context.skipped
+    assert again.context.result[missing].accession == '0000000001-20-000004'
+    assert provider.resolved == 0
+    assert again.misses.get('AAA', 'quarterly', Date(2020, 4), again.providers.scope) is None
+
+
+def test_engine_skips_unknown_symbols(tmp_path):
+    engine = new_engine(tmp_path, ProviderRegistry()).execute({'quarterly': [Date(2020, 3)], 'annual': [Date(2020, 0)]})
+    assert not engine.context.result
+    assert {miss.reason for miss in engine.context.skipped.values()} == {UNKNOWN_SYMBOL}
+    assert len(engine.context.skipped) == 2
+
+
+@pytest.fixture
+def unknown_to_market_watch():
+    # MarketWatch serves a search page, without financials, for symbols it does not know
+    for page in ('balance-sheet', 'cash-flow', 'income'):
+        PAGE_CACHE[('AAA', page)] = Page([], [], [], datetime.datetime.now())
+    yield
+    PAGE_CACHE.clear()
+
+
+def test_symbols_unknown_to_every_provider(tmp_path, unknown_to_market_watch):
+    dates = {'quarterly': [Date(2020, 3)], 'annual': [Date(2020, 0)]}
+    market_watch = MarketWatchProvider()
+    registry = ProviderRegistry([market_watch])
+    engine = new_engine(tmp_path, registry).execute(dates)
+    assert not engine.context.result
+    assert {miss.reason for miss in engine.context.skipped.values()} == {UNKNOWN_SYMBOL}
+    assert engine.misses.get('AAA', 'quarterly', Date(2019, 4), registry.scope).reason == UNKNOWN_SYMBOL
+    with pytest.raises(NotCoveredError):
+        registry.route('AAA')
+
+    # A provider knowing the symbol makes it a missing filing
+    registry = ProviderRegistry([GappyProvider(), MarketWatchProvider()])
+    engine = new_engine(tmp_path, registry).execute({'quarterly': [Date(2020, 4)]})
+    assert engine.context.skipped[ResultKey('quarterly', 'AAA', 2020, 4)].reason == NO_FILING
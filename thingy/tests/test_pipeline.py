@@ -0,0 +1,62 @@
+import pickle
+import pytest
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date, Report
+from thingy.edgar.filing import Filing, NoFinancialDataException, parse_submission
+from thingy.pipeline import Pipeline
+from thingy.providers import ProviderRegistry
+from thingy.tests.doubles import SyntheticProvider, new_engine
+
+SYMBOLS = ['AAA', 'BBB']
+SPEC = SubmissionSpec(documents=2)
+SUBMISSION = generate_submission(SPEC)
+URL = f'https://www.sec.gov/Archives/edgar/data/0/{SPEC.accession}.txt'
+DATES = {'quarterly': [Date(2020, 3), Date(2020, 4)]}
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_providers():
+    return ProviderRegistry([SyntheticProvider(SUBMISSION, SPEC.accession)])
+
+
+def test_parse_submission():
+    parsed = pickle.loads(pickle.dumps(parse_submission(URL, 'SYN', SUBMISSION)))
+    filing = Filing(URL, company='SYN', text=SUBMISSION)
+    assert (parsed.accession, parsed.date_filed) == (filing.accession, filing.date_filed)
+    assert repr(Report.new(parsed, 'quarterly')) == repr(Report.new(filing, 'quarterly'))
+
+    spec = SubmissionSpec(documents=0, statements={})
+    parsed = parse_submission(URL, 'SYN', generate_submission(spec))
+    with pytest.raises(NoFinancialDataException):
+        parsed.get_balance_sheets()
+
+
+@pytest.mark.parametrize('parsers', [0, 1])
+def test_pipeline(tmp_path, parsers):
+    expected = new_engine(tmp_path, new_providers(), SYMBOLS, store='serial').execute(DATES).context.result
+
+    engine = new_engine(tmp_path, new_providers(), SYMBOLS, store='pipeline')
+    pipeline = Pipeline(engine, downloaders=2, parsers=parsers, depth=2)
+    result = pipeline.execute(DATES).context.result
+    assert result == expected
+    assert list(result) == list(expected)  # computed in the same order
+
+    provider = next(iter(engine.providers))
+    # Every cell resolves to the same filing, downloaded and parsed once
+    assert provider.stats.calls['download'] == 1 and 'fetch' not in provider.stats.calls
+    assert pipeline.stats['download'].items == pipeline.stats['compute'].items == 4
+    assert pipeline.stats['parse'].items == 1
+    assert pipeline.queues['parse'].max_depth <= 2
+    assert engine.resolved == {}
+
+
+def test_pipeline_falls_back_to_the_engine(tmp_path):
+    engine = new_engine(tmp_path, new_providers(), SYMBOLS, store='pipeline')
+    provider = next(iter(engine.providers))
+    provider.download = lambda symbol, filing_info: None  # only fetches filings whole
+    expected = new_engine(tmp_path, new_providers(), SYMBOLS, store='serial').execute(DATES).context.result
+    assert Pipeline(engine, parsers=0).execute(DATES).context.result == expected
+    assert provider.stats.calls['fetch'] == 1
@@ -0,0 +1,77 @@
+import pytest
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date
+from thingy.edgar.stock import NoFilingInfoException
+from thingy.providers import Provider, ProviderRegistry, EdgarProvider, MarketWatchProvider, TokenBucket
+from thingy.state import ResultKey
+from thingy.tests.doubles import SyntheticProvider, new_engine
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_registry(tmp_path):
+    symbols = tmp_path / 'symbols.csv'
+    symbols.write_text('cik,symbol,year,quarter,filing_url\n1,AAA,2018/,QTR4/,\n2,AAA,2018/,QTR4/,\n')
+    return ProviderRegistry([EdgarProvider(symbols_path=str(symbols)), MarketWatchProvider()])
+
+
+def test_route_by_coverage(tmp_path):
+    registry = new_registry(tmp_path)
+    assert [provider.name for provider in registry.route('AAA')] == ['edgar', 'market_watch']
+    assert [provider.name for provider in registry.route('BBBBF')] == ['market_watch']
+    assert registry.providers[0].cik('AAA') == '1'
+
+    with pytest.raises(LookupError):
+        ProviderRegistry([EdgarProvider(symbols_path=str(tmp_path / 'symbols.csv'))]).route('BBBBF')
+
+
+class NoFilingProvider(Provider):
+    name = 'no_filing'
+
+    def covers(self, symbol):
+        return True
+
+    def get_stock(self, symbol):
+        return None
+
+    def resolve(self, symbol, period, date):
+        raise NoFilingInfoException('No filing info found.')
+
+
+def test_fallback_is_recorded(tmp_path):
+    spec = SubmissionSpec(documents=2)
+    registry = ProviderRegistry([NoFilingProvider(), SyntheticProvider(generate_submission(spec), spec.accession)])
+    engine = new_engine(tmp_path, registry)
+    result = engine.execute({'quarterly': [Date(2020, 3)]}).context.result[ResultKey('quarterly', 'AAA', 2020, 3)]
+    assert (result.provider, result.fallback) == ('synthetic', 'no_filing: No filing info found.')
+
+    registry = ProviderRegistry([SyntheticProvider(generate_submission(spec), spec.accession)])
+    engine = new_engine(tmp_path, registry, store='single')
+    result = engine.execute({'quarterly': [Date(2020, 3)]}).context.result[ResultKey('quarterly', 'AAA', 2020, 3)]
+    assert (result.provider, result.fallback) == ('synthetic', None)
+
+
+def test_providers_are_abstract():
+    with pytest.raises(TypeError):
+        Provider()
+
+
+def test_call_stats():
+    provider = NoFilingProvider()
+    assert provider.call('fetch', lambda value: value, 1) == 1
+    with pytest.raises(ZeroDivisionError):
+        provider.call('fetch', lambda: 1 / 0)
+    assert (provider.stats.calls['fetch'], provider.stats.errors['fetch']) == (2, 1)
+
+
+def test_token_bucket(monkeypatch):
+    sleeps = list()
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    bucket = TokenBucket(rate=1000, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert not sleeps
+    bucket.acquire()  # out of tokens, waits for the next one
+    assert sleeps
@@ -0,0 +1,192 @@
+import math
+import random
+import datetime
+import numpy
+import pandas
+import lxml.objectify
+import pytest
+from benchmarks.synthetic import BALANCE_SHEET_CONCEPTS, CASH_FLOW_CONCEPTS, INCOME_STATEMENT_CONCEPTS
+from thingy.collections import Date, Report
+from thingy.edgar.store import FactStore
+from thingy.screen import Screener, add_percentiles, screen, where
+from thingy.tests.doubles import LOGIC_PATH
+
+# cik -> sic, current assets, current liabilities, total assets, total liabilities
+COMPANIES = {
+    '1': ('1311', 200, 100, 1000, 400),
+    '2': ('1381', 100, 100, 1000, 900),
+    '3': ('1311', 300, 100, 2000, 500),
+    '4': ('2911', 50, 0, 500, 100),
+}
+CONCEPTS = ('us-gaap_AssetsCurrent', 'us-gaap_LiabilitiesCurrent', 'us-gaap_Assets', 'us-gaap_Liabilities')
+PERIOD_END = datetime.date(2020, 6, 30)
+FILED = datetime.date(2020, 8, 5)
+
+
+# Every mode and post of query, labels matching several concepts
+QUERIES_LOGIC = '''<root>
+<facts>
+    <fact id='cash'>
+        <query source='balance_sheet' mode='regexp'>
+            .*cash.*
+            us-gaap_.*Debt
+        </query>
+    </fact>
+    <fact id='debt'>
+        <query source='balance_sheet' mode='regexp' post='sum'>
+            .*debt.*
+            .*liabilities
+        </query>
+    </fact>
+    <fact id='liabilities'>
+        <query source='balance_sheet' mode='select'>
+            Total liabilities
+            us-gaap_Liabilities
+        </query>
+        <query source='balance_sheet' mode='regexp' post='static' value='-1'>
+            .*assets
+        </query>
+    </fact>
+    <fact id='income'>
+        <query source='income_statements' mode='select' post='sum'>
+            net income
+            us-gaap_Revenues
+            NOPE
+        </query>
+    </fact>
+    <fact id='operating_cash'>
+        <query source='cash_flow' mode='select'>
+            us-gaap_NetCashProvidedByUsedInOperatingActivities
+            Net income
+        </query>
+    </fact>
+</facts>
+<ratios>
+    <ratio id='margin'>
+        <compute source.a='income' source.b='operating_cash'/>
+        Income to operating cash
+    </ratio>
+</ratios>
+</root>'''
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+@pytest.fixture
+def screener(tmp_path, logic):
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    rows = list()
+    for cik, (sic, *values) in COMPANIES.items():
+        accession = f'{int(cik):010d}-20-000001'
+        rows.extend((cik, '', concept, PERIOD_END, None, value, [], accession, FILED)
+                    for concept, value in zip(CONCEPTS, values))
+        rows.append((cik, '', 'us-gaap_NetIncomeLoss', PERIOD_END, 3, 10.0, [], accession, FILED))
+        rows.append((cik, '', 'us-gaap_Revenues', PERIOD_END, 3, 100.0, [], accession, FILED))
+    store.add_facts(rows)
+    store.add_companies((cik, f'COMPANY {cik}', sic, '1231', FILED) for cik, (sic, *_) in COMPANIES.items())
+    # '5' has no facts at all
+    index = {'AAA': '1', 'AAB': '1', 'BBB': '2', 'CCC': '3', 'DDD': '4', 'EEE': '5'}
+    return Screener(logic, store, index, batch_size=2)
+
+
+def test_run(screener):
+    frame = screener.run('quarterly', Date(2020, 3)).set_index('cik')
+    assert list(frame.index) == ['1', '2', '3', '4', '5']
+    assert frame.loc['1', 'symbols'] == 'AAA AAB'
+    assert frame.loc['1', 'current_ratio'] == 2
+    assert frame.loc['1', 'total_equity'] == 600  # eval
+    assert frame.loc['1', 'debt_to_equity'] == pytest.approx(400 / 600)
+    assert math.isnan(frame.loc['4', 'current_ratio'])  # division by zero
+    assert frame.loc['5', 'accession'] is None and math.isnan(frame.loc['5', 'total_assets'])
+    assert screener.query_stats['misses']
+
+
+def test_non_calendar_fiscal_year(screener):
+    # A retailer whose fiscal year ends in January: its 2020Q3 filing is the
+    # one of the quarter ended in July, as in Report.from_store
+    rows = list()
+    for period_end, current_assets, accession in ((datetime.date(2020, 4, 30), 100, '0000000006-20-000001'),
+                                                  (datetime.date(2020, 7, 31), 300, '0000000006-20-000002')):
+        rows.extend(('6', '', concept, period_end, None, value, [], accession, FILED)
+                    for concept, value in zip(CONCEPTS, (current_assets, 100, 1000, 400)))
+        rows.append(('6', '', 'us-gaap_NetIncomeLoss', period_end, 3, 10.0, [], accession, FILED))
+    screener.store.add_facts(rows)
+    screener.store.add_companies([('6', 'RETAILER', '5311', '0131', FILED)])
+    screener.symbols['6'] = ['FFF']
+
+    frame = screener.run('quarterly', Date(2020, 3)).set_index('cik')
+    assert frame.loc['6', 'accession'] == '0000000006-20-000002'
+    assert frame.loc['6', 'current_ratio'] == 3
+    assert frame.loc['1', 'current_ratio'] == 2
+    assert Report.from_store(screener.store, '6', 'quarterly', Date(2020, 3)).accession == '0000000006-20-000002'
+
+
+def test_screen(screener):
+    frame = add_percentiles(screener.run('quarterly', Date(2020, 3)), ['current_ratio'])
+    percentiles = dict(zip(frame['cik'], frame['current_ratio_percentile']))
+    assert (percentiles['1'], percentiles['2'], percentiles['3']) == pytest.approx((200 / 3, 100 / 3, 100))
+
+    assert list(where(frame, ['current_ratio > 1.5'])['cik']) == ['1', '3']
+    with pytest.raises(ValueError):
+        where(frame, ['nope > 1'])
+
+    top = screen(screener, 'quarterly', Date(2020, 3), ['debt_ratio < 0.5'], sort='current_ratio', top=1)
+    assert list(top['cik']) == ['3']
+
+
+def random_datapoints(generator, cik):
+    '''Columns of a few periods, each with some concepts missing, zero or under another statement'''
+    accession = f'{int(cik):010d}-20-000001'
+    rows = list()
+    for period_end, months in ((PERIOD_END, None), (datetime.date(2020, 5, 31), None), (PERIOD_END, 3),
+                               (PERIOD_END, 6), (datetime.date(2020, 4, 30), 3), (PERIOD_END, 12)):
+        if generator.random() < 0.3:
+            continue
+        if months is None:
+            concepts, statements = BALANCE_SHEET_CONCEPTS + [('us-gaap_DebtCurrent', 'Short-term debt')], \
+                ('', 'balance_sheet')
+        else:
+            concepts, statements = INCOME_STATEMENT_CONCEPTS + CASH_FLOW_CONCEPTS, \
+                ('', 'income_statements', 'cash_flow')
+        for concept, label in concepts:
+            if generator.random() < 0.2:
+                continue
+            labels = generator.sample([label, label.upper(), 'Total liabilities', 'Cash', 'Net income'],
+                                      generator.randint(0, 3))
+            value = generator.choice([0.0, float(generator.randint(1, 1000))])
+            rows.append((cik, generator.choice(statements), concept, period_end, months, value, labels, accession,
+                         FILED))
+    return rows
+
+
+@pytest.mark.parametrize('logic_xml', [None, QUERIES_LOGIC], ids=['engine', 'queries'])
+def test_run_matches_reports(tmp_path, logic_xml):
+    if logic_xml is None:
+        with open(LOGIC_PATH) as f:
+            logic_xml = f.read()
+    logic = lxml.objectify.fromstring(logic_xml)
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    generator = random.Random(1)
+    ciks = [str(cik) for cik in range(1, 61)]
+    for cik in ciks:
+        store.add_facts(random_datapoints(generator, cik))
+    screener = Screener(logic, store, {f'S{cik}': cik for cik in ciks}, batch_size=7)
+
+    for period, date in (('quarterly', Date(2020, 3)), ('annual', Date(2020, 0))):
+        frame = screener.run(period, date).set_index('cik')
+        for cik in ciks:
+            # The facts of each company queried from its Report, as in Engine
+            report = Report.from_store(store, cik, period, date)
+            accession = frame.loc[cik, 'accession']
+            assert accession == report.accession if report is not None else pandas.isna(accession)
+            for fact in screener.facts:
+                if hasattr(fact.fact, 'eval'):
+                    continue
+                expected = numpy.nan
+                for query in (fact.fact.query if report is not None else ()):
+                    if (result := fact.execute_query(query, report)) is not None:
+                        expected = result
+                        break
+                assert frame.loc[cik, fact.id] == pytest.approx(expected, nan_ok=True), (period, cik, fact.id)
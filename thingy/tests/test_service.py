@@ -0,0 +1,89 @@
+import os
+import json
+import shutil
+import threading
+import urllib.request
+import urllib.error
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date
+from thingy.edgar.store import FactStore
+from thingy.providers import ProviderRegistry
+from thingy.service import Service, LOGIC_PATH, parse_date, serve
+from thingy.tests.doubles import SyntheticProvider
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+@pytest.fixture
+def server(tmp_path):
+    logic_path = tmp_path / 'engine.xml'
+    shutil.copy(LOGIC_PATH, logic_path)
+    spec = SubmissionSpec()
+    providers = ProviderRegistry([SyntheticProvider(generate_submission(spec), spec.accession)])
+    service = Service(logic_path=str(logic_path), providers=providers,
+                      fact_store=FactStore(str(tmp_path / 'facts.sqlite')))
+    server = serve(service, port=0, workers=2, backlog=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_parse_date():
+    assert parse_date('2020q3') == Date(2020, 3)
+    assert parse_date(2019) == Date(2019, 0)
+    with pytest.raises(ValueError):
+        parse_date('Q3')
+
+
+def test_query(server):
+    server, url = server
+    query = {'symbols': ['syn'], 'dates': {'quarterly': ['2020Q3']}}
+
+    status, body = request(f'{url}/query', query)
+    rows = json.loads(body)['rows']
+    assert status == 200
+    assert {row[1] for row in rows} == {'SYN'}
+    assert any(row[4] == 'ratio' for row in rows)
+
+    # Answered from the warm caches
+    request(f'{url}/query', query)
+    caches = json.loads(request(f'{url}/metrics')[1])['caches']
+    assert caches['reports']['hits'] >= 1
+    assert caches['filings']['misses'] == 1
+
+    status, body = request(f'{url}/query', dict(query, format='html'))
+    assert status == 200 and body.decode().rstrip().endswith('</html>')
+
+    assert request(f'{url}/query', {'symbols': 'SYN'})[0] == 400
+    assert request(f'{url}/nothing')[0] == 404
+
+    # More concurrent queries than workers and backlog share the cached reports
+    with ThreadPoolExecutor(8) as pool:
+        assert set(pool.map(lambda _: request(f'{url}/query', query)[0], range(16))) == {200}
+
+
+def test_logic_reload(server):
+    server, url = server
+    service = server.RequestHandlerClass.service
+    logic, machine = service.logic
+    assert service.logic[0] is logic
+
+    stat = os.stat(service.logic_path)
+    os.utime(service.logic_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert service.logic[0] is not logic
+    assert json.loads(request(f'{url}/metrics')[1])['service']['logic.reloads'] == 1
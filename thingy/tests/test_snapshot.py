@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+import subprocess
+from thingy import snapshot
+from thingy.engine import machine_config
+from thingy.providers import EdgarProvider
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def sources(tmp_path):
+    logic_path = tmp_path / 'engine.xml'
+    symbols_path = tmp_path / 'symbols.csv'
+    shutil.copy(snapshot.LOGIC_PATH, logic_path)
+    symbols_path.write_text('symbol,cik\nXOM,34088\nCVX,93410\nXOM,1\n')
+    return str(logic_path), str(symbols_path)
+
+
+def test_load_builds_and_reuses(tmp_path):
+    logic_path, symbols_path = sources(tmp_path)
+    path = str(tmp_path / 'snapshot.pickle')
+
+    built = snapshot.load(path, logic_path, symbols_path)
+    assert os.path.exists(path)
+    assert built.symbols == {'XOM': '34088', 'CVX': '93410'}
+    assert built.machine == machine_config(built.logic)
+
+    loaded = snapshot.load(path, logic_path, symbols_path)
+    assert loaded == built
+    edgar = next(iter(loaded.providers()))
+    assert isinstance(edgar, EdgarProvider)
+    assert edgar.cik('CVX') == '93410'
+
+
+def test_load_rebuilds_stale(tmp_path):
+    logic_path, symbols_path = sources(tmp_path)
+    path = str(tmp_path / 'snapshot.pickle')
+    snapshot.load(path, logic_path, symbols_path)
+
+    with open(symbols_path, 'a') as f:
+        f.write('SM,893538\n')
+    os.utime(symbols_path, ns=(0, 0))
+    assert snapshot.load(path, logic_path, symbols_path).symbols['SM'] == '893538'
+
+
+def test_load_ignores_corrupt(tmp_path):
+    logic_path, symbols_path = sources(tmp_path)
+    path = tmp_path / 'snapshot.pickle'
+    path.write_bytes(b'not a pickle')
+    assert snapshot.load(str(path), logic_path, symbols_path).symbols['XOM'] == '34088'
+
+
+def test_engine_import_is_lazy():
+    # Heavy dependencies are only imported once they are needed
+    root = os.path.join(os.path.dirname(__file__), '..', '..')
+    code = ('import sys, thingy.engine, thingy.service, thingy.snapshot; '
+            'print(" ".join(sorted({"pandas", "bs4", "mako.template", "pyarrow", "requests", "cachecontrol"} '
+            '& set(sys.modules))))')
+    loaded = subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                            capture_output=True, text=True).stdout.strip()
+    assert loaded == ''
@@ -0,0 +1,112 @@
+from datetime import datetime, date
+from thingy.collections import Date, Report
+from thingy.edgar.financials import FinancialElement, FinancialInfo
+from thingy.edgar.store import FactStore
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_financial_info(period_end, months, value):
+    return FinancialInfo(period_end, months, {
+        'us-gaap_Assets': FinancialElement(['Total assets'], [value], [value]),
+    })
+
+
+def new_store(tmp_path):
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    for statement, months in (('balance_sheet', None), ('cash_flow', 3), ('income_statements', 3)):
+        # a 10-Q with the prior year quarter as comparative column
+        for period_end, value in ((datetime(2020, 6, 30), 20.0), (datetime(2019, 6, 30), 10.0)):
+            store.add_financial_info('1', statement, 'A-2', datetime(2020, 8, 1),
+                                     new_financial_info(period_end, months, value))
+    return store
+
+
+def test_newer_filing_wins(tmp_path):
+    store = new_store(tmp_path)
+    # restated by a later filing, then an older filing is parsed again
+    store.add_financial_info('1', 'balance_sheet', 'A-3', datetime(2021, 8, 1),
+                             new_financial_info(datetime(2019, 6, 30), None, 11.0))
+    store.add_financial_info('1', 'balance_sheet', 'A-1', datetime(2019, 8, 1),
+                             new_financial_info(datetime(2019, 6, 30), None, 9.0))
+
+    column = store.get_columns('1', date(2019, 6, 30), date(2019, 6, 30))[
+        ('balance_sheet', date(2019, 6, 30), None)]
+    fact = column.map['us-gaap_Assets']
+    assert (fact.values, fact.accession) == ([11.0], 'A-3')
+
+
+def test_report_from_comparative_column(tmp_path):
+    store = new_store(tmp_path)
+
+    report = Report.from_store(store, '1', 'quarterly', Date(2019, 3))
+    assert report.accession == 'A-2'
+    assert report.balance_sheet['Total assets'] == 10.0
+    assert report.income_statements['us-gaap_Assets'] == 10.0
+
+    # Nothing stored for the period, or the latest filing is wanted
+    assert Report.from_store(store, '1', 'quarterly', Date(2019, 4)) is None
+    assert Report.from_store(store, '1', 'quarterly', Date(2020, 0)) is None
+    assert Report.from_store(store, '1', 'annual', Date(2020, 0)) is None
+
+
+def test_configured(tmp_path, monkeypatch):
+    monkeypatch.delenv('THINGY_FACT_STORE', raising=False)
+    assert FactStore.configured().path == ':memory:'
+    monkeypatch.setenv('THINGY_FACT_STORE', str(tmp_path / 'facts.sqlite'))
+    assert FactStore.configured().path == str(tmp_path / 'facts.sqlite')
+
+
+def test_many_ciks(tmp_path):
+    store = new_store(tmp_path)
+    store.add_companies([('1', 'COMPANY 1', '1311', '1231', date(2020, 8, 1))])
+    # More CIKs than SQLite takes parameters (see MAX_VARIABLES)
+    ciks = [str(cik) for cik in range(2000, 0, -1)]
+    assert list(store.get_companies(ciks)) == ['1']
+    assert {row[0] for row in store.get_datapoints(ciks, date(2020, 6, 30), date(2020, 6, 30))} == {'1'}
+    assert list(store.get_columns_many(ciks, date(2020, 6, 30), date(2020, 6, 30))) == ['1']
+
+
+def test_fiscal_period_end_window():
+    # Calendar fiscal years pick the same period end as the calendar window
+    assert Date(2020, 3).period_end_window('quarterly', '1231') == (date(2020, 6, 23), date(2020, 7, 7))
+    assert Date(2020, 0).period_end_window('annual', '1231') == (date(2019, 12, 24), date(2020, 1, 7))
+    # Fiscal years ending in January, February and October
+    assert Date(2020, 3).period_end_window('quarterly', '0131') == (date(2020, 7, 24), date(2020, 8, 7))
+    assert Date(2020, 3).period_end_window('quarterly', '0228') == (date(2020, 5, 21), date(2020, 6, 4))
+    assert Date(2020, 1).period_end_window('quarterly', '0131') == (date(2020, 1, 24), date(2020, 2, 7))
+    assert Date(2020, 0).period_end_window('annual', '1031') == (date(2020, 10, 24), date(2020, 11, 7))
+    # Unknown fiscal year ends fall back to calendar quarters
+    assert Date(2020, 3).period_end_window('quarterly', None) == (date(2020, 4, 1), date(2020, 6, 30))
+    assert Date(2020, 3).period_end_window('quarterly', '') == (date(2020, 4, 1), date(2020, 6, 30))
+
+
+def add_filing(store, cik, accession, date_filed, period_end, months, value):
+    for statement, statement_months in (('balance_sheet', None), ('cash_flow', months),
+                                        ('income_statements', months)):
+        store.add_financial_info(cik, statement, accession, date_filed,
+                                 new_financial_info(period_end, statement_months, value))
+
+
+def test_report_of_non_calendar_filer(tmp_path):
+    store = FactStore(str(tmp_path / 'facts.sqlite'))
+    # A retailer whose fiscal year ends in January: its 2020Q3 filing is the
+    # one of the quarter ended in July, not April
+    store.add_companies([('2', 'RETAILER', '5311', '0131', date(2020, 9, 1))])
+    add_filing(store, '2', 'B-1', datetime(2020, 6, 1), datetime(2020, 4, 30), 3, 1.0)
+    add_filing(store, '2', 'B-2', datetime(2020, 9, 1), datetime(2020, 7, 31), 3, 2.0)
+
+    report = Report.from_store(store, '2', 'quarterly', Date(2020, 3))
+    assert (report.accession, report.balance_sheet['Total assets']) == ('B-2', 2.0)
+    report = Report.from_store(store, '2', 'quarterly', Date(2020, 2))
+    assert (report.accession, report.balance_sheet['Total assets']) == ('B-1', 1.0)
+
+    # Without a companies row the fiscal year end comes from the annual columns
+    add_filing(store, '3', 'C-1', datetime(2019, 12, 20), datetime(2019, 10, 31), 12, 1.0)
+    add_filing(store, '3', 'C-2', datetime(2020, 12, 18), datetime(2020, 10, 31), 12, 2.0)
+    assert store.get_fiscal_year_ends(['2', '3', '4']) == {'2': '0131', '3': '1031'}
+
+    report = Report.from_store(store, '3', 'annual', Date(2020, 0))
+    assert (report.accession, report.balance_sheet['Total assets']) == ('C-2', 2.0)
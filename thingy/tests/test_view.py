@@ -0,0 +1,71 @@
+import os
+import lxml.objectify
+import mako.runtime
+from mako.template import Template
+from thingy.collections import Date
+from thingy.metric_handlers import Fact, Ratio
+from thingy.state import State, ResultKey
+from thingy.view import build_view
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'templates', 'template.html.mako')
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+def new_state():
+    state = State()
+    state.metadata.symbols = ['AAA', 'BBB']
+    state.metadata.dates = {'quarterly': [Date(2020, 1), Date(2020, 2)]}
+    state.metadata.facts['Assets'] = [Fact(lxml.objectify.fromstring('<fact id="assets"/>'))]
+    state.metadata.ratios['Liquidity'] = [Ratio(lxml.objectify.fromstring(
+        '<ratio id="current">Assets over assets<compute source.a="assets" source.b="assets"/></ratio>'))]
+    for quarter, assets in ((1, 1000.0), (2, 1500.5)):
+        state.result[ResultKey('quarterly', 'AAA', 2020, quarter)].facts['assets'] = assets
+        state.result[ResultKey('quarterly', 'AAA', 2020, quarter)].ratios['current'] = Ratio.Metric(assets, 2.0, assets / 2)
+    # BBB only has an older cell
+    state.result[ResultKey('quarterly', 'BBB', 2020, 1)].facts['assets'] = 10.0
+    return state
+
+
+def test_build_view():
+    view = build_view(new_state())
+    assert [period.period for period in view.periods] == ['quarterly']
+
+    (fact_table,) = view.periods[0].fact_tables
+    aaa, bbb = fact_table.rows
+    assert (aaa.cells[0].value, aaa.cells[0].sparkline) == ('$1,500.5', '1000,1500')
+    assert (bbb.cells[0].value, bbb.cells[0].sparkline) == ('', '10')
+
+    (ratio_table,) = view.periods[0].ratio_tables
+    aaa, bbb = ratio_table.rows
+    assert (aaa.cells[0].ratio, aaa.cells[0].pie, aaa.cells[0].sparkline) == (
+        '750.25', '1500.5, 2.0', '1000.0:2.0,1500.5:2.0')
+    assert (bbb.cells[0].ratio, bbb.cells[0].sparkline) == ('', '')
+
+
+def test_build_view_does_not_add_results():
+    state = new_state()
+    build_view(state)
+    assert ResultKey('quarterly', 'BBB', 2020, 2) not in state.result
+
+
+def test_fallbacks_are_listed(tmp_path):
+    state = new_state()
+    state.result[ResultKey('quarterly', 'AAA', 2020, 2)].provider = 'market_watch'
+    state.result[ResultKey('quarterly', 'AAA', 2020, 2)].fallback = 'edgar: No filing info found.'
+    (cell,) = build_view(state).fallbacks
+    assert (cell.symbol, cell.period, cell.date, cell.provider, cell.reason) == (
+        'AAA', 'Quarterly', '2020Q2', 'market_watch', 'edgar: No filing info found.')
+    assert '<h1>Other sources</h1>' in Template(filename=TEMPLATE_PATH).render(view=build_view(state))
+    assert '<h1>Other sources</h1>' not in Template(filename=TEMPLATE_PATH).render(view=build_view(new_state()))
+
+
+def test_streaming_render_matches(tmp_path):
+    template = Template(filename=TEMPLATE_PATH)
+    view = build_view(new_state())
+    target = tmp_path / 'report.html'
+    with open(target, 'w') as f:
+        template.render_context(mako.runtime.Context(f, view=view))
+    assert target.read_text() == template.render(view=view)
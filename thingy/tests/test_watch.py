@@ -0,0 +1,130 @@
+import os
+import datetime
+import pytest
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date
+from thingy.edgar.edgar import get_daily_index_path, parse_master_index
+from thingy.providers import EdgarProvider, ProviderRegistry
+from thingy.state import ResultKey
+from thingy.tests.doubles import SyntheticStock, new_engine
+from thingy.watch import Change, Cursor, DailyIndex, LocalDailyIndex, Watcher
+
+HEADER = '''Description:           Daily Index of EDGAR Dissemination Feed by Company Name
+Last Data Received:    Nov 3, 2020
+Comments:              webmaster@sec.gov
+Anonymous FTP:         ftp://ftp.sec.gov/edgar/
+
+
+
+
+CIK|Company Name|Form Type|Date Filed|File Name
+--------------------------------------------------------------------------------
+'''
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+class SyntheticEdgarProvider(EdgarProvider):
+    def __init__(self, symbols_path: str, submission: str, accession: str):
+        super().__init__(symbols_path, rate=None)
+        self.submission = submission
+        self.accession = accession
+
+    def get_stock(self, symbol: str) -> SyntheticStock:
+        return SyntheticStock(symbol, self.submission, self.accession)
+
+
+def write_index(root, day: datetime.date, rows: list[str]):
+    path = os.path.join(root, get_daily_index_path(day))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(HEADER + ''.join(f'{row}\n' for row in rows))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    symbols_path = tmp_path / 'symbols.csv'
+    symbols_path.write_text('cik,symbol\n1,SYN\n')
+    spec = SubmissionSpec()
+    provider = SyntheticEdgarProvider(str(symbols_path), generate_submission(spec), spec.accession)
+    return new_engine(tmp_path, ProviderRegistry([provider]), ['SYN']).execute(
+        {'quarterly': [Date(2020, 3), Date(2020, 4)]})
+
+
+def test_parse_master_index():
+    filing_infos = parse_master_index(HEADER + (
+        '1|SYNTHETIC INC|10-Q|20201103|edgar/data/1/0000000001-20-000002.txt\n'
+        '2|OTHER CORP|8-K|20201103|edgar/data/2/0000000002-20-000001.txt\n'), ['10-Q'])
+    assert [(info.cik, info.form, info.date_filed, info.accession) for info in filing_infos] == [
+        ('1', '10-Q', '2020-11-03', '0000000001-20-000002')]
+
+
+def test_get_daily_index_path():
+    assert get_daily_index_path(datetime.date(2020, 11, 3)) == '2020/QTR4/master.20201103.idx'
+
+
+def test_daily_index_is_abstract():
+    class NoIndex(DailyIndex):
+        pass
+
+    with pytest.raises(TypeError):
+        NoIndex()
+
+
+def test_change_dates():
+    quarterly, annual = parse_master_index(HEADER + (
+        '1|SYNTHETIC INC|10-Q|20201103|edgar/data/1/0000000001-20-000002.txt\n'
+        '1|SYNTHETIC INC|10-K/A|20210215|edgar/data/1/0000000001-21-000001.txt\n'))
+    assert Change.new('SYN', quarterly) == Change('SYN', 'quarterly', Date(2020, 4), quarterly)
+    assert Change.new('SYN', annual) == Change('SYN', 'annual', Date(2021, 0), annual)
+
+
+def test_watch(engine, tmp_path):
+    index_path = str(tmp_path / 'daily-index')
+    cursor_path = str(tmp_path / 'watch.json')
+    day = datetime.date(2020, 11, 3)
+    write_index(index_path, day, [
+        '1|SYNTHETIC INC|10-Q|20201103|edgar/data/1/0000000001-20-000002.txt',
+        '1|SYNTHETIC INC|8-K|20201103|edgar/data/1/0000000001-20-000003.txt',
+        '2|OTHER CORP|10-Q|20201103|edgar/data/2/0000000002-20-000001.txt',
+    ])
+    updates = list()
+    watcher = Watcher(engine, LocalDailyIndex(index_path), cursor_path,
+                      start=datetime.date(2020, 11, 2), on_update=updates.append)
+
+    applied = watcher.update(today=datetime.date(2020, 11, 4))
+    assert [(change.symbol, change.period, change.date) for change in applied] == [
+        ('SYN', 'quarterly', Date(2020, 4))]
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2020, 4)].accession == '0000000001-20-000002'
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2020, 3)].accession == '0000000001-20-000001'
+    assert updates == [engine]
+    assert Cursor.load(cursor_path).day == day
+
+    # Nothing new: the index is not modified
+    assert watcher.update(today=datetime.date(2020, 11, 5)) == []
+    assert len(updates) == 1
+
+    # The index gained a row: only the new filing is applied
+    write_index(index_path, day, [
+        '1|SYNTHETIC INC|10-Q|20201103|edgar/data/1/0000000001-20-000002.txt',
+        '1|SYNTHETIC INC|10-Q/A|20201103|edgar/data/1/0000000001-20-000004.txt',
+    ])
+    os.utime(os.path.join(index_path, get_daily_index_path(day)), ns=(1, 1))
+    applied = watcher.update(today=datetime.date(2020, 11, 5))
+    assert [change.filing_info.accession for change in applied] == ['0000000001-20-000004']
+    assert engine.context.result[ResultKey('quarterly', 'SYN', 2020, 4)].accession == '0000000001-20-000004'
+
+    # A restarted watcher carries on from the cursor
+    restarted = Watcher(engine, LocalDailyIndex(index_path), cursor_path)
+    assert restarted.poll(today=datetime.date(2020, 11, 5))[0] == []
+
+
+def test_watch_skips_dates_not_compared(engine, tmp_path):
+    index_path = str(tmp_path / 'daily-index')
+    day = datetime.date(2021, 2, 15)
+    write_index(index_path, day, ['1|SYNTHETIC INC|10-K|20210215|edgar/data/1/0000000001-21-000001.txt'])
+    watcher = Watcher(engine, LocalDailyIndex(index_path), str(tmp_path / 'watch.json'), start=day)
+    assert watcher.update(today=day) == []
+    assert ResultKey('annual', 'SYN', 2021, 0) not in engine.context.result
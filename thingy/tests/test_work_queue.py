@@ -0,0 +1,129 @@
+import time
+import threading
+from benchmarks.synthetic import SubmissionSpec, generate_submission
+from thingy.collections import Date
+from thingy.edgar.stock import NoFilingInfoException
+from thingy.negative_cache import NO_FILING
+from thingy.providers import ProviderRegistry
+from thingy.state import ResultKey
+from thingy.work_queue import WorkQueue, Worker, merge, DONE, DEAD, PENDING
+from thingy.tests.doubles import SyntheticProvider, new_engine
+
+DATES = {'quarterly': [Date(2020, 2), Date(2020, 3)]}
+
+
+def setup_module(module):
+    print('setup_module      module:%s' % module.__name__)
+
+
+class GappyProvider(SyntheticProvider):
+    '''No filing of DEF for 2020Q2'''
+
+    def resolve(self, symbol, period, date):
+        if (symbol, date) == ('DEF', Date(2020, 2)):
+            raise NoFilingInfoException('No filing info found.')
+        return super().resolve(symbol, period, date)
+
+
+def new_providers() -> ProviderRegistry:
+    spec = SubmissionSpec()
+    return ProviderRegistry([GappyProvider(generate_submission(spec), spec.accession)])
+
+
+def test_submit_and_claim(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease=60)
+    assert queue.submit('job', ['SYN', 'ABC'], DATES) == 4
+    assert queue.submit('job', ['SYN', 'ABC'], DATES) == 0
+    assert queue.job('job') == (['SYN', 'ABC'], DATES)
+
+    first = queue.claim('job', 'a', limit=3)
+    second = queue.claim('job', 'b', limit=3)
+    assert len(first) == 3 and len(second) == 1
+    assert not {task.id for task in first} & {task.id for task in second}
+    assert queue.claim('job', 'c') == []
+
+    # Only the lease holder may complete a task
+    assert not queue.complete(second[0], 'a', None)
+    assert queue.complete(second[0], 'b', None)
+    assert queue.stats('job') == {'leased': 3, DONE: 1}
+
+
+def test_lease_expiry_and_dead_letter(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease=-1, max_attempts=2, retry_delay=0)
+    queue.submit('job', ['SYN'], {'quarterly': [Date(2020, 3)]})
+
+    # The worker died: its lease runs out and the task is handed out again
+    task, = queue.claim('job', 'a')
+    retried, = queue.claim('job', 'b')
+    assert retried.id == task.id and retried.attempts == 2
+    assert not queue.complete(task, 'a', None)
+
+    # Failing max_attempts times dead-letters it
+    assert queue.fail(retried, 'b', 'ValueError()')
+    assert queue.stats('job') == {DEAD: 1}
+    assert queue.errors('job') == [(ResultKey('quarterly', 'SYN', 2020, 3), DEAD, 'ValueError()')]
+    assert queue.claim('job', 'c') == []
+
+    assert queue.requeue('job') == 1
+    assert queue.stats('job') == {PENDING: 1}
+
+
+def test_fail_retries_later(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), retry_delay=3600)
+    queue.submit('job', ['SYN'], {'quarterly': [Date(2020, 3)]})
+    task, = queue.claim('job', 'a')
+    assert queue.fail(task, 'a', 'timeout')
+    assert queue.stats('job') == {PENDING: 1}
+    assert queue.claim('job', 'a') == []
+
+
+def test_lease_renewed_while_running(logic, tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease=0.3)
+    queue.submit('job', ['SYN'], {'quarterly': [Date(2020, 3)]})
+    engine = new_engine(tmp_path, new_providers(), (), logic=logic)
+    execute = engine.execute
+    claimed = list()
+
+    def slow_execute(dates):
+        time.sleep(1)  # a few leases long
+        claimed.extend(queue.claim('job', 'other'))
+        return execute(dates)
+
+    engine.execute = slow_execute
+    worker = Worker(queue, 'job', engine, name='slow')
+    task, = queue.claim('job', worker.name)
+    worker.run_task(task)
+    assert claimed == []
+    assert worker.stats == {'done': 1}
+    assert queue.stats('job') == {DONE: 1}
+
+
+def test_workers_and_merge(logic, tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    symbols = ['SYN', 'ABC', 'DEF']
+    WorkQueue(path).submit('job', symbols, DATES)
+
+    workers = [Worker(WorkQueue(path), 'job', new_engine(tmp_path, new_providers(), (), f'worker-{n}', logic),
+                      name=f'worker-{n}', batch_size=1)
+               for n in range(2)]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(worker.stats['done'] for worker in workers) == 6
+    queue = WorkQueue(path)
+    assert queue.stats('job') == {DONE: 6}
+
+    merged = merge(queue, 'job', logic)
+    expected = new_engine(tmp_path, new_providers(), symbols, 'expected', logic).execute(DATES)
+    assert merged.context.metadata.symbols == symbols
+    assert dict(merged.context.result) == dict(expected.context.result)
+    assert ({accession: sorted(keys, key=str) for accession, keys in merged.context.filings.items()}
+            == {accession: sorted(keys, key=str) for accession, keys in expected.context.filings.items()})
+    # The cell without a filing is listed as skipped, as in the run
+    missing = ResultKey('quarterly', 'DEF', 2020, 2)
+    assert list(merged.context.skipped) == list(expected.context.skipped) == [missing]
+    assert merged.context.skipped[missing].reason == NO_FILING
+    assert merged.context.skipped[missing].detail == expected.context.skipped[missing].detail
@@ -0,0 +1,208 @@
+'''
+View model for the report template
+
+Everything the template shows is computed and formatted in one pass over the
+results, so the template only iterates over rows of plain strings. Rows are
+only built as the template gets to them, so that together with a streaming
+render (see Engine.write) a report is never held in memory as a whole.
+Cells missing from the results (e.g. no filing was found) are left empty,
+and those skipped as having nothing to compare are listed with the reason.
+So are cells answered by a fallback provider, as they mix sources.
+'''
+from __future__ import annotations
+import os
+import datetime
+import functools
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, TextIO
+from thingy.metric_handlers import Fact, Ratio
+from thingy.state import State, ResultKey, ResultValue
+
+if TYPE_CHECKING:
+    from mako.template import Template
+
+PERIODS = ('quarterly', 'annual')
+
+# Compiled templates are cached here, so they are only compiled once
+TEMPLATE_CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'mako')
+
+
+@dataclass
+class FactCell:
+    value: str
+    sparkline: str
+
+
+@dataclass
+class RatioCell:
+    ratio: str
+    pie: str
+    sparkline: str
+
+
+@dataclass
+class Row:
+    symbol: str
+    cells: list
+
+
+class LazyRows:
+    '''Rows built anew, on demand, every time they are iterated over'''
+
+    def __init__(self, factory: Callable[[], Iterable[Row]]):
+        self._factory = factory
+
+    def __iter__(self) -> Iterator[Row]:
+        return iter(self._factory())
+
+
+@dataclass
+class FactTable:
+    group: str
+    facts: list[Fact]
+    rows: LazyRows
+
+
+@dataclass
+class RatioTable:
+    group: str
+    ratios: list[Ratio]
+    rows: LazyRows
+
+
+@dataclass
+class PeriodView:
+    period: str
+    title: str
+    fact_tables: list[FactTable]
+    ratio_tables: list[RatioTable]
+
+
+@dataclass
+class SkippedCell:
+    symbol: str
+    period: str
+    date: str
+    reason: str
+    detail: str
+    until: str                  # when the cell will be tried again
+
+
+@dataclass
+class FallbackCell:
+    symbol: str
+    period: str
+    date: str
+    provider: str
+    reason: str                 # why the preferred providers failed
+
+
+@dataclass
+class ReportView:
+    symbols: list[str]
+    periods: list[PeriodView]
+    generated: str
+    skipped: list[SkippedCell] = field(default_factory=list)
+    fallbacks: list[FallbackCell] = field(default_factory=list)
+
+
+def load_template(filename: str) -> Template:
+    from mako.template import Template
+    return Template(filename=filename, module_directory=TEMPLATE_CACHE_PATH)
+
+
+def render(template: Template, state: State, stream: TextIO):
+    '''Render the report of state, writing it to stream as it is rendered'''
+    import mako.runtime
+    template.render_context(mako.runtime.Context(stream, view=build_view(state)))
+
+
+def build_view(state: State) -> ReportView:
+    metadata = state.metadata
+    return ReportView(
+        symbols=list(metadata.symbols),
+        periods=[build_period(state, period) for period in PERIODS if period in metadata.dates],
+        generated=datetime.datetime.now().isoformat(),
+        skipped=build_skipped(state),
+        fallbacks=build_fallbacks(state))
+
+
+def sorted_keys(state: State, keys: Iterable[ResultKey]) -> list[ResultKey]:
+    '''keys in report order: by period, symbol, then date'''
+    symbols = {symbol: position for position, symbol in enumerate(state.metadata.symbols)}
+    return sorted(keys, key=lambda key: (PERIODS.index(key.period) if key.period in PERIODS else len(PERIODS),
+                                         symbols.get(key.symbol, len(symbols)), key.year, key.quarter))
+
+
+def format_date(key: ResultKey) -> str:
+    return f'{key.year}Q{key.quarter}' if key.quarter else str(key.year or 'latest')
+
+
+def build_skipped(state: State) -> list[SkippedCell]:
+    return [SkippedCell(
+        symbol=key.symbol,
+        period=key.period.title(),
+        date=format_date(key),
+        reason=(miss := state.skipped[key]).reason.replace('_', ' '),
+        detail=miss.detail,
+        until=datetime.datetime.fromtimestamp(miss.expires).date().isoformat())
+        for key in sorted_keys(state, state.skipped)]
+
+
+def build_fallbacks(state: State) -> list[FallbackCell]:
+    return [FallbackCell(
+        symbol=key.symbol,
+        period=key.period.title(),
+        date=format_date(key),
+        provider=(result := state.result[key]).provider,
+        reason=result.fallback)
+        for key in sorted_keys(state, (key for key, result in state.result.items() if result.fallback))]
+
+
+def build_period(state: State, period: str) -> PeriodView:
+    metadata = state.metadata
+    dates = metadata.dates[period]
+
+    # Results of each symbol, in date order, looked up once
+    series = {
+        symbol: [value for date in dates
+                 if (value := state.result.get(ResultKey(period, symbol, date.year, date.quarter))) is not None]
+        for symbol in metadata.symbols}
+    latest = {
+        symbol: state.result.get(ResultKey(period, symbol, dates[-1].year, dates[-1].quarter))
+        for symbol in metadata.symbols}
+
+    return PeriodView(
+        period=period,
+        title=period.title(),
+        fact_tables=[
+            FactTable(group, facts, LazyRows(functools.partial(
+                build_rows, fact_cell, facts, metadata.symbols, latest, series)))
+            for group, facts in metadata.facts.items()],
+        ratio_tables=[
+            RatioTable(group, ratios, LazyRows(functools.partial(
+                build_rows, ratio_cell, ratios, metadata.symbols, latest, series)))
+            for group, ratios in metadata.ratios.items()])
+
+
+def build_rows(build_cell: Callable, columns: list, symbols: list[str],
+               latest: dict[str, Optional[ResultValue]], series: dict[str, list[ResultValue]]) -> Iterator[Row]:
+    for symbol in symbols:
+        yield Row(symbol, [build_cell(column, latest[symbol], series[symbol]) for column in columns])
+
+
+def fact_cell(fact: Fact, latest: Optional[ResultValue], series: list[ResultValue]) -> FactCell:
+    value = latest.facts.get(fact.id) if latest is not None else None
+    return FactCell(
+        value='' if value is None else f'${value:,}',
+        sparkline=','.join(str(int(result.facts[fact.id]))
+                           for result in series if fact.id in result.facts))
+
+
+def ratio_cell(ratio: Ratio, latest: Optional[ResultValue], series: list[ResultValue]) -> RatioCell:
+    metric = latest.ratios.get(ratio.id) if latest is not None else None
+    return RatioCell(
+        ratio='' if metric is None else f'{metric.ratio:.2f}',
+        pie='' if metric is None else f'{metric.a}, {metric.b}',
+        sparkline=','.join(f'{result.ratios[ratio.id].a}:{result.ratios[ratio.id].b}'
+                           for result in series if ratio.id in result.ratios))
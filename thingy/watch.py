@@ -0,0 +1,285 @@
+'''
+Watch mode: keep the results of a comparison up to date as filings come out
+
+Rather than re-running a whole comparison, EDGAR's daily index is polled
+(with conditional requests, so an unchanged index costs a 304) and new
+10-Q/10-K filings (and their amendments) of the companies being compared are
+matched against their CIKs. Only the cells those filings answer are
+recomputed, after which the report and/or export are rewritten:
+
+    python -m thingy.watch XOM CVX --quarterly 2020Q3 2020Q4 --annual 2020 \\
+        --report report.html --export results.parquet --interval 3600
+
+A new filing answers the cell of the quarter it was filed in (or of its year
+for 10-Ks), the same way the EDGAR provider resolves cells, if that date is
+part of the comparison.
+
+The last daily index processed, its ETag and the filings already seen in it
+are kept in a cursor file, so restarts carry on where they left off.
+LocalDailyIndex serves indexes from a directory laid out like
+edgar/daily-index, e.g. to test offline or replay a mirror.
+'''
+from __future__ import annotations
+import os
+import abc
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import dataclasses
+from typing import Callable, Optional
+from thingy import log
+from thingy.collections import Date
+from thingy.edgar.edgar import DAILY_INDEX_URL, FINANCIAL_FORM_MAP, FilingInfo, \
+    get_daily_index_path, parse_master_index
+from thingy.edgar.requests_wrapper import GetRequest, RequestException
+from thingy.edgar.store import FactStore
+from thingy.engine import Engine
+from thingy.providers import EdgarProvider
+
+logger = logging.getLogger(__name__)
+
+CURSOR_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'watch.json')
+PERIODS = {form: period for period, forms in FINANCIAL_FORM_MAP.items() for form in forms}
+INTERVAL = 3600
+
+
+@dataclasses.dataclass
+class IndexResponse:
+    text: Optional[str]  # None when not modified
+    etag: Optional[str]
+
+
+class DailyIndex(abc.ABC):
+    @abc.abstractmethod
+    def fetch(self, day: datetime.date, etag: Optional[str] = None) -> Optional[IndexResponse]:
+        '''
+        The master index of day, or None if there is none (yet); its text is
+        None if its ETag still is etag
+        '''
+
+
+class EdgarDailyIndex(DailyIndex):
+    def __init__(self, base_url: str = DAILY_INDEX_URL):
+        self.base_url = base_url
+
+    def fetch(self, day: datetime.date, etag: Optional[str] = None) -> Optional[IndexResponse]:
+        url = self.base_url + get_daily_index_path(day)
+        try:
+            # Not cached: the HTTP cache would keep answering with a stale index
+            request = GetRequest(url, cache=False, headers={'If-None-Match': etag} if etag else None)
+        except RequestException as e:
+            if e.status_code in (403, 404):  # not published (yet), or not a business day
+                return None
+            raise
+        response = request.response
+        return IndexResponse(None if request.not_modified else response.text,
+                             response.headers.get('ETag', etag))
+
+
+class LocalDailyIndex(DailyIndex):
+    '''Daily indexes from a directory laid out like edgar/daily-index'''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def fetch(self, day: datetime.date, etag: Optional[str] = None) -> Optional[IndexResponse]:
+        path = os.path.join(self.root, get_daily_index_path(day))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        current = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        if current == etag:
+            return IndexResponse(None, etag)
+        with open(path, encoding='latin-1') as f:
+            return IndexResponse(f.read(), current)
+
+
+@dataclasses.dataclass
+class Cursor:
+    '''The last daily index processed'''
+    day: datetime.date
+    etag: Optional[str] = None
+    accessions: list[str] = dataclasses.field(default_factory=list)  # seen in that index
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Cursor]:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(datetime.date.fromisoformat(data['day']), data['etag'], data['accessions'])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'day': self.day.isoformat(), 'etag': self.etag, 'accessions': self.accessions}, f)
+        os.replace(f'{path}.tmp', path)
+
+
+@dataclasses.dataclass(frozen=True)
+class Change:
+    '''A new filing, and the cell it answers'''
+    symbol: str
+    period: str
+    date: Date
+    filing_info: FilingInfo = dataclasses.field(compare=False)
+
+    @classmethod
+    def new(cls, symbol: str, filing_info: FilingInfo) -> Change:
+        period = PERIODS[filing_info.form]
+        filed = datetime.date.fromisoformat(filing_info.date_filed)
+        quarter = 0 if period == 'annual' else (filed.month - 1) // 3 + 1
+        return cls(symbol, period, Date(filed.year, quarter), filing_info)
+
+
+class Watcher:
+    def __init__(self, engine: Engine, index: Optional[DailyIndex] = None, cursor_path: str = CURSOR_PATH,
+                 start: Optional[datetime.date] = None, on_update: Optional[Callable[[Engine], None]] = None):
+        '''
+        :param engine: an engine whose execute() has been run
+        :param start: first day to look at when there is no cursor yet
+            (default: today)
+        :param on_update: called once cells have been recomputed, e.g. to
+            rewrite the report
+        '''
+        self.engine = engine
+        self.index = EdgarDailyIndex() if index is None else index
+        self.cursor_path = cursor_path
+        self.cursor = Cursor.load(cursor_path) or Cursor(start or datetime.date.today())
+        self.on_update = on_update
+        try:
+            self.provider = next(provider for provider in engine.providers if isinstance(provider, EdgarProvider))
+        except StopIteration:
+            raise ValueError('Watching needs an EdgarProvider') from None
+
+    @property
+    def tracked(self) -> dict[str, list[str]]:
+        '''cik -> symbols being compared'''
+        tracked = dict()
+        for symbol in self.engine.symbols:
+            if (cik := self.provider.cik(symbol)) is not None:
+                tracked.setdefault(cik, []).append(symbol)
+        return tracked
+
+    def poll(self, today: Optional[datetime.date] = None) -> tuple[list[Change], Cursor]:
+        '''
+        New filings in the daily indexes from the cursor up to today, and the
+        cursor to carry on from once they have been processed
+        '''
+        today = today or datetime.date.today()
+        tracked = self.tracked
+        cursor = self.cursor
+        changes = list()
+
+        day = cursor.day
+        while day <= today:
+            same_day = day == cursor.day
+            response = self.index.fetch(day, cursor.etag if same_day else None)
+            if response is not None:
+                if response.text is not None:
+                    seen = set(cursor.accessions) if same_day else set()
+                    for filing_info in parse_master_index(response.text, list(PERIODS)):
+                        if filing_info.cik in tracked and filing_info.accession not in seen:
+                            seen.add(filing_info.accession)
+                            changes.extend(Change.new(symbol, filing_info) for symbol in tracked[filing_info.cik])
+                    cursor = Cursor(day, response.etag, sorted(seen))
+                else:
+                    logger.debug('Daily index of %s not modified', day, extra={'stage': 'watch'})
+            day += datetime.timedelta(days=1)
+
+        return changes, cursor
+
+    def apply(self, changes: list[Change]) -> list[Change]:
+        '''Recompute the cells answered by changes; returns the changes applied'''
+        applied = list()
+        dates = self.engine.context.metadata.dates
+        for change in changes:
+            if change.date not in dates.get(change.period, ()):
+                logger.info('%s filed %s for %s, which is not being compared', change.symbol,
+                            change.filing_info.form, change.date,
+                            extra={'symbol': change.symbol, 'accession': change.filing_info.accession,
+                                   'stage': 'watch'})
+                continue
+            logger.info('%s filed %s, recomputing %s %dQ%d', change.symbol, change.filing_info.form,
+                        change.period, change.date.year, change.date.quarter,
+                        extra={'symbol': change.symbol, 'accession': change.filing_info.accession,
+                               'stage': 'watch'})
+            self.engine.recompute(change.period, change.symbol, change.date,
+                                  filing=(self.provider, change.filing_info))
+            applied.append(change)
+        return applied
+
+    def update(self, today: Optional[datetime.date] = None) -> list[Change]:
+        '''Poll, recompute what changed and move the cursor on'''
+        changes, cursor = self.poll(today)
+        applied = self.apply(changes)
+        if applied and self.on_update is not None:
+            self.on_update(self.engine)
+        self.cursor = cursor
+        cursor.save(self.cursor_path)
+        return applied
+
+    def run(self, interval: float = INTERVAL):
+        while True:
+            self.update()
+            time.sleep(interval)
+
+
+def main(argv: list[str] = None) -> int:
+    from thingy import snapshot
+    from thingy.service import parse_date
+    from thingy.view import load_template
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--quarterly', nargs='*', default=[], type=parse_date, metavar='YYYYQN')
+    parser.add_argument('--annual', nargs='*', default=[], type=parse_date, metavar='YYYY')
+    parser.add_argument('--report', help='HTML report to keep up to date')
+    parser.add_argument('--export', help='export (see thingy.export) to keep up to date')
+    parser.add_argument('--template', default=os.path.join(snapshot.ROOT_PATH, 'templates', 'template.html.mako'))
+    parser.add_argument('--cursor', default=CURSOR_PATH)
+    parser.add_argument('--store', help='fact store to keep across runs (default: THINGY_FACT_STORE, else none)')
+    parser.add_argument('--companyfacts', metavar='SOURCE',
+                        help="companyfacts documents (a directory or companyfacts.zip, or 'sec' to download them) "
+                             'to answer cells from ahead of EDGAR')
+    parser.add_argument('--index', help='directory of daily indexes to use instead of EDGAR')
+    parser.add_argument('--start', type=datetime.date.fromisoformat, help='first day to watch (default: today)')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help='seconds between polls')
+    args = parser.parse_args(argv)
+
+    log.configure(logging.INFO)
+    dates = {period: date_list for period, date_list in (('quarterly', args.quarterly), ('annual', args.annual))
+             if date_list}
+    if not dates:
+        parser.error('at least one --quarterly or --annual date is required')
+
+    current = snapshot.load()
+    fact_store = FactStore(args.store) if args.store else FactStore.configured()
+    engine = Engine(symbols=[symbol.upper() for symbol in args.symbols], logic=current.logic,
+                    template_engine=load_template(args.template) if args.report else None,
+                    providers=current.providers(args.companyfacts), machine=current.machine,
+                    fact_store=fact_store, catalog=current.catalog(fact_store))
+
+    def write(engine: Engine):
+        if args.report:
+            engine.write(args.report)
+        if args.export:
+            engine.export(args.export)
+
+    write(engine.execute(dates))
+    watcher = Watcher(engine, LocalDailyIndex(args.index) if args.index else None, args.cursor,
+                      start=args.start, on_update=write)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,501 @@
+'''
+Durable work queue, to split a comparison across processes and hosts
+
+A job is a comparison (symbols and dates) split into one task per
+(period, symbol, date) cell, kept in a SQLite file; no broker is needed, and
+workers on other hosts only need to share the filesystem. Workers lease
+tasks, compute their cell with their own Engine and write the ResultValue
+back, or the Miss the cell was skipped for. A task whose lease runs out (its
+worker died) is handed out again; a task failing max_attempts times is
+dead-lettered, for requeue() once the problem is fixed. Once every task is
+finished, merge() gathers the results into an Engine, ready to write() or
+export():
+
+    python -m thingy.work_queue submit oil XOM CVX SM --quarterly 2020Q3 2020Q4 --annual 2019
+    python -m thingy.work_queue work oil --processes 4      # on as many hosts as needed
+    python -m thingy.work_queue status oil
+    python -m thingy.work_queue merge oil --report oil.html --export oil.parquet
+
+Each worker process has its own providers and so its own rate limits: past
+a few processes per host, requests are throttled by the data provider
+rather than by the number of workers.
+'''
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import functools
+import threading
+import contextlib
+import dataclasses
+import multiprocessing
+from collections import Counter
+from typing import Callable, Optional
+from thingy import log
+from thingy.collections import Date
+from thingy.engine import Engine
+from thingy.metric_handlers import Ratio
+from thingy.negative_cache import Miss
+from thingy.state import ResultKey, ResultValue
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'queue.sqlite')
+
+LEASE = 300  # seconds
+HEARTBEATS = 3  # lease renewals per lease, while a task runs
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30  # seconds, doubled on every attempt
+BATCH_SIZE = 4
+
+# Task states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+DEAD = 'dead'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    symbols TEXT NOT NULL,      -- JSON list, in report order
+    dates TEXT NOT NULL,        -- JSON {period: [[year, quarter], ...]}
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL REFERENCES jobs (job),
+    period TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    quarter INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,     -- retries are delayed until then
+    worker TEXT,                            -- holding the lease
+    lease_expires REAL,
+    error TEXT,
+    result TEXT,                            -- JSON ResultValue, NULL if no filing was found
+    skipped TEXT,                           -- JSON Miss, when the cell was skipped
+    UNIQUE (job, period, symbol, year, quarter)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (job, state, not_before);
+'''
+
+
+@dataclasses.dataclass(frozen=True)
+class Task:
+    id: int
+    job: str
+    key: ResultKey
+    attempts: int
+
+    @property
+    def date(self) -> Date:
+        return Date(self.key.year, self.key.quarter)
+
+
+def dump_result(result: Optional[ResultValue]) -> Optional[str]:
+    if result is None:
+        return None
+    return json.dumps({'facts': result.facts,
+                       'ratios': {ratio_id: [metric.a, metric.b, metric.ratio]
+                                  for ratio_id, metric in result.ratios.items()},
+                       'accession': result.accession,
+                       'provider': result.provider,
+                       'fallback': result.fallback})
+
+
+def dump_skipped(miss: Optional[Miss]) -> Optional[str]:
+    if miss is None:
+        return None
+    return json.dumps(dataclasses.asdict(miss))
+
+
+def load_skipped(text: Optional[str]) -> Optional[Miss]:
+    if text is None:
+        return None
+    return Miss(**json.loads(text))
+
+
+def load_result(text: Optional[str]) -> Optional[ResultValue]:
+    if text is None:
+        return None
+    data = json.loads(text)
+    return ResultValue(facts=data['facts'],
+                       ratios={ratio_id: Ratio.Metric(*values) for ratio_id, values in data['ratios'].items()},
+                       accession=data['accession'],
+                       provider=data.get('provider'),
+                       fallback=data.get('fallback'))
+
+
+class WorkQueue:
+    def __init__(self, path: str = QUEUE_PATH, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Transactions are handled explicitly, see _WriteTransaction
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+            # Queues created before skipped cells were kept
+            if 'skipped' not in {row[1] for row in self._connection.execute('PRAGMA table_info(tasks)')}:
+                self._connection.execute('ALTER TABLE tasks ADD COLUMN skipped TEXT')
+        return self._connection
+
+    def submit(self, job: str, symbols: list[str], dates: dict[str, list[Date]]) -> int:
+        '''Add a job, returning the number of tasks added (none if it was submitted before)'''
+        tasks = [(job, period, symbol, date.year, date.quarter)
+                 for period, date_list in dates.items()
+                 for symbol in symbols
+                 for date in date_list]
+        with self._lock, self._write() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO jobs (job, symbols, dates, created) VALUES (?, ?, ?, ?)',
+                (job, json.dumps(list(symbols)),
+                 json.dumps({period: [[date.year, date.quarter] for date in date_list]
+                             for period, date_list in dates.items()}),
+                 time.time()))
+            before = connection.total_changes
+            connection.executemany(
+                'INSERT OR IGNORE INTO tasks (job, period, symbol, year, quarter) VALUES (?, ?, ?, ?, ?)', tasks)
+            return connection.total_changes - before
+
+    def job(self, job: str) -> tuple[list[str], dict[str, list[Date]]]:
+        '''The symbols and dates of a job'''
+        with self._lock:
+            row = self.connection.execute('SELECT symbols, dates FROM jobs WHERE job = ?', (job,)).fetchone()
+        if row is None:
+            raise KeyError(f'No such job: {job}')
+        return (json.loads(row[0]),
+                {period: [Date(year, quarter) for year, quarter in date_list]
+                 for period, date_list in json.loads(row[1]).items()})
+
+    def claim(self, job: str, worker: str, limit: int = 1) -> list[Task]:
+        '''
+        Lease up to limit tasks of job to worker: pending ones, and leased
+        ones whose lease has run out (dead-lettering those already tried
+        max_attempts times)
+        '''
+        now = time.time()
+        with self._lock, self._write() as connection:
+            connection.execute(
+                "UPDATE tasks SET state = ?, worker = NULL, error = 'lease expired' "
+                'WHERE job = ? AND state = ? AND lease_expires < ? AND attempts >= ?',
+                (DEAD, job, LEASED, now, self.max_attempts))
+            rows = connection.execute(
+                'SELECT id, period, symbol, year, quarter, attempts FROM tasks '
+                'WHERE job = ? AND ((state = ? AND not_before <= ?) OR (state = ? AND lease_expires < ?)) '
+                'ORDER BY id LIMIT ?',
+                (job, PENDING, now, LEASED, now, limit)).fetchall()
+            connection.executemany(
+                'UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+                [(LEASED, worker, now + self.lease, row[0]) for row in rows])
+        return [Task(id, job, ResultKey(period, symbol, year, quarter), attempts + 1)
+                for id, period, symbol, year, quarter, attempts in rows]
+
+    def extend(self, task: Task, worker: str) -> bool:
+        '''Renew the lease of task; False if worker lost it'''
+        return self._update_leased(task, worker, 'lease_expires = ?', time.time() + self.lease)
+
+    def complete(self, task: Task, worker: str, result: Optional[ResultValue],
+                 skipped: Optional[Miss] = None) -> bool:
+        '''
+        Record the result of task, or why its cell was skipped; False if
+        worker lost its lease (the result is dropped)
+        '''
+        return self._update_leased(task, worker, 'state = ?, result = ?, skipped = ?, error = NULL, worker = NULL',
+                                   DONE, dump_result(result), dump_skipped(skipped))
+
+    def fail(self, task: Task, worker: str, error: str) -> bool:
+        '''Retry task later, or dead-letter it after max_attempts'''
+        if task.attempts >= self.max_attempts:
+            return self._update_leased(task, worker, 'state = ?, error = ?, worker = NULL', DEAD, error)
+        return self._update_leased(task, worker, 'state = ?, error = ?, worker = NULL, not_before = ?',
+                                   PENDING, error, time.time() + self.retry_delay * 2 ** (task.attempts - 1))
+
+    def _update_leased(self, task: Task, worker: str, assignments: str, *args) -> bool:
+        with self._lock, self._write() as connection:
+            cursor = connection.execute(
+                f'UPDATE tasks SET {assignments} WHERE id = ? AND state = ? AND worker = ?',
+                (*args, task.id, LEASED, worker))
+            return cursor.rowcount == 1
+
+    def requeue(self, job: str) -> int:
+        '''Give dead-lettered tasks of job another max_attempts; returns how many'''
+        with self._lock, self._write() as connection:
+            return connection.execute(
+                'UPDATE tasks SET state = ?, attempts = 0, not_before = 0 WHERE job = ? AND state = ?',
+                (PENDING, job, DEAD)).rowcount
+
+    def stats(self, job: str) -> Counter:
+        '''Number of tasks of job in each state'''
+        with self._lock:
+            return Counter(dict(self.connection.execute(
+                'SELECT state, count(*) FROM tasks WHERE job = ? GROUP BY state', (job,))))
+
+    def errors(self, job: str) -> list[tuple[ResultKey, str, str]]:
+        '''(cell, state, error) of the tasks of job that failed at least once and are not done'''
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT period, symbol, year, quarter, state, error FROM tasks '
+                'WHERE job = ? AND state != ? AND error IS NOT NULL ORDER BY id', (job, DONE)).fetchall()
+        return [(ResultKey(period, symbol, year, quarter), state, error)
+                for period, symbol, year, quarter, state, error in rows]
+
+    def results(self, job: str) -> dict[ResultKey, Optional[ResultValue]]:
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT period, symbol, year, quarter, result FROM tasks WHERE job = ? AND state = ?',
+                (job, DONE)).fetchall()
+        return {ResultKey(period, symbol, year, quarter): load_result(result)
+                for period, symbol, year, quarter, result in rows}
+
+    def skipped(self, job: str) -> dict[ResultKey, Miss]:
+        '''Why the cells of the tasks of job that were skipped were'''
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT period, symbol, year, quarter, skipped FROM tasks '
+                'WHERE job = ? AND state = ? AND skipped IS NOT NULL', (job, DONE)).fetchall()
+        return {ResultKey(period, symbol, year, quarter): load_skipped(skipped)
+                for period, symbol, year, quarter, skipped in rows}
+
+    def _write(self) -> _WriteTransaction:
+        return _WriteTransaction(self.connection)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class _WriteTransaction:
+    '''
+    A write transaction taken up front (BEGIN IMMEDIATE), so that concurrent
+    workers wait on the database lock instead of failing to upgrade a read
+    '''
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+class Worker:
+    '''
+    Computes the tasks of a job, one cell at a time, with a single Engine
+    (so its caches stay warm from one task to the next)
+    '''
+
+    def __init__(self, queue: WorkQueue, job: str, engine: Engine, name: Optional[str] = None,
+                 batch_size: int = BATCH_SIZE):
+        self.queue = queue
+        self.job = job
+        self.engine = engine
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.batch_size = batch_size
+        self.stats = Counter()
+
+    @contextlib.contextmanager
+    def heartbeat(self, task: Task):
+        '''
+        Keep renewing the lease of task while it runs: a cell walking back
+        through EDGAR indexes under the rate limit may well outlast a lease
+        '''
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.queue.lease / HEARTBEATS):
+                if not self.queue.extend(task, self.name):
+                    return  # lost anyway, see run_task
+
+        thread = threading.Thread(target=beat, name=f'heartbeat-{task.id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def run_task(self, task: Task):
+        key = task.key
+        try:
+            self.engine.symbols = [key.symbol]
+            with self.heartbeat(task):
+                self.engine.execute({key.period: [task.date]})
+        except Exception as e:
+            logger.exception('Task %d failed', task.id,
+                             extra={'symbol': key.symbol, 'period': key.period, 'stage': 'work'})
+            self.stats['failed'] += 1
+            self.queue.fail(task, self.name, repr(e))
+            return
+
+        if self.queue.complete(task, self.name, self.engine.context.result.get(key),
+                               self.engine.context.skipped.get(key)):
+            self.stats['done'] += 1
+        else:
+            logger.warning('Lost the lease of task %d, dropping its result', task.id,
+                           extra={'symbol': key.symbol, 'period': key.period, 'stage': 'work'})
+            self.stats['lost'] += 1
+
+    def run(self, idle: Optional[float] = None, poll: float = 1.0) -> Counter:
+        '''
+        Work until no task is left to claim, or, with idle, until none has
+        been available for idle seconds (e.g. waiting on retries); returns
+        the number of tasks done, failed and lost
+        '''
+        waiting_since = None
+        while True:
+            tasks = self.queue.claim(self.job, self.name, self.batch_size)
+            if not tasks:
+                if idle is None:
+                    break
+                waiting_since = waiting_since or time.monotonic()
+                if time.monotonic() - waiting_since >= idle:
+                    break
+                time.sleep(poll)
+                continue
+
+            waiting_since = None
+            for task in tasks:
+                # Later tasks of the batch have been waiting on the previous ones
+                if task is tasks[0] or self.queue.extend(task, self.name):
+                    self.run_task(task)
+        return self.stats
+
+
+def merge(queue: WorkQueue, job: str, logic, template_engine=None, **engine_args) -> Engine:
+    '''
+    An Engine holding the results (and skipped cells) of job, as if it had
+    executed it; cells not done (yet) are left empty
+    '''
+    symbols, dates = queue.job(job)
+    engine = Engine(symbols=symbols, logic=logic, template_engine=template_engine, **engine_args).start(dates)
+    context = engine.context
+    for key, result in queue.results(job).items():
+        if result is None:
+            continue
+        context.result[key] = result
+        if result.accession:
+            context.filings[result.accession].append(key)
+    context.skipped.update(queue.skipped(job))
+    return engine
+
+
+def default_engine(symbols: list[str] = (), companyfacts: Optional[str] = None) -> Engine:
+    '''An Engine with the providers of the snapshot, see Snapshot.providers'''
+    from thingy import snapshot
+    from thingy.edgar.store import FactStore
+    current = snapshot.load()
+    fact_store = FactStore.configured()
+    return Engine(symbols=list(symbols), logic=current.logic, template_engine=None,
+                  providers=current.providers(companyfacts), machine=current.machine,
+                  fact_store=fact_store, catalog=current.catalog(fact_store))
+
+
+def work(path: str, job: str, idle: Optional[float] = None,
+         engine_factory: Callable[[], Engine] = default_engine) -> Counter:
+    '''Run a worker (e.g. in a child process) until the job is done'''
+    return Worker(WorkQueue(path), job, engine_factory()).run(idle=idle)
+
+
+def main(argv: list[str] = None) -> int:
+    from thingy.service import parse_date
+    from thingy.view import load_template
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queue', default=QUEUE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit')
+    submit.add_argument('job')
+    submit.add_argument('symbols', nargs='+')
+    submit.add_argument('--quarterly', nargs='*', default=[], type=parse_date, metavar='YYYYQN')
+    submit.add_argument('--annual', nargs='*', default=[], type=parse_date, metavar='YYYY')
+
+    worker = commands.add_parser('work')
+    worker.add_argument('job')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--idle', type=float, help='keep waiting this long for retries')
+    worker.add_argument('--companyfacts', metavar='SOURCE',
+                        help="companyfacts documents (a directory or companyfacts.zip, or 'sec' to download them) "
+                             'to answer cells from ahead of EDGAR')
+
+    status = commands.add_parser('status')
+    status.add_argument('job')
+
+    requeue = commands.add_parser('requeue')
+    requeue.add_argument('job')
+
+    merger = commands.add_parser('merge')
+    merger.add_argument('job')
+    merger.add_argument('--report')
+    merger.add_argument('--export')
+    merger.add_argument('--template', default=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                           'templates', 'template.html.mako'))
+
+    args = parser.parse_args(argv)
+    log.configure(logging.INFO)
+    queue = WorkQueue(args.queue)
+
+    if args.command == 'submit':
+        dates = {period: date_list for period, date_list in (('quarterly', args.quarterly),
+                                                             ('annual', args.annual)) if date_list}
+        if not dates:
+            submit.error('at least one --quarterly or --annual date is required')
+        added = queue.submit(args.job, [symbol.upper() for symbol in args.symbols], dates)
+        print(f'{args.job}: {added} tasks added')
+
+    elif args.command == 'work':
+        engine_factory = functools.partial(default_engine, companyfacts=args.companyfacts)
+        processes = [multiprocessing.Process(target=work, args=(args.queue, args.job, args.idle, engine_factory))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        print(f'{args.job}: {dict(queue.stats(args.job))}')
+
+    elif args.command == 'status':
+        print(f'{args.job}: {dict(queue.stats(args.job))}')
+        for key, state, error in queue.errors(args.job):
+            print(f'  {key.period} {key.symbol} {key.year}Q{key.quarter} ({state}): {error}')
+
+    elif args.command == 'requeue':
+        print(f'{args.job}: {queue.requeue(args.job)} tasks requeued')
+
+    elif args.command == 'merge':
+        from thingy import snapshot
+        current = snapshot.load()
+        stats = queue.stats(args.job)
+        if stats[PENDING] or stats[LEASED]:
+            logger.warning('%s is not finished: %s', args.job, dict(stats))
+        engine = merge(queue, args.job, current.logic,
+                       load_template(args.template) if args.report else None, machine=current.machine)
+        if args.report:
+            engine.write(args.report)
+        if args.export:
+            print(f'Exported {engine.export(args.export)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())